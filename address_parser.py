@@ -0,0 +1,91 @@
+import re
+
+
+# cities we deliver to: spelling variants -> canonical name, and their postcode ranges
+CITY_GAZETTEER = {
+    "leipzig": "Leipzig",
+    "halle (saale)": "Halle",
+    "halle/saale": "Halle",
+    "halle / saale": "Halle",
+    "halle an der saale": "Halle",
+    "halle saale": "Halle",
+    "halle": "Halle",
+    "dresden": "Dresden",
+}
+
+POSTCODE_RANGES = {
+    "Leipzig": (4103, 4357),
+    "Halle": (6108, 6132),
+    "Dresden": (1067, 1328),
+}
+
+_city_regex = re.compile(
+    r"(?<![\w-])(" + "|".join(re.escape(alias) for alias in sorted(CITY_GAZETTEER, key=len, reverse=True)) + r")(?![\w-])",
+    re.IGNORECASE,
+)
+_postcode_regex = re.compile(r"(?<!\d)(\d{5})(?!\d)")
+_preamble_regex = re.compile(
+    r"^\s*(my address is|the address is|address:?|deliver (it )?to|please deliver to|it'?s|i live (at|in)|ich wohne in|meine adresse ist)\s+",
+    re.IGNORECASE,
+)
+_street_number_regex = re.compile(
+    r"^(?P<street>[^\d,]*[^\W\d_][^\d,]*?)\s*(?:nr\.?\s*)?(?P<number>\d{1,4}\s?[a-zA-Z]?(?:\s?[-/]\s?\d{1,4}\s?[a-zA-Z]?)?)$",
+    re.IGNORECASE,
+)
+_number_street_regex = re.compile(
+    r"^(?P<number>\d{1,4}\s?[a-zA-Z]?)\s+(?P<street>[^\d,]*[^\W\d_][^\d,]*)$",
+    re.IGNORECASE,
+)
+
+
+def city_for_postcode(postcode: str):
+    number = int(postcode)
+    for city, (low, high) in POSTCODE_RANGES.items():
+        if low <= number <= high:
+            return city
+    return None
+
+
+def parse_address(text: str):
+    """
+    Deterministically splits the German address forms we deliver to ("Street 12A, Leipzig",
+    "Leipzig, Street 12A", "Street 12, 04109 Leipzig", "My address is Street 12A in Leipzig")
+    into (city, street, house_number). Returns None for anything else, so the caller can fall back to the LLM.
+    """
+    rest = _preamble_regex.sub("", text.strip()).strip().rstrip(".!")
+
+    city_match = _city_regex.search(rest)
+    postcode_match = _postcode_regex.search(rest)
+    city = CITY_GAZETTEER[city_match.group(1).lower()] if city_match else None
+    postcode_city = city_for_postcode(postcode_match.group(1)) if postcode_match else None
+
+    if city is None:
+        city = postcode_city
+    elif postcode_match and postcode_city != city: # postcode of another city, let the LLM sort it out
+        return None
+    if city is None:
+        return None
+
+    # remove city and postcode, along with the connecting words
+    spans = [m.span() for m in (city_match, postcode_match) if m]
+    for start, end in sorted(spans, reverse=True):
+        connector = re.search(r"\bin\s+$", rest[:start], re.IGNORECASE) # only "in" right before them, not "In den Gärten"
+        if connector:
+            start = connector.start()
+        rest = rest[:start] + " " + rest[end:]
+    rest = re.sub(r"\b(germany|deutschland)\b", " ", rest, flags=re.IGNORECASE)
+    parts = [p.strip(" .") for p in re.split(r"[,;\n]", rest)]
+    parts = [re.sub(r"\s+", " ", p) for p in parts if p]
+    if len(parts) != 1:
+        return None
+
+    match = _street_number_regex.match(parts[0]) or _number_street_regex.match(parts[0])
+    if match is None:
+        return None
+
+    street = match.group("street").strip(" .-")
+    house_number = re.sub(r"\s+", "", match.group("number"))
+    if len(street) < 3:
+        return None
+
+    return (city, street, house_number)
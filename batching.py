@@ -0,0 +1,131 @@
+import asyncio
+import threading
+import time
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent calls from threads: items submitted within `window` seconds of the first one are passed to
+    `handler` as one list (identical items once, sent early once `max_batch` items wait) and the results are handed
+    back to the callers.
+
+    `handler(items) -> results` returns one result per item, an exception instance fails only the callers of that item
+    """
+
+    def __init__(self, handler, window: float = 0.01, max_batch: int = 32):
+        self.handler = handler
+        self.window = window
+        self.max_batch = max_batch
+        self.batches = 0
+        self.items = 0
+        self.deduplicated = 0
+        self._pending = {} # item -> (threading.Event, result holder)
+        self._full = threading.Condition()
+
+    def submit(self, item):
+        batch = None
+        with self._full:
+            call = self._pending.get(item)
+            if call is not None:
+                self.deduplicated += 1
+            else:
+                call = self._pending[item] = (threading.Event(), {})
+                if len(self._pending) == 1: # the first caller of a batch collects and sends it
+                    self._full.wait_for(lambda: len(self._pending) >= self.max_batch, timeout=self.window)
+                    batch, self._pending = self._pending, {}
+                elif len(self._pending) >= self.max_batch:
+                    self._full.notify_all()
+        if batch is not None:
+            self._flush(batch)
+        done, outcome = call
+        done.wait()
+        if isinstance(outcome["result"], Exception):
+            raise outcome["result"]
+        return outcome["result"]
+
+    def _flush(self, batch: dict):
+        items = list(batch)
+        self.batches += 1
+        self.items += len(items)
+        try:
+            results = self.handler(items)
+        except Exception as e:
+            results = [e] * len(items)
+        for item, result in zip(items, results):
+            done, outcome = batch[item]
+            outcome["result"] = result
+            done.set()
+
+    def stats(self) -> dict:
+        return {"batches": self.batches, "items": self.items, "deduplicated": self.deduplicated,
+                "mean_batch_size": self.items / self.batches if self.batches else 0.0}
+
+
+class AsyncMicroBatcher:
+    """
+    Same as `MicroBatcher` for coroutines, `handler` is async. One batch is collected per event loop
+    """
+
+    def __init__(self, handler, window: float = 0.01, max_batch: int = 32):
+        self.handler = handler
+        self.window = window
+        self.max_batch = max_batch
+        self.batches = 0
+        self.items = 0
+        self.deduplicated = 0
+        self._pending = {} # event loop -> {item: future}
+        self._flushers = {} # event loop -> timer handle
+
+    async def submit(self, item):
+        loop = asyncio.get_running_loop()
+        pending = self._pending.setdefault(loop, {})
+        future = pending.get(item)
+        if future is not None:
+            self.deduplicated += 1
+        else:
+            future = pending[item] = loop.create_future()
+            if len(pending) == 1:
+                self._flushers[loop] = loop.call_later(self.window, self._flush, loop)
+            elif len(pending) >= self.max_batch:
+                self._flushers.pop(loop).cancel()
+                self._flush(loop)
+        return await asyncio.shield(future)
+
+    def _flush(self, loop):
+        self._flushers.pop(loop, None)
+        batch = self._pending.pop(loop, {})
+        if batch:
+            loop.create_task(self._run(batch))
+
+    async def _run(self, batch: dict):
+        items = list(batch)
+        self.batches += 1
+        self.items += len(items)
+        try:
+            results = await self.handler(items)
+        except Exception as e:
+            results = [e] * len(items)
+        for item, result in zip(items, results):
+            future = batch[item]
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        return {"batches": self.batches, "items": self.items, "deduplicated": self.deduplicated,
+                "mean_batch_size": self.items / self.batches if self.batches else 0.0}
+
+
+def render_chatml(messages: list) -> str:
+    """
+    Chat messages as one ChatML text prompt, for the multi-prompt completions endpoint.
+    Has to match the chat template of the served model
+    """
+    text = "".join(f"<|im_start|>{m['role']}\n{m['content']}<|im_end|>\n" for m in messages)
+    return text + "<|im_start|>assistant\n"
+
+
+CHATML_STOP = ["<|im_end|>"]
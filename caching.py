@@ -0,0 +1,283 @@
+import asyncio
+import functools
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+
+def normalize_key_text(text) -> str:
+    return re.sub(r"\s+", " ", str(text)).strip().casefold()
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries expire after `ttl` seconds.
+    A per-entry TTL can be passed to `set` (e.g. shorter TTLs for negative results).
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict() # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.time():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, ttl: float = None):
+        with self._lock:
+            self._data[key] = (time.time() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def items(self) -> list:
+        """
+        Returns the live entries as (key, value, expires_at), oldest first
+        """
+        now = time.time()
+        with self._lock:
+            return [(key, value, expires_at) for key, (expires_at, value) in self._data.items() if expires_at >= now]
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / requests if requests else 0.0,
+        }
+
+
+class DiskCache:
+    """
+    Persistent key-value store with expiry on top of SQLite, values are stored as JSON.
+    A forked process opens its own connection, SQLite connections must not be used across a fork
+    """
+
+    def __init__(self, path: str, table: str = "cache"):
+        self.path = path
+        self.table = table
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._inherited = None
+        with self._lock, self._conn:
+            self._conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT, expires_at REAL)")
+        if hasattr(os, "register_at_fork"):
+            instance = weakref.ref(self)
+            os.register_at_fork(after_in_child=lambda: instance() and instance()._reset_after_fork())
+
+    def _reset_after_fork(self):
+        self._lock = threading.Lock()
+        # the parent's connection is kept referenced but unused, closing it in the child could disturb the parent
+        self._inherited = self._conn
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+
+    def get(self, key, default=None):
+        with self._lock:
+            row = self._conn.execute(f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] < time.time():
+            return default
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl: float = 3600):
+        with self._lock, self._conn:
+            self._conn.execute(f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+                               (key, json.dumps(value), time.time() + ttl))
+
+    def delete(self, key):
+        with self._lock, self._conn:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def purge_expired(self):
+        with self._lock, self._conn:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE expires_at < ?", (time.time(),))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class TieredCache:
+    """
+    In-memory LRU in front of an optional disk cache. Disk hits are promoted into memory
+    """
+
+    def __init__(self, memory: TTLCache, disk: DiskCache = None):
+        self.memory = memory
+        self.disk = disk
+
+    def get(self, key, default=None):
+        value = self.memory.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        if self.disk is not None:
+            value = self.disk.get(key, _MISSING)
+            if value is not _MISSING:
+                self.memory.set(key, value)
+                return value
+        return default
+
+    def set(self, key, value, ttl: float = None):
+        self.memory.set(key, value, ttl)
+        if self.disk is not None:
+            self.disk.set(key, value, self.memory.ttl if ttl is None else ttl)
+
+
+_MISSING = object()
+
+
+class Memoizer:
+    """
+    Memoizes LLM-backed functions, keyed by the normalized input, the model name and the prompt version.
+    Keeps hit/miss counters per function.
+    """
+
+    def __init__(self, cache, model_name=None):
+        self.cache = cache
+        self.model_name = model_name
+        self.metrics = {}
+
+    def key(self, name: str, prompt_version: str, args: tuple) -> str:
+        model = self.model_name() if callable(self.model_name) else self.model_name
+        raw = json.dumps([name, prompt_version, model, [normalize_key_text(a) for a in args]])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def lookup(self, name: str, prompt_version: str, args: tuple):
+        """
+        Cache lookup for callers that can't use the decorator (e.g. streaming), returns None on a miss
+        """
+        value = self.cache.get(self.key(name, prompt_version, args))
+        self.record(name, value is not None)
+        return value
+
+    def store(self, name: str, prompt_version: str, args: tuple, value):
+        self.cache.set(self.key(name, prompt_version, args), value)
+
+    def record(self, name: str, hit: bool):
+        metrics = self.metrics.setdefault(name, {"hits": 0, "misses": 0})
+        metrics["hits" if hit else "misses"] += 1
+
+    def stats(self) -> dict:
+        return {
+            name: dict(m, hit_rate=m["hits"] / (m["hits"] + m["misses"]))
+            for name, m in self.metrics.items()
+        }
+
+    def memoize(self, name: str, prompt_version: str = "1", decode=None):
+        """
+        Decorator for sync and async functions. `decode` restores the value type after a JSON round trip (e.g. tuple)
+        """
+        def decorator(function):
+            if asyncio.iscoroutinefunction(function):
+                @functools.wraps(function)
+                async def async_wrapper(*args):
+                    key = self.key(name, prompt_version, args)
+                    value = self.cache.get(key, _MISSING)
+                    self.record(name, value is not _MISSING)
+                    if value is not _MISSING:
+                        return decode(value) if decode else value
+                    value = await function(*args)
+                    self.cache.set(key, value)
+                    return value
+                return async_wrapper
+
+            @functools.wraps(function)
+            def wrapper(*args):
+                key = self.key(name, prompt_version, args)
+                value = self.cache.get(key, _MISSING)
+                self.record(name, value is not _MISSING)
+                if value is not _MISSING:
+                    return decode(value) if decode else value
+                value = function(*args)
+                self.cache.set(key, value)
+                return value
+            return wrapper
+        return decorator
+
+
+class SingleFlight:
+    """
+    Request coalescing for threads: concurrent calls with the same key share one execution
+    """
+
+    def __init__(self):
+        self.coalesced = 0
+        self._calls = {} # key -> (threading.Event, result holder)
+        self._lock = threading.Lock()
+
+    def do(self, key, function, *args):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = (threading.Event(), {})
+            else:
+                self.coalesced += 1
+        done, outcome = call
+        if not leader:
+            done.wait()
+            if "error" in outcome:
+                raise outcome["error"]
+            return outcome["value"]
+        try:
+            outcome["value"] = function(*args)
+            return outcome["value"]
+        except Exception as e:
+            outcome["error"] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            done.set()
+
+
+class AsyncSingleFlight:
+    """
+    Request coalescing for coroutines: concurrent awaits with the same key share one task
+    """
+
+    def __init__(self):
+        self.coalesced = 0
+        self._tasks = {}
+
+    async def do(self, key, function, *args):
+        task = self._tasks.get(key)
+        if task is None:
+            task = self._tasks[key] = asyncio.ensure_future(function(*args))
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
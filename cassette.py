@@ -0,0 +1,189 @@
+"""
+Record/replay layer for outbound HTTP calls (Pizza API, Qanary, SPARQL and the OpenAI-compatible LLM server).
+
+In "record" mode every request goes out and the response is appended to the cassette file, in "replay" mode
+responses are served from the file only, a request without recording raises `CassetteMiss`.
+Recordings are keyed by the normalized request: method, URL with sorted query, and the body with sorted
+JSON keys / form fields. Identical requests are replayed in the order they were recorded.
+"""
+import base64
+import hashlib
+import json
+import threading
+from os import makedirs, path
+from urllib.parse import parse_qsl, urlsplit
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+
+MODES = ("record", "replay")
+
+
+class CassetteMiss(ConnectionError):
+    pass
+
+
+def normalize_body(body, content_type: str = None) -> str:
+    if not body:
+        return ""
+    if isinstance(body, bytes):
+        body = body.decode("utf-8", "replace")
+    content_type = (content_type or "").lower()
+    if "json" in content_type:
+        try:
+            return json.dumps(json.loads(body), sort_keys=True, separators=(",", ":"))
+        except ValueError:
+            pass
+    if "x-www-form-urlencoded" in content_type:
+        return json.dumps(sorted(parse_qsl(body, keep_blank_values=True)), separators=(",", ":"))
+    return body
+
+
+def request_key(method: str, url: str, body=None, content_type: str = None) -> str:
+    parts = urlsplit(url)
+    normalized = [
+        method.upper(),
+        f"{parts.scheme}://{parts.netloc.lower()}{parts.path}",
+        sorted(parse_qsl(parts.query, keep_blank_values=True)),
+        normalize_body(body, content_type),
+    ]
+    return hashlib.sha256(json.dumps(normalized).encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    def __init__(self, cassette_path: str, mode: str = "replay"):
+        if mode not in MODES:
+            raise ValueError(f"Unknown cassette mode {mode}, expected one of {', '.join(MODES)}")
+        self.path = cassette_path
+        self.mode = mode
+        self.recordings = {} # key -> list of responses
+        self.played = {} # key -> number of responses replayed
+        self.hits = 0
+        self.misses = 0
+        self.recorded = 0
+        self._lock = threading.Lock()
+        if path.exists(cassette_path):
+            with open(cassette_path, encoding="utf-8") as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self.recordings.setdefault(entry.pop("key"), []).append(entry)
+        elif mode == "record" and path.dirname(cassette_path):
+            makedirs(path.dirname(cassette_path), exist_ok=True)
+
+    def replay(self, key: str, method: str, url: str) -> tuple:
+        """
+        Returns (status, content type, body) of the next recording for the request
+        """
+        with self._lock:
+            responses = self.recordings.get(key)
+            if not responses:
+                self.misses += 1
+                raise CassetteMiss(f"No recording for {method} {url} in {self.path}")
+            position = self.played.get(key, 0)
+            self.played[key] = position + 1
+            self.hits += 1
+            entry = responses[min(position, len(responses) - 1)] # the last response repeats
+        body = base64.b64decode(entry["body_b64"]) if "body_b64" in entry else entry["body"].encode("utf-8")
+        return entry["status"], entry.get("content_type"), body
+
+    def record(self, key: str, method: str, url: str, status: int, content_type: str, body: bytes):
+        entry = {"key": key, "method": method, "url": url, "status": status, "content_type": content_type}
+        try:
+            entry["body"] = body.decode("utf-8")
+        except UnicodeDecodeError:
+            entry["body_b64"] = base64.b64encode(body).decode("ascii")
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+            self.recordings.setdefault(key, []).append({k: v for k, v in entry.items() if k != "key"})
+            self.recorded += 1
+
+    def http_client(self) -> httpx.Client:
+        """
+        For the sync OpenAI client (`OpenAI(http_client=...)`)
+        """
+        return httpx.Client(transport=CassetteTransport(self, httpx.HTTPTransport()))
+
+    def async_http_client(self, **kwargs) -> httpx.AsyncClient:
+        return httpx.AsyncClient(transport=AsyncCassetteTransport(self, httpx.AsyncHTTPTransport(**kwargs)))
+
+    def stats(self) -> dict:
+        return {"mode": self.mode, "recordings": sum(map(len, self.recordings.values())),
+                "hits": self.hits, "misses": self.misses, "recorded": self.recorded}
+
+
+class CassetteAdapter(HTTPAdapter):
+    """
+    requests transport adapter, mounted by `HttpClient` when a cassette is active
+    """
+
+    def __init__(self, cassette: Cassette, **kwargs):
+        self.cassette = cassette
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        key = request_key(request.method, request.url, request.body, request.headers.get("Content-Type"))
+        if self.cassette.mode == "replay":
+            status, content_type, body = self.cassette.replay(key, request.method, request.url)
+            response = requests.Response()
+            response.status_code = status
+            response.headers = CaseInsensitiveDict({"Content-Type": content_type} if content_type else {})
+            response.encoding = get_encoding_from_headers(response.headers)
+            response._content = body
+            response.url = request.url
+            response.request = request
+            return response
+
+        response = super().send(request, **kwargs)
+        self.cassette.record(key, request.method, request.url, response.status_code, response.headers.get("Content-Type"), response.content)
+        return response
+
+
+def _replayed_response(cassette: Cassette, key: str, request: httpx.Request) -> httpx.Response:
+    status, content_type, body = cassette.replay(key, request.method, str(request.url))
+    return httpx.Response(status, headers={"content-type": content_type} if content_type else {}, content=body, request=request)
+
+
+class CassetteTransport(httpx.BaseTransport):
+    def __init__(self, cassette: Cassette, transport: httpx.BaseTransport):
+        self.cassette = cassette
+        self.transport = transport
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        key = request_key(request.method, str(request.url), request.read(), request.headers.get("content-type"))
+        if self.cassette.mode == "replay":
+            return _replayed_response(self.cassette, key, request)
+        response = self.transport.handle_request(request)
+        body = response.read() # streamed responses are recorded (and replayed) as a whole
+        response.close()
+        content_type = response.headers.get("content-type")
+        self.cassette.record(key, request.method, str(request.url), response.status_code, content_type, body)
+        return httpx.Response(response.status_code, headers={"content-type": content_type} if content_type else {}, content=body, request=request)
+
+    def close(self):
+        self.transport.close()
+
+
+class AsyncCassetteTransport(httpx.AsyncBaseTransport):
+    def __init__(self, cassette: Cassette, transport: httpx.AsyncBaseTransport):
+        self.cassette = cassette
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        key = request_key(request.method, str(request.url), await request.aread(), request.headers.get("content-type"))
+        if self.cassette.mode == "replay":
+            return _replayed_response(self.cassette, key, request)
+        response = await self.transport.handle_async_request(request)
+        body = await response.aread()
+        await response.aclose()
+        content_type = response.headers.get("content-type")
+        self.cassette.record(key, request.method, str(request.url), response.status_code, content_type, body)
+        return httpx.Response(response.status_code, headers={"content-type": content_type} if content_type else {}, content=body, request=request)
+
+    async def aclose(self):
+        await self.transport.aclose()
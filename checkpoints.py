@@ -0,0 +1,162 @@
+import asyncio
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from os import environ
+
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+
+class BatchedSqliteSaver(SqliteSaver):
+    """
+    SQLite checkpointer that commits in batches instead of once per checkpoint write.
+
+    Writes are committed after `batch_size` writes or `flush_interval` seconds, whichever comes first.
+    Reads on the same connection always see the pending writes; other processes resuming a session
+    see them after the next commit (call `flush()` to force one, e.g. before handing a session over).
+    Only the latest `keep` checkpoints of a thread are kept, 0 keeps all.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, batch_size: int = 50, flush_interval: float = 1.0, keep: int = 10, **kwargs):
+        super().__init__(conn, **kwargs)
+        self.keep = keep
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending_writes = 0
+        self.commits = 0
+        self._last_commit = time.monotonic()
+        self._flush_lock = threading.RLock()
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+        self._flusher.start()
+
+    @classmethod
+    def from_path(cls, path: str, **kwargs):
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return cls(conn, **kwargs)
+
+    @contextmanager
+    def cursor(self, transaction: bool = True):
+        with self._flush_lock:
+            self.setup()
+            cur = self.conn.cursor()
+            try:
+                yield cur
+            finally:
+                cur.close()
+                if transaction:
+                    self.pending_writes += 1
+                    if self.pending_writes >= self.batch_size or time.monotonic() - self._last_commit >= self.flush_interval:
+                        self.flush()
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        saved = super().put(config, checkpoint, metadata, new_versions)
+        if self.keep:
+            self.prune(config["configurable"]["thread_id"], config["configurable"]["checkpoint_ns"])
+        return saved
+
+    def prune(self, thread_id: str, checkpoint_ns: str = ""):
+        """
+        Deletes all but the latest `keep` checkpoints of a thread and their pending writes
+        """
+        # checkpoint ids are time ordered, the same order SqliteSaver uses to find the latest one
+        with self.cursor(transaction=False) as cur:
+            for table in ("checkpoints", "writes"):
+                cur.execute(
+                    f"DELETE FROM {table} WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id < ("
+                    "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+                    "ORDER BY checkpoint_id DESC LIMIT 1 OFFSET ?)",
+                    (thread_id, checkpoint_ns, thread_id, checkpoint_ns, self.keep - 1),
+                )
+
+    def flush(self):
+        with self._flush_lock:
+            if self.pending_writes:
+                self.conn.commit()
+                self.commits += 1
+                self.pending_writes = 0
+            self._last_commit = time.monotonic()
+
+    def close(self):
+        self._closed.set()
+        self.flush()
+        self.conn.close()
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self.flush_interval):
+            try:
+                self.flush()
+            except sqlite3.ProgrammingError: # connection closed
+                return
+
+    # SqliteSaver is sync only, the async interface runs it in worker threads
+
+    async def aget_tuple(self, config):
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        for item in await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit))):
+            yield item
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id):
+        return await asyncio.to_thread(self.put_writes, config, writes, task_id)
+
+
+class PrunedMemorySaver(MemorySaver):
+    """
+    MemorySaver that keeps only the latest `keep` checkpoints of a thread, 0 keeps all
+    """
+
+    def __init__(self, keep: int = 10, **kwargs):
+        super().__init__(**kwargs)
+        self.keep = keep
+        self._prune_lock = threading.Lock()
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        saved = super().put(config, checkpoint, metadata, new_versions)
+        if self.keep:
+            self.prune(config["configurable"]["thread_id"], config["configurable"]["checkpoint_ns"])
+        return saved
+
+    def prune(self, thread_id: str, checkpoint_ns: str = ""):
+        with self._prune_lock:
+            checkpoints = self.storage[thread_id][checkpoint_ns]
+            dropped = sorted(checkpoints)[:-self.keep]
+            for checkpoint_id in dropped:
+                del checkpoints[checkpoint_id]
+                self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+            if not dropped:
+                return
+            # channel values are stored once per version, drop the versions no kept checkpoint refers to
+            referenced = {
+                (channel, version)
+                for saved in checkpoints.values()
+                for channel, version in self.serde.loads_typed(saved[0])["channel_versions"].items()
+            }
+            for key in [k for k in self.blobs if k[:2] == (thread_id, checkpoint_ns) and k[2:] not in referenced]:
+                del self.blobs[key]
+
+
+def create_checkpointer(backend: str = None, path: str = None):
+    """
+    "memory" (default) keeps sessions in the process, "sqlite" persists them in PIZZABOT_CHECKPOINT_PATH
+    """
+    backend = backend or environ.get("PIZZABOT_CHECKPOINTER", "memory")
+    keep = int(environ.get("PIZZABOT_CHECKPOINT_KEEP", 10))
+    if backend == "memory":
+        return PrunedMemorySaver(keep=keep)
+    if backend == "sqlite":
+        return BatchedSqliteSaver.from_path(
+            path or environ.get("PIZZABOT_CHECKPOINT_PATH", "pizzabot_sessions.sqlite"),
+            keep=keep,
+            batch_size=int(environ.get("PIZZABOT_CHECKPOINT_BATCH_SIZE", 50)),
+            flush_interval=float(environ.get("PIZZABOT_CHECKPOINT_FLUSH_INTERVAL", 1.0)),
+        )
+    raise ValueError(f"Unknown checkpointer backend: {backend}")
@@ -0,0 +1,52 @@
+import pytest
+
+import pizzabot
+
+
+MENU = "Margherita, Hawaii"
+ADDRESS = ("Leipzig", "Augustusplatz", "10")
+
+
+@pytest.fixture
+def backends(monkeypatch):
+    """
+    The utils backends used by the nodes, answered locally; `calls` records which were used
+    """
+    calls = []
+
+    def backend(name, result):
+        def call(*args):
+            calls.append(name)
+            return result(*args) if callable(result) else result
+
+        async def acall(*args):
+            return call(*args)
+        return call, acall
+
+    answers = {
+        "check_order_intention": lambda _input: "pizza" in _input.lower(),
+        "validate_pizza_name": lambda _input: "1" if "margherita" in _input.lower() else None,
+        "check_customer_address": lambda _input: ADDRESS if "leipzig" in _input.lower() else None,
+        "get_pizza_menu": MENU,
+        "post_order": "42",
+        "get_pizza_context": "Pizza Margherita tomato and mozzarella\n",
+        "generate_pizza_description": "A classic.",
+        "prefetch_pizza_menu": True,
+    }
+    for name, result in answers.items():
+        call, acall = backend(name, result)
+        monkeypatch.setattr(pizzabot, name, call)
+        monkeypatch.setattr(pizzabot, f"a{name}", acall)
+
+    def stream(_input, context, language):
+        calls.append("stream_pizza_description")
+        yield from ["A ", "classic."]
+
+    async def astream(_input, context, language):
+        for token in stream(_input, context, language):
+            yield token
+
+    monkeypatch.setattr(pizzabot, "stream_pizza_description", stream)
+    monkeypatch.setattr(pizzabot, "astream_pizza_description", astream)
+    monkeypatch.setattr(pizzabot, "menu_words", lambda: set())
+    return calls
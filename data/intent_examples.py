@@ -0,0 +1,54 @@
+# labelled utterances for the local order intention classifier (True = the user wants to order a pizza)
+order_intention_examples = [
+    ("I wanna order a pizza.", True),
+    ("I want to order pizza", True),
+    ("I want a pizza", True),
+    ("I would like to order a pizza", True),
+    ("I'd like a pizza please", True),
+    ("Can I order a pizza?", True),
+    ("Can I get a pizza delivered?", True),
+    ("One pizza please", True),
+    ("Order pizza", True),
+    ("I am hungry, I want to order something", True),
+    ("I want to order Hawaiian", True),
+    ("Give me a Margherita", True),
+    ("I'll have a Pepperoni", True),
+    ("Let me order a Quattro Formaggi", True),
+    ("Pizza delivery please", True),
+    ("I want to place an order", True),
+    ("Could you deliver a pizza to me?", True),
+    ("Yes, I want to order", True),
+    ("How are you doing today?", False),
+    ("Hello", False),
+    ("Hi there", False),
+    ("What is the weather like?", False),
+    ("Thanks", False),
+    ("Thank you, bye", False),
+    ("Who are you?", False),
+    ("What can you do?", False),
+    ("Tell me a joke", False),
+    ("I don't want anything", False),
+    ("I don't want a pizza", False),
+    ("I do not want to order", False),
+    ("No thanks", False),
+    ("What time is it?", False),
+    ("Where are you located?", False),
+    ("Good morning", False),
+    ("Never mind", False),
+    ("I just wanted to say hi", False),
+    # requests about an existing order or the service are not a new order
+    ("I want a refund", False),
+    ("I want my money back", False),
+    ("Cancel my order", False),
+    ("Please cancel the order", False),
+    ("Where is my order?", False),
+    ("What is the status of my order?", False),
+    ("My pizza arrived cold", False),
+    ("I want to complain about my pizza", False),
+    ("The pizza was wrong", False),
+    ("Can I talk to a human?", False),
+    ("I want to speak to a manager", False),
+    ("Is it going to rain today?", False),
+    ("What is the weather tomorrow?", False),
+    ("What are your opening hours?", False),
+]
@@ -0,0 +1,138 @@
+"""
+Evaluation of the dialogue graph against `data/test_dialogue.py`, with LangSmith or locally (see test_pizzabot.py)
+"""
+import copy
+import hashlib
+import json
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from os import environ
+
+from langchain_core.messages import AIMessage
+
+from caching import DiskCache, TieredCache, TTLCache, normalize_key_text
+
+
+JUDGE_PROMPT_VERSION = "1"
+
+JUDGE_INSTRUCTIONS = (
+    "Given an actual answer and an expected answer, determine whether"
+    " the actual answer contains all of the information in the"
+    " expected answer. Respond with 'CORRECT' if the actual answer"
+    " does contain all of the expected information and 'INCORRECT'"
+    " otherwise. Do not include anything else in your response."
+)
+
+
+def normalize_answer(text: str) -> str:
+    """
+    Casefolded, punctuation removed, whitespace collapsed
+    """
+    return normalize_key_text(re.sub(r"[^\w\s]", " ", text))
+
+
+def last_ai_message(outputs: dict):
+    # Our graph outputs a State dictionary, which in this case means
+    # we'll have a 'messages' key and the final message should
+    # be our actual answer.
+    ai_messages = [msg for msg in outputs["messages"] if isinstance(msg, AIMessage)]
+    return ai_messages[-1].content if ai_messages else None
+
+
+class Evaluator:
+    """
+    The `correct` judge with a deterministic pre-check and a verdict cache.
+
+    An actual answer that contains the expected answer as a whole sequence of words (after normalization) is correct
+    without asking the judge, "order 42" does not match "order 4". Other pairs are judged once per (actual, expected, judge model) and the verdict is cached
+    """
+
+    def __init__(self, judge_factory, judge_model: str = None, cache=None):
+        self.judge_factory = judge_factory # creates the judge chat model on first use
+        self.judge_model = judge_model
+        self.cache = cache or TTLCache(maxsize=10000, ttl=30 * 86400)
+        self.counts = {"matched": 0, "cached": 0, "judged": 0, "missing": 0}
+        self._judge = None
+
+    def key(self, actual: str, expected: str) -> str:
+        raw = json.dumps([JUDGE_PROMPT_VERSION, self.judge_model, normalize_answer(actual), normalize_answer(expected)])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def judge(self, actual: str, expected: str) -> bool:
+        if self._judge is None:
+            self._judge = self.judge_factory()
+        user_msg = (
+            f"ACTUAL ANSWER: {actual}"
+            f"\n\nEXPECTED ANSWER: {expected}"
+        )
+        response = self._judge.invoke(
+            [
+                {"role": "system", "content": JUDGE_INSTRUCTIONS},
+                {"role": "user", "content": user_msg}
+            ]
+        )
+        return response.content.strip().upper() == "CORRECT"
+
+    def correct(self, outputs: dict, reference_outputs: dict) -> bool:
+        actual = last_ai_message(outputs)
+        if actual is None:
+            self.counts["missing"] += 1
+            return False
+        expected = reference_outputs["expected"]
+        if f" {normalize_answer(expected)} " in f" {normalize_answer(actual)} ":
+            self.counts["matched"] += 1
+            return True
+
+        key = self.key(actual, expected)
+        verdict = self.cache.get(key)
+        if verdict is not None:
+            self.counts["cached"] += 1
+            return verdict
+        verdict = self.judge(actual, expected)
+        self.counts["judged"] += 1
+        self.cache.set(key, verdict)
+        return verdict
+
+
+def create_judge_cache():
+    """
+    In memory, and in EVAL_JUDGE_CACHE_PATH across runs if set
+    """
+    cache_path = environ.get("EVAL_JUDGE_CACHE_PATH")
+    return TieredCache(
+        TTLCache(maxsize=10000, ttl=30 * 86400),
+        DiskCache(cache_path, table="judge") if cache_path else None,
+    )
+
+
+def run_local(target, examples: list, evaluators: list, max_concurrency: int = 8) -> dict:
+    """
+    Runs the examples through `target` and the evaluators without LangSmith, `max_concurrency` examples at a time.
+    Every run gets its own copy of the example inputs, the graph updates the state it is given in place
+    """
+    def run(example):
+        start = time.perf_counter()
+        try:
+            outputs = target.invoke(copy.deepcopy(example["inputs"]))
+        except Exception as e:
+            return {"error": repr(e), "seconds": time.perf_counter() - start}
+        seconds = time.perf_counter() - start
+        scores = {evaluator.__name__: evaluator(outputs, example["outputs"]) for evaluator in evaluators}
+        return {"scores": scores, "seconds": seconds, "actual": last_ai_message(outputs)}
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        results = list(executor.map(run, examples))
+    duration = time.perf_counter() - start
+
+    summary = {}
+    for evaluator in evaluators:
+        scores = [r["scores"][evaluator.__name__] for r in results if "scores" in r]
+        summary[evaluator.__name__] = sum(scores) / len(scores) if scores else 0.0
+    return {
+        "results": results,
+        "summary": summary,
+        "errors": sum("error" in r for r in results),
+        "duration": duration,
+    }
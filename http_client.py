@@ -0,0 +1,168 @@
+import asyncio
+import threading
+import weakref
+from urllib.parse import urlsplit
+
+
+
+# default timeouts (seconds) per logical endpoint, can be overwritten with HTTP_TIMEOUTS="menu=3,qanary=30"
+DEFAULT_TIMEOUTS = {
+    "default": 5,
+    "menu": 5,
+    "address_validate": 5,
+    "order": 5,
+    "qanary": 60,
+    "sparql": 20,
+}
+
+
+def parse_timeouts(value: str) -> dict:
+    timeouts = dict(DEFAULT_TIMEOUTS)
+    for pair in filter(None, (p.strip() for p in (value or "").split(","))):
+        endpoint, _, seconds = pair.partition("=")
+        timeouts[endpoint.strip()] = float(seconds)
+    return timeouts
+
+
+class HttpClient:
+    """
+    Shared HTTP client layer with one keep-alive session and connection pool per host.
+
+    Connections are reused across calls (and threads), so only the first request to
+    PIZZA_API_BASE / QANARY_API_BASE pays for the TCP and TLS handshake.
+    """
+
+    def __init__(self, pool_connections: int = 4, pool_maxsize: int = 16, timeouts: dict = None, cassette=None):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.timeouts = timeouts or dict(DEFAULT_TIMEOUTS)
+        self.cassette = cassette # record/replay all requests, see cassette.py
+        self._sessions = {}
+        self._adapters = {}
+        self._lock = threading.Lock()
+
+    def session(self, url: str) -> "requests.Session":
+        host = urlsplit(url).netloc
+        session = self._sessions.get(host)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(host)
+                if session is None:
+                    import requests # imported on first use to keep `import utils` fast
+                    from requests.adapters import HTTPAdapter
+                    session = requests.Session()
+                    if self.cassette is not None:
+                        from cassette import CassetteAdapter
+                        adapter = CassetteAdapter(self.cassette, pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize)
+                    else:
+                        adapter = HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize)
+                    session.mount("http://", adapter)
+                    session.mount("https://", adapter)
+                    self._adapters[host] = adapter
+                    self._sessions[host] = session
+        return session
+
+    def timeout(self, endpoint: str) -> float:
+        return self.timeouts.get(endpoint, self.timeouts["default"])
+
+    def request(self, method: str, url: str, endpoint: str = "default", **kwargs) -> "requests.Response":
+        kwargs.setdefault("timeout", self.timeout(endpoint))
+        return self.session(url).request(method, url, **kwargs)
+
+    def get(self, url: str, endpoint: str = "default", **kwargs) -> "requests.Response":
+        return self.request("GET", url, endpoint, **kwargs)
+
+    def post(self, url: str, endpoint: str = "default", **kwargs) -> "requests.Response":
+        return self.request("POST", url, endpoint, **kwargs)
+
+    def stats(self) -> dict:
+        """
+        Returns the pool utilization per host
+        """
+        stats = {}
+        for host, adapter in list(self._adapters.items()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                slots = list(pool.pool.queue) if pool.pool is not None else []
+                maxsize = pool.pool.maxsize if pool.pool is not None else 0
+                stats[f"{pool.scheme}://{host}"] = {
+                    "maxsize": maxsize,
+                    "in_use": maxsize - len(slots),
+                    "idle": len([c for c in slots if c is not None]),
+                    "connections_opened": pool.num_connections,
+                    "requests": pool.num_requests,
+                }
+        return stats
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+            self._adapters.clear()
+
+
+
+class AsyncHttpClient:
+    """
+    Async counterpart of `HttpClient` based on httpx.
+
+    httpx pools connections per host internally; one client is kept per event loop,
+    because its connections cannot be shared between loops.
+    """
+
+    def __init__(self, max_connections: int = 100, max_keepalive_connections: int = 16, timeouts: dict = None, cassette=None):
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.timeouts = timeouts or dict(DEFAULT_TIMEOUTS)
+        self.cassette = cassette
+        self.in_flight = {}
+        self.requests = {}
+        self._clients = weakref.WeakKeyDictionary()
+
+    def client(self) -> "httpx.AsyncClient":
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            import httpx
+            limits = httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_keepalive_connections)
+            if self.cassette is not None:
+                client = self._clients[loop] = self.cassette.async_http_client(limits=limits)
+            else:
+                client = self._clients[loop] = httpx.AsyncClient(limits=limits)
+        return client
+
+    def timeout(self, endpoint: str) -> float:
+        return self.timeouts.get(endpoint, self.timeouts["default"])
+
+    async def request(self, method: str, url: str, endpoint: str = "default", **kwargs) -> "httpx.Response":
+        kwargs.setdefault("timeout", self.timeout(endpoint))
+        host = urlsplit(url).netloc
+        self.in_flight[host] = self.in_flight.get(host, 0) + 1
+        self.requests[host] = self.requests.get(host, 0) + 1
+        try:
+            return await self.client().request(method, url, **kwargs)
+        finally:
+            self.in_flight[host] -= 1
+
+    async def get(self, url: str, endpoint: str = "default", **kwargs) -> "httpx.Response":
+        return await self.request("GET", url, endpoint, **kwargs)
+
+    async def post(self, url: str, endpoint: str = "default", **kwargs) -> "httpx.Response":
+        return await self.request("POST", url, endpoint, **kwargs)
+
+    def stats(self) -> dict:
+        return {
+            host: {
+                "max_connections": self.max_connections,
+                "in_flight": self.in_flight.get(host, 0),
+                "requests": count,
+            }
+            for host, count in self.requests.items()
+        }
+
+    async def aclose(self):
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
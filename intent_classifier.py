@@ -0,0 +1,231 @@
+import json
+import logging
+import math
+import re
+import threading
+from collections import Counter, namedtuple
+from os import path
+
+
+logger = logging.getLogger(__name__)
+
+IntentDecision = namedtuple("IntentDecision", ["intention", "tier", "confidence"])
+
+
+class Tiers:
+    KEYWORDS = "keywords"
+    LOCAL_MODEL = "local_model"
+    LLM = "llm"
+
+
+NEGATIONS = {"not", "no", "never", "don't", "dont", "doesn't", "won't", "nothing"}
+
+
+def words(text: str) -> list:
+    """
+    Words following a negation are marked ("don't want pizza" -> "don't", "not_want", "not_pizza")
+    """
+    words = []
+    negated = False
+    for word in re.findall(r"[a-zäöüß0-9']+|[.,!?;]", text.lower()):
+        if word in ".,!?;":
+            negated = False
+        elif word in NEGATIONS:
+            negated = True
+            words.append(word)
+        else:
+            words.append(f"not_{word}" if negated else word)
+    return words
+
+
+def tokenize(text: str) -> list:
+    """
+    Unigrams and bigrams of `words`
+    """
+    unigrams = words(text)
+    return unigrams + [f"{a}_{b}" for a, b in zip(unigrams, unigrams[1:])]
+
+
+class KeywordMatcher:
+    """
+    Tier one: precompiled patterns for the obvious phrasings
+    """
+
+    # only clear order verbs close to the pizza: "I like pizza" or "I want to know if you have vegan pizza" are not orders
+    order_patterns = [
+        r"\b(order|want|buy)\s+(\S+\s+){0,3}pizzas?\b",
+        r"\bi'?ll have (a|an|one|two|three|the|\d+)\b",
+        r"\bpizzas?\b.*\b(please|delivery)\b",
+        r"\b(place|make)\b.*\border\b",
+        r"^\s*(i want to |i'?d like to |let me )?order\b",
+    ]
+    # questions ("Do you have vegan pizza?", "Do you deliver pizza to Berlin?") are left to the next tiers
+    question_pattern = r"\?\s*$|^\s*(do|does|did|is|are|can|could|would|will|what|which|where|when|who|how|why)\b"
+    other_patterns = [
+        r"^\s*(hi|hello|hey|good (morning|evening|afternoon))( there)?[\s!.?]*$",
+        r"^\s*(thanks|thank you|bye|goodbye|no thanks|never mind)[\s!.,?a-z]*$",
+        r"\bhow are you\b",
+        r"\bwho are you\b",
+        r"\bweather\b",
+    ]
+    # about an existing order or the service, or not a request at all: "I want a refund for my pizza",
+    # "where is my order", "order status" look like orders to the patterns above and are left to the LLM
+    defer_patterns = [
+        r"\b(refund|money back|cancel\w*|complain\w*|complaint|status|track\w*|wrong|late|cold|problem)\b",
+        r"\bwhere('?s| is)\b.*\b(order|pizza|delivery)\b",
+        r"\b(talk|speak)\b.*\b(human|person|someone|manager|agent)\b",
+    ]
+    negation_pattern = r"\b(don'?t|do not|not|never|no)\b"
+
+    def __init__(self):
+        self.defer_regex = re.compile("|".join(self.defer_patterns), re.IGNORECASE)
+        self.order_regex = re.compile("|".join(self.order_patterns), re.IGNORECASE)
+        self.other_regex = re.compile("|".join(self.other_patterns), re.IGNORECASE)
+        self.negation_regex = re.compile(self.negation_pattern, re.IGNORECASE)
+        self.question_regex = re.compile(self.question_pattern, re.IGNORECASE)
+
+    def defers(self, _input: str) -> bool:
+        """
+        True if no local tier may answer, only the LLM
+        """
+        return bool(self.defer_regex.search(_input))
+
+    def classify(self, _input: str):
+        if self.order_regex.search(_input):
+            # "I don't want a pizza" and questions are left to the next tiers
+            if self.negation_regex.search(_input) or self.question_regex.search(_input):
+                return None
+            return IntentDecision(True, Tiers.KEYWORDS, 1.0)
+        if self.other_regex.search(_input):
+            return IntentDecision(False, Tiers.KEYWORDS, 1.0)
+        return None
+
+
+class NaiveBayesClassifier:
+    """
+    Tier two: multinomial naive Bayes over unigrams and bigrams, small enough to train at startup on CPU.
+
+    The raw posteriors of naive Bayes are close to 0 or 1 for almost any input, so the confidence is calibrated:
+    the log odds are averaged per token and scaled by `sharpness`. Input with less than `min_coverage` known words
+    gets no decision
+    """
+
+    def __init__(self, examples: list, sharpness: float = 3.5, min_coverage: float = 0.75):
+        self.sharpness = sharpness
+        self.min_coverage = min_coverage
+        self.counts = {True: Counter(), False: Counter()}
+        self.documents = Counter()
+        for text, label in examples:
+            self.counts[label].update(tokenize(text))
+            self.documents[label] += 1
+        self.vocabulary = set(self.counts[True]) | set(self.counts[False])
+        self.totals = {label: sum(counts.values()) for label, counts in self.counts.items()}
+        self.size = sum(self.documents.values())
+
+    def classify(self, _input: str):
+        unigrams = words(_input)
+        tokens = [t for t in tokenize(_input) if t in self.vocabulary]
+        if not tokens or not self.documents[True] or not self.documents[False]:
+            return None
+        if sum(word in self.vocabulary for word in unigrams) / len(unigrams) < self.min_coverage:
+            return None
+        scores = {}
+        for label in (True, False):
+            score = math.log(self.documents[label] / self.size)
+            for token in tokens:
+                score += math.log((self.counts[label][token] + 1) / (self.totals[label] + len(self.vocabulary)))
+            scores[label] = score
+        intention = scores[True] > scores[False]
+        margin = (scores[intention] - scores[not intention]) / len(tokens)
+        confidence = 1 / (1 + math.exp(-self.sharpness * margin))
+        return IntentDecision(intention, Tiers.LOCAL_MODEL, confidence)
+
+
+def load_training_examples(traffic_log: str = None) -> list:
+    """
+    Collects labelled utterances from the dialogue test set, the seed examples and the logged LLM decisions
+    """
+    from data.intent_examples import order_intention_examples
+    from data.test_dialogue import correct_dialogue
+
+    examples = list(order_intention_examples)
+    examples += [
+        (e["inputs"]["input"], e["outputs"]["active_order"])
+        for e in correct_dialogue if not e["inputs"]["active_order"]
+    ]
+    if traffic_log and path.exists(traffic_log):
+        with open(traffic_log, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    examples.append((record["input"], bool(record["intention"])))
+                except (ValueError, KeyError):
+                    continue
+    return examples
+
+
+class CascadingIntentClassifier:
+    """
+    Answers the order intention with the cheapest tier that is confident:
+    keyword patterns, then the local model, and only then the LLM.
+    LLM answers are appended to the traffic log so that the local model can be retrained on them.
+    """
+
+    def __init__(self, confidence: float = 0.9, min_training_examples: int = 20, traffic_log: str = None):
+        self.confidence = confidence
+        self.min_training_examples = min_training_examples
+        self.traffic_log = traffic_log
+        self.keywords = KeywordMatcher()
+        self.model = None
+        self.decisions = Counter()
+        self._lock = threading.Lock()
+
+    def train(self):
+        self.model = NaiveBayesClassifier(load_training_examples(self.traffic_log))
+        logger.info(f"Trained local intent model on {self.model.size} utterances")
+        return self.model
+
+    def classify_locally(self, _input: str):
+        if self.keywords.defers(_input):
+            return None
+        decision = self.keywords.classify(_input)
+        if decision is not None:
+            return decision
+        model = self.model or self.train()
+        if model.size < self.min_training_examples:
+            return None
+        decision = model.classify(_input)
+        if decision is not None and decision.confidence >= self.confidence:
+            return decision
+        return None
+
+    def classify(self, _input: str, llm) -> IntentDecision:
+        decision = self.classify_locally(_input)
+        if decision is None:
+            decision = IntentDecision(llm(_input), Tiers.LLM, None)
+            self.log_traffic(_input, decision.intention)
+        self.record(_input, decision)
+        return decision
+
+    async def aclassify(self, _input: str, allm) -> IntentDecision:
+        decision = self.classify_locally(_input)
+        if decision is None:
+            decision = IntentDecision(await allm(_input), Tiers.LLM, None)
+            self.log_traffic(_input, decision.intention)
+        self.record(_input, decision)
+        return decision
+
+    def record(self, _input: str, decision: IntentDecision):
+        self.decisions[decision.tier] += 1
+        logger.debug(f"Order intention {decision.intention} for {_input!r} answered by tier {decision.tier}")
+
+    def log_traffic(self, _input: str, intention: bool):
+        if not self.traffic_log:
+            return
+        with self._lock, open(self.traffic_log, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"input": _input, "intention": bool(intention)}) + "\n")
+
+    def stats(self) -> dict:
+        total = sum(self.decisions.values())
+        return {tier: {"count": count, "share": count / total} for tier, count in self.decisions.items()}
+
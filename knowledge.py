@@ -0,0 +1,166 @@
+import json
+import logging
+import re
+import unicodedata
+from os import environ, path
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SNAPSHOT_PATH = path.join(path.dirname(path.abspath(__file__)), "data", "pizza_knowledge.json")
+
+# words of description requests ("tell me more about ...") that do not name a pizza
+QUESTION_WORDS = frozenset("""
+    tell me more about describe description the and or of what whats is are was can could would you your please
+    give some info information details explain know like want to how does do taste tastes it its this that these those
+    which both difference between compare versus with for on in has have ingredients ingredient topping toppings pizza
+    pizzas
+""".split())
+
+
+def normalize_label(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(re.findall(r"[a-z0-9]+", text))
+
+
+def label_aliases(label: str) -> set:
+    """
+    "Pizza Margherita" -> {"pizza margherita", "margherita", "margherita pizza"}
+    """
+    name = normalize_label(label)
+    bare = " ".join(w for w in name.split() if w != "pizza")
+    return {alias for alias in (name, bare, f"pizza {bare}", f"{bare} pizza") if bare}
+
+
+def build_snapshot(sparql_result: dict) -> dict:
+    """
+    Turns the result of `fetch_pizza_descriptions_from_wikidata` into a compact index:
+    a list of entries and a map from every normalized label/alias to the entry position
+    """
+    entries = []
+    aliases = {}
+    for binding in sparql_result["results"]["bindings"]:
+        label = binding["label"]["value"]
+        entries.append({
+            "uri": binding["pizza"]["value"],
+            "label": label,
+            "description": binding["description"]["value"],
+        })
+        for alias in label_aliases(label):
+            aliases.setdefault(alias, len(entries) - 1)
+    return {"entries": entries, "aliases": aliases}
+
+
+class PizzaKnowledge:
+    """
+    Local label/alias -> description lookup over the Wikidata pizza snapshot
+    """
+
+    def __init__(self, snapshot: dict):
+        self.entries = snapshot["entries"]
+        self.aliases = snapshot["aliases"]
+        self.max_alias_length = max((len(a.split()) for a in self.aliases), default=1)
+
+    @classmethod
+    def load(cls, snapshot_path: str = DEFAULT_SNAPSHOT_PATH):
+        if not path.exists(snapshot_path):
+            logger.info(f"No pizza knowledge snapshot at {snapshot_path}")
+            return None
+        with open(snapshot_path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def resolve(self, question: str) -> tuple:
+        """
+        Returns the entries of all pizzas mentioned in the question (longest alias match wins) and the remaining
+        words that may name a pizza the snapshot does not know
+        """
+        words = normalize_label(question).split()
+        found = []
+        unresolved = []
+        i = 0
+        while i < len(words):
+            for n in range(min(self.max_alias_length, len(words) - i), 0, -1):
+                position = self.aliases.get(" ".join(words[i:i + n]))
+                if position is not None:
+                    if self.entries[position] not in found:
+                        found.append(self.entries[position])
+                    i += n
+                    break
+            else:
+                if words[i] not in QUESTION_WORDS and len(words[i]) > 2 and not words[i].isdigit():
+                    unresolved.append(words[i])
+                i += 1
+        return found, unresolved
+
+    def lookup(self, question: str) -> list:
+        return self.resolve(question)[0]
+
+    def context(self, question: str) -> str:
+        """
+        Same format as the Qanary pipeline context: one "label description" line per pizza
+        """
+        return self.answer(question)[0]
+
+    def answer(self, question: str) -> tuple:
+        """
+        Returns the context and whether it is complete, i.e. the question names at least one pizza and every name
+        was found in the snapshot
+        """
+        found, unresolved = self.resolve(question)
+        return "".join(f"{e['label']} {e['description']}\n" for e in found), bool(found) and not unresolved
+
+
+def merge_context(local: str, remote: str) -> str:
+    """
+    The snapshot lines followed by the lines of the Qanary context that are not among them
+    """
+    lines = local.splitlines(keepends=True)
+    return local + "".join(line for line in remote.splitlines(keepends=True) if line not in lines)
+
+
+def write_snapshot(output_path: str) -> dict:
+    """
+    Fetches the pizza descriptions from Wikidata and writes the snapshot to `output_path`
+    """
+    from utils import fetch_pizza_descriptions_from_wikidata # utils imports this module
+
+    result = fetch_pizza_descriptions_from_wikidata()
+    if "error" in result:
+        raise ConnectionError(f"Wikidata query failed: {result['error']}")
+    snapshot = build_snapshot(result)
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f, ensure_ascii=False, separators=(",", ":"))
+    return snapshot
+
+
+_knowledge = None
+
+
+def get_knowledge():
+    """
+    Loads the snapshot once per process. With PIZZA_KNOWLEDGE_BUILD=1 a missing snapshot is built from Wikidata first
+    (the worker master does this before the fork); without a snapshot every description is answered by Qanary
+    """
+    global _knowledge
+    if _knowledge is None:
+        snapshot_path = environ.get("PIZZA_KNOWLEDGE_SNAPSHOT", DEFAULT_SNAPSHOT_PATH)
+        if not path.exists(snapshot_path) and environ.get("PIZZA_KNOWLEDGE_BUILD", "0") == "1":
+            try:
+                write_snapshot(snapshot_path)
+            except Exception as e:
+                logger.error(f"Could not build the pizza knowledge snapshot: {e}")
+        _knowledge = PizzaKnowledge.load(snapshot_path) or False
+    return _knowledge or None
+
+
+if __name__ == "__main__":
+    # build the snapshot: python knowledge.py [output path]
+    import sys
+
+    output_path = sys.argv[1] if len(sys.argv) > 1 else environ.get("PIZZA_KNOWLEDGE_SNAPSHOT", DEFAULT_SNAPSHOT_PATH)
+    try:
+        snapshot = write_snapshot(output_path)
+    except ConnectionError as e:
+        sys.exit(str(e))
+    print(f"Wrote {len(snapshot['entries'])} pizzas ({len(snapshot['aliases'])} aliases) to {output_path}")
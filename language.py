@@ -0,0 +1,146 @@
+import logging
+import re
+import threading
+import time
+from collections import Counter, namedtuple
+from os import environ, path
+
+from caching import TTLCache, normalize_key_text
+
+
+logger = logging.getLogger(__name__)
+
+LanguageDecision = namedtuple("LanguageDecision", ["language", "source"])
+
+
+class Sources:
+    SESSION = "session" # fast path, the language detected earlier in the session
+    DETECTED = "detected"
+    DEFAULT = "default"
+
+
+LANGUAGE_NAMES = {"en": "English", "de": "German", "fr": "French", "it": "Italian", "es": "Spanish", "nl": "Dutch", "pl": "Polish"}
+
+
+def language_name(code: str) -> str:
+    """
+    "de" -> "German", for prompts; unknown codes are returned as they are
+    """
+    return LANGUAGE_NAMES.get(code, code)
+
+
+# words that say nothing about the language of a chat message
+NEUTRAL_WORDS = {"ok", "okay", "pizza", "pizzas", "hi", "hey", "yes", "no", "thanks", "please", "bye"}
+
+
+class LanguageDetector:
+    """
+    langdetect with the profiles loaded once per process, restricted to `languages`.
+
+    Short input (below `min_length` characters or `min_words` words) and input made only of menu words and numbers
+    is not detected at all, the language of the session (or `default`) is kept. So is the language for text that
+    langdetect is not at least `confidence` sure about. Detections are cached by the normalized text
+    """
+
+    def __init__(self, languages: list = None, default: str = "en", min_length: int = 20, min_words: int = 3,
+                 confidence: float = 0.8, max_text_length: int = 200, cache_size: int = 4096):
+        self.languages = languages # None: all profiles shipped with langdetect
+        self.default = default
+        self.min_length = min_length
+        self.min_words = min_words
+        self.confidence = confidence
+        self.max_text_length = max_text_length
+        self.cache = TTLCache(maxsize=cache_size, ttl=86400)
+        self.decisions = Counter()
+        self._factory = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Loads the language profiles, the slow part of langdetect
+        """
+        if self._factory is not None:
+            return self._factory
+        with self._lock:
+            if self._factory is None:
+                from langdetect import DetectorFactory
+                from langdetect.detector_factory import PROFILES_DIRECTORY
+
+                start = time.perf_counter()
+                factory = DetectorFactory()
+                factory.seed = 0 # deterministic results for the same text
+                if self.languages:
+                    profiles = []
+                    for language in self.languages:
+                        with open(path.join(PROFILES_DIRECTORY, language), encoding="utf-8") as f:
+                            profiles.append(f.read())
+                    factory.load_json_profile(profiles)
+                else:
+                    factory.load_profile(PROFILES_DIRECTORY)
+                self._factory = factory
+                logger.info(f"Loaded {len(factory.get_lang_list())} language profiles in {time.perf_counter() - start:.2f}s")
+        return self._factory
+
+    def is_uninformative(self, text: str, vocabulary=()) -> bool:
+        words = re.findall(r"\w+", text.lower())
+        if len(text.strip()) < self.min_length or len(words) < self.min_words:
+            return True
+        return all(word.isdigit() or word in NEUTRAL_WORDS or word in vocabulary for word in words)
+
+    def detect_text(self, text: str):
+        """
+        Returns (language, probability) of the most likely language, None if the text has no features
+        """
+        from langdetect.lang_detect_exception import LangDetectException
+
+        key = normalize_key_text(text)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        detector = self.load().create()
+        detector.set_max_text_length(self.max_text_length)
+        detector.append(text)
+        try:
+            best = detector.get_probabilities()[0]
+        except (LangDetectException, IndexError):
+            return None
+        result = (best.lang, best.prob)
+        self.cache.set(key, result)
+        return result
+
+    def detect(self, text: str, previous: str = None, vocabulary=()) -> LanguageDecision:
+        """
+        The language of `text`; `previous` is the language of the session so far, `vocabulary` the menu words
+        """
+        fallback = LanguageDecision(previous, Sources.SESSION) if previous else LanguageDecision(self.default, Sources.DEFAULT)
+        if self.is_uninformative(text, vocabulary):
+            decision = fallback
+        else:
+            detected = self.detect_text(text)
+            if detected is None or detected[1] < self.confidence:
+                decision = fallback
+            else:
+                decision = LanguageDecision(detected[0], Sources.DETECTED)
+        self.decisions[decision.source] += 1
+        return decision
+
+    def stats(self) -> dict:
+        total = sum(self.decisions.values())
+        return {source: {"count": count, "share": count / total} for source, count in self.decisions.items()}
+
+
+_detector = None
+
+
+def get_language_detector() -> LanguageDetector:
+    """
+    One detector per process, configured by PIZZABOT_LANGUAGES and PIZZABOT_DEFAULT_LANGUAGE
+    """
+    global _detector
+    if _detector is None:
+        languages = [l.strip() for l in environ.get("PIZZABOT_LANGUAGES", "en,de").split(",") if l.strip()]
+        _detector = LanguageDetector(
+            languages=languages or None,
+            default=environ.get("PIZZABOT_DEFAULT_LANGUAGE", "en"),
+        )
+    return _detector
@@ -0,0 +1,5 @@
+"""
+Load testing against local stand-ins for the LLM server, the Pizza API and Qanary:
+
+    python -m loadtest --conversations 200 --concurrency 50 --rate 10 --latency llm=lognormal:400,0.5
+"""
@@ -0,0 +1,68 @@
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import time
+
+from loadtest import stubs
+
+
+def start_stubs(host: str, port: int, latency: list, error_rate: list) -> subprocess.Popen:
+    """
+    The stubs run in their own process, so their work doesn't compete with the bot for the GIL
+    """
+    command = [sys.executable, "-m", "loadtest.stubs", "--host", host, "--port", str(port)]
+    command += [f"--latency={value}" for value in latency or []]
+    command += [f"--error-rate={value}" for value in error_rate or []]
+    process = subprocess.Popen(command)
+
+    import httpx
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"http://{host}:{port}/stats")
+            return process
+        except httpx.TransportError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("Stub server did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replays scripted conversations against the bot and stub backends")
+    parser.add_argument("--conversations", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20, help="conversations in flight")
+    parser.add_argument("--rate", type=float, help="conversation arrivals per second (Poisson), default: closed loop")
+    parser.add_argument("--script", action="append", help="scripts to replay, default: all")
+    parser.add_argument("--stub-host", default="127.0.0.1")
+    parser.add_argument("--stub-port", type=int, default=9000)
+    parser.add_argument("--stub-url", help="use already running stubs instead of starting them")
+    parser.add_argument("--no-llm-cache", action="store_true", help="send every LLM call to the stub")
+    parser.add_argument("--json", help="also write the report to this file")
+    stubs.add_arguments(parser)
+    args = parser.parse_args()
+
+    process = None if args.stub_url else start_stubs(args.stub_host, args.stub_port, args.latency, args.error_rate)
+    try:
+        import utils
+        from caching import TTLCache
+        from loadtest.generator import format_report, point_bot_at, run_load
+
+        point_bot_at(args.stub_url or f"http://{args.stub_host}:{args.stub_port}")
+        if args.no_llm_cache:
+            utils.llm_cache.cache = TTLCache(maxsize=0)
+        result = asyncio.run(run_load(args.conversations, args.concurrency, args.rate, args.script))
+    finally:
+        if process is not None:
+            process.terminate()
+
+    report = result.report()
+    print(format_report(report))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import asyncio
+import random
+import statistics
+import time
+import uuid
+from collections import Counter, defaultdict
+from os import environ
+
+from langgraph.checkpoint.memory import MemorySaver
+
+import utils
+from data.test_dialogue import correct_dialogue
+from pizzabot import INPUT, build_graph, initial_state, session_config
+
+
+SCRIPTS = {
+    "order": [example["inputs"][INPUT] for example in correct_dialogue],
+    # after a description the order starts over, the bot asks for the pizza again
+    "describe_then_order": [
+        "I want to order pizza",
+        "Tell me more about Hawaiian pizza",
+        "I want to order pizza",
+        "Hawaiian",
+        "Leipzig, Maksim Gorki Str. 58",
+    ],
+}
+
+
+def point_bot_at(base_url: str):
+    """
+    Sends all external calls of utils to the stub server
+    """
+    utils.pizza_api_base = base_url
+    utils.qanary_api_base = f"{base_url}/qanary"
+    utils.openai_api_base = f"{base_url}/v1"
+    utils.openai_api_key = utils.openai_api_key or "stub"
+    environ.setdefault("MODEL_NAME", "stub")
+    utils.menu_cache.invalidate()
+
+
+def percentiles(values: list) -> dict:
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def at(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+    return {"count": len(ordered), "mean": statistics.fmean(ordered), "p50": at(50), "p95": at(95), "p99": at(99), "max": ordered[-1]}
+
+
+class LoadResult:
+    def __init__(self):
+        self.turns = [] # seconds per turn
+        self.steps = defaultdict(list) # "script#turn" -> seconds
+        self.nodes = defaultdict(list) # node name -> seconds
+        self.queue_waits = [] # seconds from the scheduled arrival of a conversation to its start (open loop only)
+        self.errors = Counter() # exception type -> count
+        self.conversations = 0
+        self.incomplete = Counter() # script -> conversations that ran through without placing the order
+        self.started_at = time.perf_counter()
+        self.finished_at = None
+
+    def report(self) -> dict:
+        duration = (self.finished_at or time.perf_counter()) - self.started_at
+        return {
+            "duration": duration,
+            "conversations": self.conversations,
+            "incomplete": dict(self.incomplete),
+            "turns": len(self.turns),
+            "throughput": {"turns_per_second": len(self.turns) / duration, "conversations_per_second": self.conversations / duration},
+            "errors": dict(self.errors),
+            "turn_latency": percentiles(self.turns),
+            "queue_wait": percentiles(self.queue_waits),
+            "step_latency": {step: percentiles(values) for step, values in sorted(self.steps.items())},
+            "node_latency": {node: percentiles(values) for node, values in sorted(self.nodes.items())},
+        }
+
+
+async def run_turn(graph, thread_id: str, user_input: str, result: LoadResult, scheduled_at: float = None) -> float:
+    """
+    Runs a turn with stream_mode="updates" so the time between two updates can be attributed to the node that produced it.
+    The latency is measured from `scheduled_at` if given, so the time the turn waited to be started is included
+    """
+    config = session_config(thread_id)
+    inputs = {INPUT: user_input} if (await graph.aget_state(config)).values else initial_state(user_input)
+    start = last = time.perf_counter()
+    async for update in graph.astream(inputs, config, stream_mode="updates"):
+        now = time.perf_counter()
+        for node in update:
+            result.nodes[node].append(now - last)
+        last = now
+    return last - (start if scheduled_at is None else scheduled_at)
+
+
+async def run_conversation(graph, script_name: str, result: LoadResult, scheduled_at: float = None):
+    """
+    The first turn is measured from `scheduled_at`, the arrival time of the conversation in an open loop
+    """
+    thread_id = str(uuid.uuid4())
+    for i, user_input in enumerate(SCRIPTS[script_name]):
+        try:
+            seconds = await run_turn(graph, thread_id, user_input, result, scheduled_at if i == 0 else None)
+        except Exception as e:
+            result.errors[type(e).__name__] += 1
+            return # the rest of the script depends on this turn
+        result.turns.append(seconds)
+        result.steps[f"{script_name}#{i + 1}"].append(seconds)
+    result.conversations += 1
+    if not (await graph.aget_state(session_config(thread_id))).values.get("ended"):
+        result.incomplete[script_name] += 1
+
+
+async def run_load(conversations: int, concurrency: int, rate: float = None, scripts: list = None, graph=None) -> LoadResult:
+    """
+    Replays `conversations` scripted conversations with at most `concurrency` in flight.
+    With a `rate` (conversations per second) they arrive as a Poisson process, otherwise back to back (closed loop).
+    In the open loop arrivals follow a fixed schedule and latencies count from the scheduled arrival, so a backlog
+    waiting for one of the `concurrency` slots shows up in the numbers instead of being omitted
+    """
+    graph = graph or build_graph(MemorySaver())
+    scripts = scripts or list(SCRIPTS)
+    slots = asyncio.Semaphore(concurrency)
+    result = LoadResult()
+
+    async def start(script_name: str, scheduled_at: float = None):
+        async with slots:
+            if scheduled_at is not None:
+                result.queue_waits.append(time.perf_counter() - scheduled_at)
+            await run_conversation(graph, script_name, result, scheduled_at)
+
+    tasks = []
+    arrival = time.perf_counter()
+    for i in range(conversations):
+        if rate and i:
+            arrival += random.expovariate(rate)
+            await asyncio.sleep(max(0.0, arrival - time.perf_counter()))
+        tasks.append(asyncio.create_task(start(scripts[i % len(scripts)], arrival if rate else None)))
+    await asyncio.gather(*tasks)
+    result.finished_at = time.perf_counter()
+    return result
+
+
+def format_report(report: dict) -> str:
+    def row(name, stats):
+        if not stats["count"]:
+            return f"{name:<28} {0:>7}"
+        return (f"{name:<28} {stats['count']:>7} {stats['p50'] * 1000:>9.1f} {stats['p95'] * 1000:>9.1f} "
+                f"{stats['p99'] * 1000:>9.1f} {stats['max'] * 1000:>9.1f}")
+
+    lines = [
+        f"{report['conversations']} conversations, {report['turns']} turns in {report['duration']:.1f} s "
+        f"({report['throughput']['turns_per_second']:.1f} turns/s, {report['throughput']['conversations_per_second']:.2f} conversations/s)",
+        f"errors: {report['errors'] or 'none'}",
+        f"conversations without an order: {report['incomplete'] or 'none'}",
+        "",
+        f"{'':<28} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}",
+        row("turn", report["turn_latency"]),
+    ]
+    if report["queue_wait"]["count"]:
+        lines.append(row("queue wait", report["queue_wait"]))
+    lines += [row(f"  {step}", stats) for step, stats in report["step_latency"].items()]
+    lines += [row(f"node {node}", stats) for node, stats in report["node_latency"].items()]
+    return "\n".join(lines)
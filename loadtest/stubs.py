@@ -0,0 +1,251 @@
+"""
+Local stand-ins for the external services: python -m loadtest.stubs --port 9000 [--latency ...] [--error-rate ...]
+
+One app serves all of them, point the bot at it with
+    OPENAI_API_BASE=http://localhost:9000/v1  PIZZA_API_BASE=http://localhost:9000  QANARY_API_BASE=http://localhost:9000/qanary
+
+Latencies are given per service as `name=distribution:parameters` in milliseconds, e.g. `llm=lognormal:400,0.5`
+(median, sigma), `menu=fixed:20`, `order=uniform:50,150`, `qanary=normal:800,200`. `llm_token` is the delay
+between two streamed tokens. Error rates are `name=probability`, failing requests get a 503.
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+import uuid
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from address_parser import parse_address
+
+
+SERVICES = ("llm", "llm_token", "menu", "address", "order", "qanary", "sparql")
+
+MENU = [
+    {"id": 1, "name": "Margherita"},
+    {"id": 2, "name": "Pepperoni"},
+    {"id": 3, "name": "Hawaiian"},
+    {"id": 4, "name": "Quattro Formaggi"},
+]
+
+DESCRIPTION = ("Hawaiian pizza is a variety of pizza usually topped with pineapple pieces and ham. "
+               "It was first made in Canada in 1962.")
+
+ORDER_WORDS = re.compile(r"\b(order|want|wanna|get|buy|hungry|pizza)\b", re.IGNORECASE)
+NEGATION = re.compile(r"\b(not|don't|dont|no)\b", re.IGNORECASE)
+CHATML_MESSAGE = re.compile(r"<\|im_start\|>(\w+)\n(.*?)<\|im_end\|>", re.DOTALL)
+
+
+class Latency:
+    """
+    Random delay in seconds drawn from `fixed`, `uniform`, `normal` or `lognormal` (parameters in milliseconds)
+    """
+
+    def __init__(self, spec: str = "fixed:0"):
+        self.spec = spec
+        kind, _, parameters = spec.partition(":")
+        values = [float(v) for v in parameters.split(",") if v]
+        if kind == "fixed":
+            self.sample = lambda: values[0] / 1000
+        elif kind == "uniform":
+            self.sample = lambda: random.uniform(values[0], values[1]) / 1000
+        elif kind == "normal":
+            self.sample = lambda: max(0.0, random.gauss(values[0], values[1])) / 1000
+        elif kind == "lognormal": # median and sigma
+            self.sample = lambda: values[0] * random.lognormvariate(0, values[1]) / 1000
+        else:
+            raise ValueError(f"Unknown latency distribution: {spec}")
+
+    async def wait(self):
+        delay = self.sample()
+        if delay:
+            await asyncio.sleep(delay)
+
+
+class StubSettings:
+    def __init__(self, latencies: dict = None, error_rates: dict = None):
+        self.latencies = {name: Latency((latencies or {}).get(name, "fixed:0")) for name in SERVICES}
+        self.error_rates = {name: float((error_rates or {}).get(name, 0.0)) for name in SERVICES}
+        self.requests = {name: 0 for name in SERVICES}
+        self.errors = {name: 0 for name in SERVICES}
+
+    async def call(self, service: str):
+        """
+        Waits for the service latency, returns an error response if this request should fail
+        """
+        self.requests[service] += 1
+        await self.latencies[service].wait()
+        if random.random() < self.error_rates[service]:
+            self.errors[service] += 1
+            return JSONResponse({"error": f"injected {service} failure"}, status_code=503)
+        return None
+
+
+def parse_assignments(values: list) -> dict:
+    """
+    ["llm=fixed:100", "menu=uniform:5,20"] -> {"llm": "fixed:100", "menu": "uniform:5,20"}
+    """
+    assignments = {}
+    for value in values or []:
+        name, _, setting = value.partition("=")
+        if name not in SERVICES:
+            raise ValueError(f"Unknown service {name}, expected one of {', '.join(SERVICES)}")
+        assignments[name] = setting
+    return assignments
+
+
+def completion_text(messages: list) -> str:
+    """
+    Answers like the real model would for the three prompts of utils
+    """
+    system = messages[0]["content"] if messages else ""
+    user = messages[-1]["content"] if messages else ""
+    if "Input Validation" in system:
+        intention = bool(ORDER_WORDS.search(user)) and not NEGATION.search(user)
+        return json.dumps({"intention": intention})
+    if "Named Entity" in system:
+        city, street, house_number = parse_address(user) or ("Leipzig", "Augustusplatz", "10")
+        return json.dumps({"city": city, "street": street, "house_number": house_number})
+    return DESCRIPTION
+
+
+def usage(messages: list, text: str) -> dict:
+    prompt_tokens = sum(len(m["content"].split()) for m in messages)
+    completion_tokens = len(text.split())
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+
+
+def create_app(settings: StubSettings = None) -> Starlette:
+    settings = settings or StubSettings()
+
+    async def chat_completions(request):
+        error = await settings.call("llm")
+        if error:
+            return error
+        body = await request.json()
+        text = completion_text(body["messages"])
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        model = body.get("model") or "stub"
+
+        if not body.get("stream"):
+            return JSONResponse({
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": usage(body["messages"], text),
+            })
+
+        async def chunks():
+            for i, token in enumerate(re.findall(r"\S+\s*", text)):
+                if i:
+                    await settings.latencies["llm_token"].wait()
+                delta = {"role": "assistant", "content": token} if i == 0 else {"content": token}
+                chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                         "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+            yield f"data: {json.dumps(chunk)}\n\n"
+            if (body.get("stream_options") or {}).get("include_usage"):
+                chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                         "choices": [], "usage": usage(body["messages"], text)}
+                yield f"data: {json.dumps(chunk)}\n\n"
+            yield "data: [DONE]\n\n"
+        return StreamingResponse(chunks(), media_type="text/event-stream")
+
+    async def completions(request):
+        """
+        Multi-prompt completions with ChatML prompts, as sent by the NLU batching of utils
+        """
+        error = await settings.call("llm")
+        if error:
+            return error
+        body = await request.json()
+        prompts = body["prompt"] if isinstance(body["prompt"], list) else [body["prompt"]]
+        choices, usages = [], []
+        for index, prompt in enumerate(prompts):
+            messages = [{"role": role, "content": content} for role, content in CHATML_MESSAGE.findall(prompt)]
+            text = completion_text(messages)
+            choices.append({"index": index, "text": text, "finish_reason": "stop"})
+            usages.append(usage(messages, text))
+        return JSONResponse({
+            "id": f"cmpl-{uuid.uuid4().hex}", "object": "text_completion", "created": int(time.time()),
+            "model": body.get("model") or "stub", "choices": choices,
+            "usage": {key: sum(u[key] for u in usages) for key in ("prompt_tokens", "completion_tokens", "total_tokens")},
+        })
+
+    async def pizza(request):
+        return await settings.call("menu") or JSONResponse(MENU)
+
+    async def validate_address(request):
+        error = await settings.call("address")
+        if error:
+            return error
+        body = await request.json()
+        if not all(body.get(field) for field in ("city", "street", "house_number")):
+            return JSONResponse({"detail": "Address not found"}, status_code=404)
+        return JSONResponse({"valid": True})
+
+    async def order(request):
+        error = await settings.call("order")
+        if error:
+            return error
+        return JSONResponse({"order_id": str(uuid.uuid4()), "status": "received"})
+
+    async def qanary(request):
+        error = await settings.call("qanary")
+        if error:
+            return error
+        return JSONResponse({
+            "inGraph": f"urn:graph:{uuid.uuid4()}",
+            "endpoint": f"{request.base_url}sparql",
+        })
+
+    async def sparql(request):
+        error = await settings.call("sparql")
+        if error:
+            return error
+        answer = {"head": {"vars": ["label", "description"]}, "results": {"bindings": [
+            {"label": {"value": "Hawaiian pizza"}, "description": {"value": DESCRIPTION}},
+        ]}}
+        return JSONResponse({"head": {"vars": ["value"]}, "results": {"bindings": [
+            {"value": {"type": "literal", "value": json.dumps(answer)}},
+        ]}})
+
+    async def stats(request):
+        return JSONResponse({"requests": settings.requests, "errors": settings.errors})
+
+    app = Starlette(routes=[
+        Route("/v1/chat/completions", chat_completions, methods=["POST"]),
+        Route("/v1/completions", completions, methods=["POST"]),
+        Route("/pizza", pizza),
+        Route("/address/validate", validate_address, methods=["POST"]),
+        Route("/order", order, methods=["POST"]),
+        Route("/qanary/startquestionansweringwithtextquestion", qanary, methods=["POST"]),
+        Route("/sparql", sparql, methods=["GET", "POST"]),
+        Route("/stats", stats),
+    ])
+    app.state.settings = settings
+    return app
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency", action="append", metavar="SERVICE=DISTRIBUTION",
+                        help=f"stub latency, services: {', '.join(SERVICES)}")
+    parser.add_argument("--error-rate", action="append", metavar="SERVICE=PROBABILITY", help="stub error rate")
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Stub LLM server, Pizza API and Qanary")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    add_arguments(parser)
+    args = parser.parse_args()
+    settings = StubSettings(parse_assignments(args.latency), parse_assignments(args.error_rate))
+    uvicorn.run(create_app(settings), host=args.host, port=args.port, log_level="warning")
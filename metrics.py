@@ -0,0 +1,170 @@
+import asyncio
+import functools
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+DESCRIPTIONS = {
+    "pizzabot_node_duration_seconds": ("histogram", "Duration of a graph node run"),
+    "pizzabot_node_errors": ("counter", "Graph node runs that raised"),
+    "pizzabot_backend_duration_seconds": ("histogram", "Duration of a call to an external backend"),
+    "pizzabot_backend_errors": ("counter", "Calls to an external backend that raised"),
+    "pizzabot_llm_tokens": ("counter", "Tokens reported in the usage of the LLM responses"),
+    "pizzabot_nlu_batches": ("counter", "Batched NLU requests sent to the LLM server"),
+    "pizzabot_nlu_batched_prompts": ("counter", "Prompts sent in batched NLU requests"),
+    "pizzabot_circuit_state": ("gauge", "Circuit breaker of a backend: 0 closed, 1 open, 2 half open"),
+    "pizzabot_circuit_rejections": ("counter", "Calls rejected because the circuit of the backend is open"),
+    "pizzabot_hedged_requests": ("counter", "Duplicate requests sent because the first one was slower than the p95"),
+    "pizzabot_deadline_exceeded": ("counter", "Calls abandoned at the backend deadline"),
+}
+
+
+class Histogram:
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self) -> dict:
+        return {"count": self.count, "sum": self.sum, "buckets": dict(zip([*map(str, self.buckets), "+Inf"], self.counts))}
+
+
+def _labels(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+class Metrics:
+    """
+    In-process registry of histograms, counters and gauges, exported as OpenMetrics text or JSON
+    """
+
+    def __init__(self):
+        self.histograms = {} # (name, labels) -> Histogram
+        self.counters = {} # (name, labels) -> value
+        self.gauges = {}
+        self.descriptions = dict(DESCRIPTIONS)
+        self._lock = threading.Lock()
+
+    def describe(self, name: str, kind: str, description: str):
+        self.descriptions[name] = (kind, description)
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        self.gauges[(name, _labels(labels))] = value
+
+    @contextmanager
+    def timer(self, backend: str, kind: str = "backend"):
+        """
+        Records the duration of the block in pizzabot_<kind>_duration_seconds and counts it as an error if it raises
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception: # not cancellations
+            self.inc(f"pizzabot_{kind}_errors", **{kind: backend})
+            raise
+        finally:
+            self.observe(f"pizzabot_{kind}_duration_seconds", time.perf_counter() - start, **{kind: backend})
+
+    def timed(self, backend: str, kind: str = "backend"):
+        """
+        Decorator version of `timer` for sync and async functions
+        """
+        def decorator(function):
+            if asyncio.iscoroutinefunction(function):
+                @functools.wraps(function)
+                async def async_wrapper(*args, **kwargs):
+                    with self.timer(backend, kind):
+                        return await function(*args, **kwargs)
+                return async_wrapper
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.timer(backend, kind):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def record_usage(self, backend: str, usage):
+        """
+        Counts the prompt and completion tokens of an OpenAI response (`response.usage`, may be None)
+        """
+        if usage is None:
+            return
+        self.inc("pizzabot_llm_tokens", usage.prompt_tokens or 0, backend=backend, type="prompt")
+        self.inc("pizzabot_llm_tokens", usage.completion_tokens or 0, backend=backend, type="completion")
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "histograms": [{"name": n, "labels": dict(l), **h.snapshot()} for (n, l), h in self.histograms.items()],
+                "counters": [{"name": n, "labels": dict(l), "value": v} for (n, l), v in self.counters.items()],
+                "gauges": [{"name": n, "labels": dict(l), "value": v} for (n, l), v in self.gauges.items()],
+            }
+
+    def to_openmetrics(self) -> str:
+        def label_text(labels, extra=()):
+            pairs = [*labels, *extra]
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}" if pairs else ""
+
+        families = {}
+        with self._lock:
+            for (name, labels), histogram in self.histograms.items():
+                lines = families.setdefault(name, [])
+                cumulative = 0
+                for bound, count in zip([*map(str, histogram.buckets), "+Inf"], histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{label_text(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_count{label_text(labels)} {histogram.count}")
+                lines.append(f"{name}_sum{label_text(labels)} {histogram.sum}")
+            for (name, labels), value in self.counters.items():
+                families.setdefault(name, []).append(f"{name}_total{label_text(labels)} {value}")
+            for (name, labels), value in self.gauges.items():
+                families.setdefault(name, []).append(f"{name}{label_text(labels)} {value}")
+
+        output = []
+        for name in sorted(families):
+            kind, description = self.descriptions.get(name, ("unknown", ""))
+            output.append(f"# TYPE {name} {kind}")
+            if description:
+                output.append(f"# HELP {name} {description}")
+            output.extend(families[name])
+        output.append("# EOF")
+        return "\n".join(output) + "\n"
+
+    def dump(self, dump_path: str):
+        dump_path = dump_path.format(pid=os.getpid()) # one file per process in worker mode
+        with open(f"{dump_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump({"time": time.time(), **self.snapshot()}, f)
+        os.replace(f"{dump_path}.tmp", dump_path)
+
+    def dump_periodically(self, dump_path: str, interval: float = 60):
+        def run():
+            while True:
+                time.sleep(interval)
+                self.dump(dump_path)
+        threading.Thread(target=run, daemon=True).start()
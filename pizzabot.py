@@ -1,8 +1,20 @@
+import asyncio
+import functools
+import inspect
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from os import environ
 from typing import TypedDict
 
-from utils import logger, post_order, validate_pizza_name, check_customer_address, BasicFunctions, get_pizza_menu, check_order_intention, generate_pizza_description, call_qanary_pipeline
+from utils import logger, metrics, post_order, validate_pizza_name, check_customer_address, BasicFunctions, get_pizza_menu, check_order_intention, generate_pizza_description, get_pizza_context, stream_pizza_description, prefetch_pizza_menu
+from utils import menu_words
+from utils import apost_order, avalidate_pizza_name, acheck_customer_address, aget_pizza_menu, acheck_order_intention, agenerate_pizza_description, aget_pizza_context, astream_pizza_description, aprefetch_pizza_menu
 
+from language import Sources, get_language_detector
+from resilience import CircuitOpenError, is_backend_failure
+from structured_output import OutputParseError
 from langgraph.graph import END, StateGraph
+from langchain_core.runnables import RunnableConfig, RunnableLambda
 from langchain_core.messages import (
     AIMessage,
     FunctionMessage,
@@ -31,9 +43,16 @@ class ChatbotState(TypedDict):
     pizza_id: str
     customer_address: tuple[str]
     order_id: str
+    # compact history index, kept up to date by BasicFunctions.add_message
+    pending_slot: str # slot the bot asked for last, None if it is not waiting for one
+    last_ai_message: AIMessage
+    last_function_message: FunctionMessage
+    archived_messages: int # messages moved out of the history window
+    language: str # language of the session, set once by the LanguageDetectionNode
 
 class Nodes(Enum):
     ENTRY = "entry"
+    LANGUAGE_DETECTION = "language_detection"
     CHECKER = "checker"
     ORDER_FORM = "order_form"
     RETRIEVAL = "retrieval"
@@ -49,27 +68,59 @@ class Intents(Enum):
     DEFAULT = "default"
     DESCRIPTION = "description"
 
+def get_token_callback(config: RunnableConfig = None):
+    """
+    Returns the `on_token` callback passed with config={"configurable": {"on_token": ...}}, if any
+    """
+    return ((config or {}).get("configurable") or {}).get("on_token")
+
+
+class ConsoleTokenPrinter:
+    """
+    Prints streamed tokens as chatbot response in the console
+    """
+
+    def __init__(self):
+        self.streamed = False
+
+    def __call__(self, token: str):
+        if not self.streamed:
+            print("-- Chatbot: ", end=" ", flush=True)
+            self.streamed = True
+        print(token, end="", flush=True)
+
+
+class Checks(Enum):
+    ORDER_INTENTION = "order_intention"
+
 class CheckerNode:
     """
     This node checks whether user input is valid
     """
     
-    def __init__(self, order_keywords: list = ["order"], confirm_keywords: list = ["yes", "Yes"], description_keywords: list = ["tell me more", "describe"]):
+    # shared by all checker nodes of the process, only used in speculative mode
+    prefetch_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="checker-prefetch")
+    prefetch_tasks = set()
+
+    def __init__(self, order_keywords: list = ["order"], confirm_keywords: list = ["yes", "Yes"], description_keywords: list = ["tell me more", "describe"],
+                 speculative: bool = environ.get("PIZZABOT_SPECULATIVE_IO", "0") == "1"):
         self.order_keywords = order_keywords
         self.confirm_keywords = confirm_keywords
         self.description_keywords = description_keywords
+        self.speculative = speculative # overlap the backend check with the menu fetch of the next turn
         
 
-    def invoke(self, state: ChatbotState) -> dict:
+    def next_check(self, state: ChatbotState):
         """
-        Checks whether the input is a valid request for pizza order
+        Decides which backend check the input needs.
+        Returns the name of the check or, if the input can be handled locally, the state update
         """
         _input = state[INPUT]
 
         if any(keyword.lower() in _input.lower() for keyword in self.description_keywords):
             state["current_intent"] = Intents.DESCRIPTION.value
             return {
-                MESSAGES: state[MESSAGES],
+                **BasicFunctions.history_update(state),
                 "current_intent": state["current_intent"]
             }
         
@@ -78,56 +129,151 @@ class CheckerNode:
                 # customer provides no further information
                 state["confirm_order"] = False
                 return {
-                    MESSAGES: state[MESSAGES],
+                    **BasicFunctions.history_update(state),
                     "confirm_order": state["confirm_order"]
                 }
         
         if state['active_order']: # if we are in the order process
             # TODO instead check whether states pizza_id, customer_address... are valid
-            if OrderSlots.PIZZA_NAME.value in state[MESSAGES][-1].content: # checking pizza name validity
-                pizza_id = validate_pizza_name(_input)
-                if pizza_id is not None: # if pizza name is valid
-                    state['pizza_id'] = pizza_id
-                    return {
-                        MESSAGES: state[MESSAGES],
-                        "pizza_id": state["pizza_id"]
-                    }
-                else: # if pizza name is invalid
-                    state["invalid"] = True
-                    state['messages'].append(AIMessage(content="Invalid pizza type. Please specify a valid type (e.g. a pizza Pepperoni)'."))
-                    return {
-                        MESSAGES: state[MESSAGES],
-                        "invalid": state["invalid"]
-                    }
-                    
-            elif OrderSlots.CUSTOMER_ADDRESS.value in state[MESSAGES][-1].content: # checking customer address validity
-                customer_address = check_customer_address(_input)
-                if customer_address is not None:
-                    state['customer_address'] = customer_address
-                    return {
-                        MESSAGES: state[MESSAGES],
-                        "customer_address": state["customer_address"]
-                    }
-                else:
-                    state["invalid"] = True
-                    state['messages'].append(AIMessage(content="Invalid customer address. Please keep in mind, we only deliver to Halle, Leipzig and Dresden."))
-                    return {
-                        MESSAGES: state[MESSAGES],
-                        "invalid": state["invalid"]
-                    }
+            pending_slot = BasicFunctions.get_pending_slot(state)
+            if pending_slot == OrderSlots.PIZZA_NAME.value: # checking pizza name validity
+                return OrderSlots.PIZZA_NAME.value
+            elif pending_slot == OrderSlots.CUSTOMER_ADDRESS.value: # checking customer address validity
+                return OrderSlots.CUSTOMER_ADDRESS.value
+
+        return Checks.ORDER_INTENTION.value
+
+    def apply_check(self, state: ChatbotState, check: str, result) -> dict:
+        """
+        Updates the state with the result of the backend check
+        """
+        if check == OrderSlots.PIZZA_NAME.value:
+            pizza_id = result
+            if pizza_id is not None: # if pizza name is valid
+                state['pizza_id'] = pizza_id
+                return {
+                    **BasicFunctions.history_update(state),
+                    "pizza_id": state["pizza_id"]
+                }
+            else: # if pizza name is invalid
+                state["invalid"] = True
+                BasicFunctions.add_message(state, AIMessage(content="Invalid pizza type. Please specify a valid type (e.g. a pizza Pepperoni)'."))
+                return {
+                    **BasicFunctions.history_update(state),
+                    "invalid": state["invalid"]
+                }
+
+        if check == OrderSlots.CUSTOMER_ADDRESS.value:
+            customer_address = result
+            if customer_address is not None:
+                state['customer_address'] = customer_address
+                return {
+                    **BasicFunctions.history_update(state),
+                    "customer_address": state["customer_address"]
+                }
+            else:
+                state["invalid"] = True
+                BasicFunctions.add_message(state, AIMessage(content="Invalid customer address. Please keep in mind, we only deliver to Halle, Leipzig and Dresden."))
+                return {
+                    **BasicFunctions.history_update(state),
+                    "invalid": state["invalid"]
+                }
         
-        if not check_order_intention(_input): # User wants to order a pizza
-            state['messages'].append(AIMessage(content="Invalid order. Please specify a pizza order. Try writing e.g. 'I want to order a pizza'."))
+        if not result: # User wants to order a pizza
+            BasicFunctions.add_message(state, AIMessage(content="Invalid order. Please specify a pizza order. Try writing e.g. 'I want to order a pizza'."))
             return {
-                MESSAGES: state[MESSAGES]
+                **BasicFunctions.history_update(state)
             }
         else: # User wants to order a pizza
             state['active_order'] = True
-            # state['messages'].append(AIMessage(content="Your pizza order is valid."))
+            # BasicFunctions.add_message(state, AIMessage(content="Your pizza order is valid."))
             return {
-                MESSAGES: state[MESSAGES],
+                **BasicFunctions.history_update(state),
                 "active_order": state["active_order"]
             }
+
+    def degraded_result(self, check: str, error: Exception):
+        """
+        The result a check falls back to if its backend is unavailable or its answer unusable: the input counts as
+        not understood (no order intention, invalid pizza or address) and the user is asked again
+        """
+        if not (is_backend_failure(error) or isinstance(error, OutputParseError)):
+            raise error
+        logger.warning(f"{check} check failed, answering with the degraded reply: {error!r}")
+        return False if check == Checks.ORDER_INTENTION.value else None
+
+    def run_check(self, check: str, function, _input):
+        try:
+            return function(_input)
+        except Exception as e:
+            return self.degraded_result(check, e)
+
+    async def arun_check(self, check: str, function, _input):
+        try:
+            return await function(_input)
+        except Exception as e:
+            return self.degraded_result(check, e)
+
+    def needs_menu_next(self, state: ChatbotState) -> bool:
+        """
+        Whether the order form will show the menu after this turn (i.e. no pizza was chosen yet)
+        """
+        return bool(state["active_order"]) and OrderSlots.PIZZA_NAME.value not in state[SLOTS]
+
+    def invoke(self, state: ChatbotState) -> dict:
+        """
+        Checks whether the input is a valid request for pizza order
+        """
+        check = self.next_check(state)
+        if isinstance(check, dict):
+            return check
+
+        checks = {
+            OrderSlots.PIZZA_NAME.value: validate_pizza_name,
+            OrderSlots.CUSTOMER_ADDRESS.value: check_customer_address,
+            Checks.ORDER_INTENTION.value: check_order_intention,
+        }
+        if not self.speculative or check != Checks.ORDER_INTENTION.value:
+            return self.apply_check(state, check, self.run_check(check, checks[check], state[INPUT]))
+
+        # speculative mode: fetch the menu for the order form while the intent check is in flight
+        prefetch = self.prefetch_executor.submit(prefetch_pizza_menu)
+        try:
+            update = self.apply_check(state, check, self.run_check(check, checks[check], state[INPUT]))
+        except Exception:
+            prefetch.cancel()
+            raise
+        if not self.needs_menu_next(state):
+            prefetch.cancel() # only stops it if it has not started yet, a running fetch just warms the cache
+        return update
+
+    async def ainvoke(self, state: ChatbotState) -> dict:
+        """
+        Async version of `invoke`
+        """
+        check = self.next_check(state)
+        if isinstance(check, dict):
+            return check
+
+        checks = {
+            OrderSlots.PIZZA_NAME.value: avalidate_pizza_name,
+            OrderSlots.CUSTOMER_ADDRESS.value: acheck_customer_address,
+            Checks.ORDER_INTENTION.value: acheck_order_intention,
+        }
+        if not self.speculative or check != Checks.ORDER_INTENTION.value:
+            return self.apply_check(state, check, await self.arun_check(check, checks[check], state[INPUT]))
+
+        prefetch = asyncio.create_task(aprefetch_pizza_menu())
+        self.prefetch_tasks.add(prefetch) # keep a reference until the task is done
+        prefetch.add_done_callback(self.prefetch_tasks.discard)
+        try:
+            update = self.apply_check(state, check, await self.arun_check(check, checks[check], state[INPUT]))
+        except BaseException:
+            prefetch.cancel()
+            raise
+        if not self.needs_menu_next(state):
+            prefetch.cancel()
+        return update
     
     def route(self, state: ChatbotState) -> str:
         """
@@ -148,18 +294,49 @@ class DescriptionNode:
     def __init__(self):
         pass
 
-    def invoke(self, state: ChatbotState) -> dict:
+    def invoke(self, state: ChatbotState, config: RunnableConfig = None) -> dict:
         """
-        Returns a description of the pizza
+        Returns a description of the pizza.
+        If an `on_token` callback is configured, the description is streamed to it while it is generated
         """
         _input = state[INPUT] # user message
-        context = call_qanary_pipeline(_input) # fetching the context from wikidata
-        logger.info(f"Context from Qanary: {context}")
-        description = generate_pizza_description(_input, str(context)) # generating the description with LLM
-        state["messages"].append(AIMessage(content=description))
+        context = get_pizza_context(_input) # fetching the context from the wikidata snapshot or Qanary
+        logger.debug(f"Pizza context: {context}")
+        on_token = get_token_callback(config)
+        if on_token is None:
+            description = generate_pizza_description(_input, str(context), session_language(state)) # generating the description with LLM
+        else:
+            tokens = []
+            for token in stream_pizza_description(_input, str(context), session_language(state)):
+                tokens.append(token)
+                on_token(token)
+            description = "".join(tokens)
+        return self.answer(state, description)
+
+    async def ainvoke(self, state: ChatbotState, config: RunnableConfig = None) -> dict:
+        """
+        Async version of `invoke`, `on_token` may be a coroutine function
+        """
+        _input = state[INPUT]
+        context = await aget_pizza_context(_input)
+        logger.debug(f"Pizza context: {context}")
+        on_token = get_token_callback(config)
+        if on_token is None:
+            description = await agenerate_pizza_description(_input, str(context), session_language(state))
+        else:
+            tokens = []
+            async for token in astream_pizza_description(_input, str(context), session_language(state)):
+                tokens.append(token)
+                if inspect.isawaitable(result := on_token(token)):
+                    await result
+            description = "".join(tokens)
+        return self.answer(state, description)
+
+    def answer(self, state: ChatbotState, description: str) -> dict:
+        BasicFunctions.add_message(state, AIMessage(content=description))
 
         return {
-            MESSAGES: state[MESSAGES],
+            **BasicFunctions.history_update(state),
             "current_intent": Intents.DEFAULT.value,
         }
 
@@ -171,60 +348,161 @@ class OrderNode:
     def __init__(self):
         pass
 
-    def invoke(self, state: ChatbotState) -> dict:
+    def next_slot(self, state: ChatbotState):
         """
-        Returns fallback message
+        Returns the next slot to fill or, if the last input was invalid, the state update
         """
-        
         required_slots = [OrderSlots.PIZZA_NAME, OrderSlots.CUSTOMER_ADDRESS, OrderSlots.ORDER_ID]
         missing_slots = BasicFunctions.get_last_missing_slots(state, required_slots)
         
         
         if state["invalid"]:
-            last_function_message = BasicFunctions.get_last_function_message(outputs)
+            last_function_message = BasicFunctions.get_last_function_message(state)
             state["invalid"] = False
-            state[MESSAGES].append(last_function_message)
+            BasicFunctions.add_message(state, last_function_message)
             return {
-                MESSAGES: state[MESSAGES],
+                **BasicFunctions.history_update(state),
                 "invalid": state["invalid"]
             }
 
-        next_slot = missing_slots[0] # get next slot to fill
-        
+        return missing_slots[0] # get next slot to fill
+
+    def invoke(self, state: ChatbotState) -> dict:
+        """
+        Returns fallback message
+        """
+        next_slot = self.next_slot(state)
+        if isinstance(next_slot, dict):
+            return next_slot
+
         if next_slot == OrderSlots.ORDER_ID.value:
-            order_id = post_order(state["pizza_id"], state["customer_address"]) # post order
-            if order_id is not None:
-                state['order_id'] = order_id
-                state['messages'].append(AIMessage(content="Thank you for providing all the details. Your order is being processed! "
-                    + "Keep your order id ready incase you have further inquiries: " + state["order_id"] + " ."))
-                state['ended'] = True
-                return {
-                    MESSAGES: state[MESSAGES],
-                    "order_id": state["order_id"],
-                    "ended": state["ended"]
-                }
-            else:
-                state['messages'].append(AIMessage(content="Something went wrong while submitting your order, please try again."))
-                state['ended'] = True
-                return {
-                    MESSAGES: state[MESSAGES],
-                    "invalid": state["invalid"]
-                } 
+            try:
+                order_id = post_order(state["pizza_id"], state["customer_address"]) # post order
+            except Exception as e:
+                return self.order_failed(state, e)
+            return self.order_submitted(state, order_id)
+        if next_slot == OrderSlots.PIZZA_NAME.value:
+            try:
+                menu = get_pizza_menu()
+            except Exception as e:
+                return self.menu_failed(state, e)
+            return self.ask_for_pizza(state, menu)
+        return self.ask_for_address(state)
 
+    async def ainvoke(self, state: ChatbotState) -> dict:
+        """
+        Async version of `invoke`
+        """
+        next_slot = self.next_slot(state)
+        if isinstance(next_slot, dict):
+            return next_slot
+
+        if next_slot == OrderSlots.ORDER_ID.value:
+            try:
+                order_id = await apost_order(state["pizza_id"], state["customer_address"])
+            except Exception as e:
+                return self.order_failed(state, e)
+            return self.order_submitted(state, order_id)
         if next_slot == OrderSlots.PIZZA_NAME.value:
-            menu = get_pizza_menu()
-            state['messages'].append(AIMessage("What pizza would you like to order?\nOr should I describe the pizza for you? Here are the options: " + menu))
-            state[MESSAGES].append(FunctionMessage(content=OrderSlots.PIZZA_NAME, name=OrderSlots.PIZZA_NAME.value))
+            try:
+                menu = await aget_pizza_menu()
+            except Exception as e:
+                return self.menu_failed(state, e)
+            return self.ask_for_pizza(state, menu)
+        return self.ask_for_address(state)
+
+    def order_submitted(self, state: ChatbotState, order_id) -> dict:
+        if order_id is not None:
+            state['order_id'] = order_id
+            BasicFunctions.add_message(state, AIMessage(content="Thank you for providing all the details. Your order is being processed! "
+                + "Keep your order id ready incase you have further inquiries: " + state["order_id"] + " ."))
+            state['ended'] = True
             return {
-                MESSAGES: state[MESSAGES]
+                **BasicFunctions.history_update(state),
+                "order_id": state["order_id"],
+                "ended": state["ended"]
             }
-        
-        elif next_slot == OrderSlots.CUSTOMER_ADDRESS.value:
-            state['messages'].append(AIMessage("What is your delivery address?"))
-            state[MESSAGES].append(FunctionMessage(content=OrderSlots.CUSTOMER_ADDRESS, name=OrderSlots.CUSTOMER_ADDRESS.value))
+        else:
+            BasicFunctions.add_message(state, AIMessage(content="Something went wrong while submitting your order, please try again."))
+            state['ended'] = True
             return {
-                MESSAGES: state[MESSAGES]
-            }
+                **BasicFunctions.history_update(state),
+                "invalid": state["invalid"]
+            } 
+
+    def order_failed(self, state: ChatbotState, error: Exception) -> dict:
+        """
+        An open circuit means the order was not sent, the user may try again. After any other backend failure the
+        order may have been placed, so the user is not asked to order again
+        """
+        if isinstance(error, CircuitOpenError):
+            logger.warning(f"Order not sent: {error!r}")
+            return self.order_submitted(state, None)
+        if not is_backend_failure(error):
+            raise error
+        logger.error(f"Order placement failed, the order may have been placed: {error!r}")
+        BasicFunctions.add_message(state, AIMessage(content="We could not confirm your order, it may still be processed. "
+            + "Please contact the pizzeria before ordering again."))
+        state['ended'] = True
+        return {
+            **BasicFunctions.history_update(state),
+            "ended": state["ended"]
+        }
+
+    def menu_failed(self, state: ChatbotState, error: Exception) -> dict:
+        """
+        Without a menu the pizza is still asked for, the name is checked once the Pizza API answers again
+        """
+        if not is_backend_failure(error):
+            raise error
+        logger.warning(f"Pizza menu not available: {error!r}")
+        return self.ask_for_pizza(state, None)
+
+    def ask_for_pizza(self, state: ChatbotState, menu: str) -> dict:
+        if menu is None:
+            BasicFunctions.add_message(state, AIMessage("What pizza would you like to order?\n"
+                + "I cannot load the menu right now, please try again in a moment."))
+        else:
+            BasicFunctions.add_message(state, AIMessage("What pizza would you like to order?\nOr should I describe the pizza for you? Here are the options: " + menu))
+        BasicFunctions.add_message(state, FunctionMessage(content=OrderSlots.PIZZA_NAME.value, name=OrderSlots.PIZZA_NAME.value))
+        return {
+            **BasicFunctions.history_update(state)
+        }
+
+    def ask_for_address(self, state: ChatbotState) -> dict:
+        BasicFunctions.add_message(state, AIMessage("What is your delivery address?"))
+        BasicFunctions.add_message(state, FunctionMessage(content=OrderSlots.CUSTOMER_ADDRESS.value, name=OrderSlots.CUSTOMER_ADDRESS.value))
+        return {
+            **BasicFunctions.history_update(state)
+        }
+
+def session_language(state: ChatbotState) -> str:
+    return state.get("language") or get_language_detector().default
+
+
+class LanguageDetectionNode:
+    """
+    Entry node: detects the language of the session and keeps it fixed once it is set.
+    Short and menu-word-only input is not detected, the session keeps the default language until a message
+    is long enough. Unlike a per-message detection, later long messages do not re-detect the language, so a
+    German address or pizza name does not switch an English session in the middle of an order
+    """
+
+    def __init__(self, detector=None):
+        self.detector = detector or get_language_detector()
+        self.detector.load() # once at startup, not in the first turn
+
+    def invoke(self, state: ChatbotState) -> dict:
+        language = state.get("language") # a node has to write at least one key, unchanged if already set
+        if not language:
+            decision = self.detector.detect(state[INPUT], vocabulary=menu_words())
+            if decision.source == Sources.DETECTED:
+                language = decision.language
+        return {"language": language}
+
+    async def ainvoke(self, state: ChatbotState) -> dict:
+        return self.invoke(state) # CPU only and short (cached, text length capped), not worth a thread hop
+
 
 class RetrievalNode:
     """
@@ -238,11 +516,11 @@ class RetrievalNode:
         """
         Extracts the information from user input
         """
-        last_message = BasicFunctions.get_last_message_or_no_message(state)
+        pending_slot = BasicFunctions.get_pending_slot(state)
 
-        if not state['active_order'] or not isinstance(last_message, FunctionMessage): # if nothing to extract
+        if not state['active_order'] or pending_slot is None: # if nothing to extract
             return {
-                MESSAGES: state[MESSAGES],
+                **BasicFunctions.history_update(state),
                 SLOTS: state[SLOTS],
                 "ended": state["ended"]
             }
@@ -251,37 +529,91 @@ class RetrievalNode:
 
         #TODO move input saving into here
 
-        if last_message.content == OrderSlots.PIZZA_NAME.value: # set pizza name
+        if pending_slot == OrderSlots.PIZZA_NAME.value: # set pizza name
             state['slots'][OrderSlots.PIZZA_NAME.value] = _input
             return {
-                MESSAGES: state[MESSAGES],
+                **BasicFunctions.history_update(state),
                 SLOTS: state[SLOTS],
                 "ended": state["ended"]
             }
-        elif last_message.content == OrderSlots.CUSTOMER_ADDRESS.value: # set customer address
+        elif pending_slot == OrderSlots.CUSTOMER_ADDRESS.value: # set customer address
             state['slots'][OrderSlots.CUSTOMER_ADDRESS.value] = _input
             return {
-                MESSAGES: state[MESSAGES],
+                **BasicFunctions.history_update(state),
                 SLOTS: state[SLOTS],
                 "ended": state["ended"]
             }
         
 
-if __name__ == "__main__":
+def initial_state(user_input: str) -> dict:
+    return {
+        INPUT: user_input,
+        SLOTS: {},
+        MESSAGES: [],
+        "active_order": False,
+        "confirm_order": False,
+        "pizza_id": None,
+        "current_intent": Intents.DEFAULT.value,
+        "customer_address": None,
+        "invalid": False,
+        "ended": False,
+        "language": None
+    }
+
+
+def session_config(thread_id: str, on_token=None) -> dict:
+    configurable = {"thread_id": thread_id}
+    if on_token is not None:
+        configurable["on_token"] = on_token
+    return {"configurable": configurable}
+
+
+def chat_turn(graph, thread_id: str, user_input: str, on_token=None) -> dict:
+    """
+    Runs one turn of the session `thread_id` on a graph compiled with a checkpointer.
+    Only the new user input is sent, the rest of the state is restored from the checkpoint
+    """
+    config = session_config(thread_id, on_token)
+    if graph.get_state(config).values:
+        return graph.invoke({INPUT: user_input}, config)
+    return graph.invoke(initial_state(user_input), config)
+
+
+async def achat_turn(graph, thread_id: str, user_input: str, on_token=None) -> dict:
+    config = session_config(thread_id, on_token)
+    if (await graph.aget_state(config)).values:
+        return await graph.ainvoke({INPUT: user_input}, config)
+    return await graph.ainvoke(initial_state(user_input), config)
+
+
+def timed_node(name: str, node):
+    """
+    The node as a runnable whose runs are recorded in the pizzabot_node_duration_seconds histogram
+    """
+    invoke = metrics.timed(name, kind="node")(node.invoke)
+    if hasattr(node, "ainvoke"):
+        return RunnableLambda(invoke, afunc=metrics.timed(name, kind="node")(node.ainvoke))
+    return invoke
+
+
+@functools.lru_cache(maxsize=None)
+def build_graph(checkpointer=None):
+    """
+    Wires and compiles the dialogue graph, once per process (and checkpointer)
+    """
     # Initialize nodes
     order_node = OrderNode()
     checker_node = CheckerNode()
     retrieval_node = RetrievalNode()
     description_node = DescriptionNode()
+    language_node = LanguageDetectionNode()
 
     workflow = StateGraph(ChatbotState)
-    # TODO set entrypoint as language detection-node
-    #either use it to set a state (enum)
-    #or route to language dependant nodes
-    workflow.add_node(Nodes.CHECKER.value, checker_node.invoke)
-    workflow.add_node(Nodes.RETRIEVAL.value, retrieval_node.invoke)
-    workflow.add_node(Nodes.ORDER_FORM.value, order_node.invoke)
-    workflow.add_node(Nodes.DESCRIPTION.value, description_node.invoke)
+    workflow.add_node(Nodes.LANGUAGE_DETECTION.value, timed_node(Nodes.LANGUAGE_DETECTION.value, language_node))
+    workflow.add_node(Nodes.CHECKER.value, timed_node(Nodes.CHECKER.value, checker_node))
+    workflow.add_node(Nodes.RETRIEVAL.value, timed_node(Nodes.RETRIEVAL.value, retrieval_node))
+    workflow.add_node(Nodes.ORDER_FORM.value, timed_node(Nodes.ORDER_FORM.value, order_node))
+    workflow.add_node(Nodes.DESCRIPTION.value, timed_node(Nodes.DESCRIPTION.value, description_node))
 
     workflow.add_conditional_edges(
         Nodes.CHECKER.value,
@@ -292,36 +624,35 @@ if __name__ == "__main__":
             END: END,
         }
     )
+    workflow.add_edge(Nodes.LANGUAGE_DETECTION.value, Nodes.CHECKER.value)
     workflow.add_edge(Nodes.RETRIEVAL.value, Nodes.ORDER_FORM.value)
     workflow.add_edge(Nodes.DESCRIPTION.value, END)
     workflow.add_edge(Nodes.ORDER_FORM.value, END)
     
-    workflow.set_entry_point(Nodes.CHECKER.value)
-    graph = workflow.compile()
+    workflow.set_entry_point(Nodes.LANGUAGE_DETECTION.value)
+    return workflow.compile(checkpointer=checkpointer)
+
+
+if __name__ == "__main__":
+    from checkpoints import create_checkpointer
+
+    graph = build_graph(create_checkpointer())
+    thread_id = str(uuid.uuid4())
 
     # START DIALOGUE: first message
     print("-- Chatbot: ", "Hi! I am a pizza bot. I can help you order a pizza. What would you like to order?")
-    user_input = input("-> Your response: ")
-    outputs = graph.invoke({
-        INPUT: user_input,
-        SLOTS: {},
-        MESSAGES: [],
-        "active_order": False,
-        "confirm_order": False,
-        "pizza_id": None,
-        "current_intent": Intents.DEFAULT.value,
-        "customer_address": None,
-        "invalid": False,
-        "ended": False
-    })
 
     while True:
-        print("-- Chatbot: ", [m.content for m in outputs[MESSAGES] if isinstance(m, AIMessage) ][-1]) # print chatbot response
         user_input = input("-> Your response: ")
 
-        outputs = graph.invoke({INPUT: user_input, SLOTS: outputs[SLOTS], MESSAGES: outputs[MESSAGES], "active_order": outputs["active_order"], "confirm_order":outputs["confirm_order"], "pizza_id":outputs["pizza_id"], "customer_address":outputs["customer_address"], "invalid":outputs["invalid"], "ended": outputs["ended"]})
+        printer = ConsoleTokenPrinter() # streams descriptions while they are generated
+        outputs = chat_turn(graph, thread_id, user_input, on_token=printer)
+
+        if printer.streamed: # the response was already printed token by token
+            print()
+        else:
+            print("-- Chatbot: ", BasicFunctions.get_last_ai_message(outputs).content) # print chatbot response
 
         # check if the conversation has ended
         if outputs["ended"]:
-            print("-- Chatbot: ", [m.content for m in outputs[MESSAGES] if isinstance(m, AIMessage) ][-1]) # print chatbot response
-            break
\ No newline at end of file
+            break
@@ -0,0 +1,389 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import functools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+# default deadlines (seconds) per backend, can be overwritten with PIZZABOT_DEADLINES="intent_llm=5,qanary=15"
+DEFAULT_DEADLINES = {
+    "default": 10,
+    "intent_llm": 10,
+    "ner_llm": 10,
+    "description_llm": 30,
+    "qanary": 20,
+    "sparql": 10,
+    "address_validate": 5,
+    "menu": 5,
+}
+
+# exception classes of the HTTP / LLM clients that mean the backend was not reached (matched by name, the
+# clients are optional imports)
+TRANSPORT_ERRORS = ("TransportError", "APIConnectionError")
+
+
+def parse_deadlines(value: str) -> dict:
+    deadlines = dict(DEFAULT_DEADLINES)
+    for pair in filter(None, (p.strip() for p in (value or "").split(","))):
+        backend, _, seconds = pair.partition("=")
+        deadlines[backend.strip()] = float(seconds)
+    return deadlines
+
+
+class CircuitOpenError(ConnectionError):
+    pass
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+def is_backend_failure(error: BaseException) -> bool:
+    """
+    Whether an error says something about the health of the backend: transport errors, timeouts and 5xx answers.
+    Errors handling an answer (parsing, validation, 4xx) are not counted by the circuit breaker
+    """
+    if isinstance(error, ValueError): # includes the JSON errors of requests, which are also OSErrors
+        return False
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    if status is not None:
+        return status >= 500
+    if isinstance(error, OSError): # ConnectionError, TimeoutError and the errors of requests
+        return True
+    return any(cls.__name__ in TRANSPORT_ERRORS for cls in type(error).__mro__)
+
+
+class LatencyWindow:
+    """
+    Durations of the last `size` successful calls, for the hedging delay
+    """
+
+    def __init__(self, size: int = 256):
+        self.durations = deque(maxlen=size)
+
+    def observe(self, seconds: float):
+        self.durations.append(seconds)
+
+    def percentile(self, q: float):
+        durations = sorted(self.durations)
+        if not durations:
+            return None
+        return durations[min(len(durations) - 1, int(q * len(durations)))]
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls for `reset_timeout` seconds,
+    then lets a single probe call through (half open) that closes it again or re-opens it.
+    The state is exported as the pizzabot_circuit_state gauge (0 closed, 1 open, 2 half open)
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 0, 1, 2
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30, metrics=None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.metrics = metrics
+        self.state = self.CLOSED
+        self.failures = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self._set_state(self.CLOSED)
+
+    def _set_state(self, state: int):
+        self.state = state
+        if self.metrics is not None:
+            self.metrics.set("pizzabot_circuit_state", state, backend=self.name)
+
+    def allow(self):
+        """
+        Raises `CircuitOpenError` while the backend is considered unhealthy
+        """
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._set_state(self.HALF_OPEN)
+            if self.state == self.CLOSED or (self.state == self.HALF_OPEN and not self._probing):
+                self._probing = self.state == self.HALF_OPEN
+                return
+            self.rejected += 1
+        if self.metrics is not None:
+            self.metrics.inc("pizzabot_circuit_rejections", backend=self.name)
+        raise CircuitOpenError(f"{self.name} is unavailable, circuit open after {self.failures} failures")
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            if self.state != self.CLOSED:
+                self._set_state(self.CLOSED)
+
+    def release(self):
+        """
+        Ends a call that was cancelled before it had an outcome, a half open circuit lets the next probe through
+        """
+        with self._lock:
+            self._probing = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                if self.state != self.OPEN:
+                    self._set_state(self.OPEN)
+
+
+class ResilientBackend:
+    """
+    Deadline, hedging and circuit breaker for the calls to one backend.
+
+    A call that has not answered after the p95 latency of the recent calls (at least `min_hedge_delay`) gets a
+    duplicate, the first answer wins. Callers get `DeadlineExceeded` after `deadline` seconds in any case.
+    Only deadlines and the errors of `is_backend_failure` count as failures; hedging is for idempotent calls only
+    """
+
+    def __init__(self, name: str, deadline: float, hedge: bool = True, breaker: CircuitBreaker = None,
+                 min_hedge_delay: float = 0.05, min_samples: int = 20, executor=None, metrics=None):
+        self.name = name
+        self.deadline = deadline
+        self.hedge = hedge
+        self.breaker = breaker or CircuitBreaker(name, metrics=metrics)
+        self.min_hedge_delay = min_hedge_delay
+        self.min_samples = min_samples
+        self.executor = executor # callable returning the executor of sync attempts
+        self.metrics = metrics
+        self.latencies = LatencyWindow()
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.deadlines_exceeded = 0
+
+    def hedge_delay(self):
+        if not self.hedge or len(self.latencies.durations) < self.min_samples:
+            return None
+        return max(self.min_hedge_delay, self.latencies.percentile(0.95))
+
+    def _succeeded(self, start: float, attempt: int):
+        self.latencies.observe(time.monotonic() - start)
+        self.breaker.success()
+        if attempt > 0:
+            self.hedge_wins += 1
+
+    def _failed(self, deadline_exceeded: bool, error: BaseException = None):
+        if not deadline_exceeded and not is_backend_failure(error):
+            self.breaker.success() # the backend answered, the caller could not use the answer
+            return
+        self.breaker.failure()
+        if deadline_exceeded:
+            self.deadlines_exceeded += 1
+            if self.metrics is not None:
+                self.metrics.inc("pizzabot_deadline_exceeded", backend=self.name)
+
+    def _hedging(self):
+        self.hedged += 1
+        if self.metrics is not None:
+            self.metrics.inc("pizzabot_hedged_requests", backend=self.name)
+
+    def call(self, function, *args, **kwargs):
+        self.breaker.allow()
+        self.calls += 1
+        start = time.monotonic()
+        hedge_at = self.hedge_delay()
+        hedge_at = start + hedge_at if hedge_at is not None else None
+        executor = self.executor()
+        attempts = {executor.submit(contextvars.copy_context().run, function, *args, **kwargs): 0}
+        pending = set(attempts)
+        error = None
+        try:
+            while pending:
+                now = time.monotonic()
+                if now >= start + self.deadline:
+                    break
+                wait_until = min(start + self.deadline, hedge_at) if hedge_at is not None else start + self.deadline
+                done, pending = concurrent.futures.wait(pending, timeout=wait_until - now, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        self._succeeded(start, attempts[future])
+                        return future.result()
+                    error = future.exception()
+                if hedge_at is not None and not done and time.monotonic() >= hedge_at:
+                    hedge_at = None
+                    self._hedging()
+                    future = executor.submit(contextvars.copy_context().run, function, *args, **kwargs)
+                    attempts[future] = 1
+                    pending.add(future)
+        except BaseException: # interrupted while waiting, there is no outcome to count
+            self.breaker.release()
+            raise
+
+        self._failed(bool(pending), error) # abandoned attempts still end with their HTTP timeout
+        if pending:
+            raise DeadlineExceeded(f"{self.name} did not answer within {self.deadline}s")
+        raise error
+
+    async def acall(self, function, *args, **kwargs):
+        self.breaker.allow()
+        self.calls += 1
+        start = time.monotonic()
+        hedge_at = self.hedge_delay()
+        hedge_at = start + hedge_at if hedge_at is not None else None
+        attempts = {asyncio.ensure_future(function(*args, **kwargs)): 0}
+        pending = set(attempts)
+        error = None
+        try:
+            while pending:
+                now = time.monotonic()
+                if now >= start + self.deadline:
+                    break
+                wait_until = min(start + self.deadline, hedge_at) if hedge_at is not None else start + self.deadline
+                done, pending = await asyncio.wait(pending, timeout=wait_until - now, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        self._succeeded(start, attempts[task])
+                        return task.result()
+                    error = task.exception()
+                if hedge_at is not None and not done and time.monotonic() >= hedge_at:
+                    hedge_at = None
+                    self._hedging()
+                    task = asyncio.ensure_future(function(*args, **kwargs))
+                    attempts[task] = 1
+                    pending.add(task)
+        except BaseException: # cancelled (e.g. the client of the turn disconnected), there is no outcome to count
+            self.breaker.release()
+            raise
+        finally:
+            for task in attempts:
+                if not task.done(): # the losing attempt, or all of them on deadline / cancellation
+                    task.cancel()
+
+        self._failed(bool(pending), error)
+        if pending:
+            raise DeadlineExceeded(f"{self.name} did not answer within {self.deadline}s")
+        raise error
+
+    @contextmanager
+    def guard(self):
+        """
+        Circuit breaker only, for calls that can neither be hedged nor abandoned (token streams, order placement)
+        """
+        self.breaker.allow()
+        self.calls += 1
+        try:
+            yield
+        except Exception as e:
+            self._failed(False, e)
+            raise
+        except BaseException: # cancelled, or a token stream closed by its consumer (GeneratorExit)
+            self.breaker.release()
+            raise
+        self.breaker.success()
+
+    def stats(self) -> dict:
+        return {
+            "state": ("closed", "open", "half_open")[self.breaker.state],
+            "calls": self.calls,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "deadlines_exceeded": self.deadlines_exceeded,
+            "rejected": self.breaker.rejected,
+            "hedge_delay": self.hedge_delay(),
+        }
+
+
+class Resilience:
+    """
+    Registry of the `ResilientBackend`s, one per backend name.
+
+    Sync calls run in a thread pool per backend (at most `max_threads` threads each) so that the caller can stop
+    waiting at the deadline, and a slow backend only exhausts its own threads. Within `inline()` they run in the
+    calling thread instead, with the circuit breaker but without deadline: for code that must not start threads,
+    such as the preload before the fork in workers.py
+    """
+
+    def __init__(self, deadlines: dict = None, hedging: bool = True, failure_threshold: int = 5, reset_timeout: float = 30,
+                 max_threads: int = 16, metrics=None):
+        self.deadlines = deadlines or dict(DEFAULT_DEADLINES)
+        self.hedging = hedging
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_threads = max_threads
+        self.metrics = metrics
+        self.backends = {}
+        self._executors = {} # backend name -> ThreadPoolExecutor
+        self._lock = threading.Lock()
+        self._inline = False
+
+    @contextmanager
+    def inline(self):
+        """
+        Sync calls made in this block run in the calling thread, no thread pool is started
+        """
+        self._inline = True
+        try:
+            yield
+        finally:
+            self._inline = False
+
+    def executor(self, name: str) -> concurrent.futures.ThreadPoolExecutor:
+        executor = self._executors.get(name)
+        if executor is None:
+            with self._lock:
+                executor = self._executors.get(name)
+                if executor is None:
+                    executor = self._executors[name] = concurrent.futures.ThreadPoolExecutor(
+                        max_workers=self.max_threads, thread_name_prefix=f"backend-{name}",
+                    )
+        return executor
+
+    def backend(self, name: str, hedge: bool = True) -> ResilientBackend:
+        backend = self.backends.get(name)
+        if backend is None:
+            breaker = CircuitBreaker(name, self.failure_threshold, self.reset_timeout, metrics=self.metrics)
+            backend = self.backends[name] = ResilientBackend(
+                name,
+                deadline=self.deadlines.get(name, self.deadlines["default"]),
+                hedge=hedge and self.hedging,
+                breaker=breaker,
+                executor=functools.partial(self.executor, name),
+                metrics=self.metrics,
+            )
+        return backend
+
+    def guarded(self, name: str, hedge: bool = True, abandon: bool = True):
+        """
+        Decorator running every call of a sync or async function through the backend `name`.
+        With `abandon=False` there is no deadline (and no hedging), only the circuit breaker: for calls whose
+        effect must not be left unknown to the caller, such as placing an order
+        """
+        backend = self.backend(name, hedge and abandon)
+
+        def decorator(function):
+            if asyncio.iscoroutinefunction(function):
+                @functools.wraps(function)
+                async def async_wrapper(*args, **kwargs):
+                    if not abandon:
+                        with backend.guard():
+                            return await function(*args, **kwargs)
+                    return await backend.acall(function, *args, **kwargs)
+                return async_wrapper
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not abandon or self._inline:
+                    with backend.guard():
+                        return function(*args, **kwargs)
+                return backend.call(function, *args, **kwargs)
+            return wrapper
+        return decorator
+
+    def stats(self) -> dict:
+        return {name: backend.stats() for name, backend in self.backends.items()}
@@ -0,0 +1,361 @@
+"""
+Headless chat server: the compiled dialogue graph behind an HTTP / WebSocket API.
+
+    uvicorn server:create_app --factory --host 0.0.0.0 --port 8000   (or: python server.py)
+
+POST /sessions                          -> {"session_id", "message"}
+POST /sessions/{session_id}/messages    {"input": "..."} -> {"message", "ended"}
+                                        with "Accept: text/event-stream" the reply is streamed as server-sent events
+WS   /sessions/{session_id}/ws          send the user input as text, receive {"type": "token"|"message"|"error", ...}
+GET  /health, GET /stats, GET /metrics (OpenMetrics)
+"""
+import asyncio
+import json
+import time
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from os import environ
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route, WebSocketRoute
+from starlette.websockets import WebSocketDisconnect
+
+from checkpoints import create_checkpointer
+from pizzabot import BasicFunctions, achat_turn, build_graph
+from utils import logger, metrics
+
+
+GREETING = "Hi! I am a pizza bot. I can help you order a pizza. What would you like to order?"
+
+
+class Overloaded(Exception):
+    pass
+
+
+class Session:
+    __slots__ = ("session_id", "created_at", "last_seen", "turns", "lock")
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.created_at = self.last_seen = time.monotonic()
+        self.turns = 0
+        self.lock = asyncio.Lock() # one turn at a time per session
+
+
+class SessionStore:
+    """
+    Server-side session registry. The dialogue state itself lives in the graph checkpointer (keyed by
+    session id), the store only keeps a few bytes per session and expires idle sessions. Sessions that are
+    not registered, e.g. after a restart or when the session was created by another worker, are looked up in
+    the checkpointer.
+
+    With `shared=True` (worker mode) the checkpointer is shared with other processes: the checkpoints are
+    committed after every turn, and an idle session is only deleted if no other worker saved a checkpoint of it
+    within the idle timeout
+    """
+
+    def __init__(self, checkpointer, idle_timeout: float = 1800, max_sessions: int = 100000, shared: bool = False):
+        self.checkpointer = checkpointer
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self.shared = shared
+        self.sessions = {}
+        self.expired = 0
+
+    def new_session_id(self) -> str:
+        return str(uuid.uuid4())
+
+    def register(self, session_id: str) -> Session:
+        if len(self.sessions) >= self.max_sessions:
+            self.expire_idle()
+            if len(self.sessions) >= self.max_sessions:
+                raise Overloaded("Too many open sessions")
+        session = self.sessions[session_id] = Session(session_id)
+        return session
+
+    def create(self) -> Session:
+        return self.register(self.new_session_id())
+
+    async def get(self, session_id: str):
+        session = self.sessions.get(session_id)
+        if session is None:
+            if await self.checkpointer.aget_tuple({"configurable": {"thread_id": session_id}}) is None:
+                return None
+            session = self.sessions.get(session_id) or self.register(session_id)
+        session.last_seen = time.monotonic()
+        return session
+
+    def remove(self, session_id: str):
+        self.sessions.pop(session_id, None)
+        if hasattr(self.checkpointer, "delete_thread"):
+            self.checkpointer.delete_thread(session_id)
+        elif hasattr(self.checkpointer, "storage"): # MemorySaver of older langgraph versions
+            self.checkpointer.storage.pop(session_id, None)
+
+    def saved_recently(self, session_id: str) -> bool:
+        """
+        Whether a checkpoint of the session was saved within the idle timeout, by any process
+        """
+        saved = self.checkpointer.get_tuple({"configurable": {"thread_id": session_id}})
+        if saved is None:
+            return False
+        age = datetime.now(timezone.utc) - datetime.fromisoformat(saved.checkpoint["ts"])
+        return age.total_seconds() < self.idle_timeout
+
+    def expire_idle(self):
+        deadline = time.monotonic() - self.idle_timeout
+        for session_id in [s.session_id for s in self.sessions.values() if s.last_seen < deadline and not s.lock.locked()]:
+            if self.shared and self.saved_recently(session_id): # continued in another worker
+                self.sessions.pop(session_id, None)
+                continue
+            self.remove(session_id)
+            self.expired += 1
+
+    async def commit(self):
+        """
+        Makes the checkpoints of the last turn visible to the other workers
+        """
+        if self.shared and hasattr(self.checkpointer, "flush"):
+            await asyncio.to_thread(self.checkpointer.flush)
+
+    async def expire_periodically(self):
+        while True:
+            await asyncio.sleep(min(60, self.idle_timeout / 2))
+            self.expire_idle()
+
+
+class ChatServer:
+    """
+    Runs turns on the async graph path. At most `max_in_flight` turns run concurrently, up to `max_queued`
+    more wait for a slot; beyond that requests are rejected with 503 so the load balancer can retry elsewhere
+    """
+
+    def __init__(self, graph, sessions: SessionStore, max_in_flight: int = 256, max_queued: int = 1024, token_buffer: int = 64):
+        self.graph = graph
+        self.sessions = sessions
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.token_buffer = token_buffer
+        self.in_flight = 0
+        self.queued = 0
+        self.turns = 0
+        self.rejected = 0
+        self._slots = asyncio.Semaphore(max_in_flight)
+
+    def admit(self):
+        """
+        Raises Overloaded if no more turns can wait, checked before a response is started
+        """
+        if self.queued >= self.max_queued:
+            self.rejected += 1
+            raise Overloaded("Too many turns in flight")
+
+    async def run_turn(self, session: Session, user_input: str, on_token=None) -> dict:
+        self.admit()
+        self.queued += 1
+        queued = True
+        try:
+            # the session lock is taken first, so further turns of a busy session do not hold a slot while waiting
+            async with session.lock:
+                await self._slots.acquire()
+                self.queued -= 1
+                queued = False
+                self.in_flight += 1
+                try:
+                    outputs = await achat_turn(self.graph, session.session_id, user_input, on_token=on_token)
+                    await self.sessions.commit()
+                finally:
+                    self.in_flight -= 1
+                    self._slots.release()
+            session.turns += 1
+            self.turns += 1
+            return outputs
+        finally:
+            if queued:
+                self.queued -= 1
+
+    async def stream_turn(self, session: Session, user_input: str):
+        """
+        Yields ("token", text) events while the reply is generated and finally ("message", outputs).
+        The token queue is bounded, so a slow client slows down the consumer of the LLM stream instead of buffering
+        """
+        queue = asyncio.Queue(maxsize=self.token_buffer)
+        done = object()
+        closed = asyncio.Event() # the consumer stopped reading, nothing may wait for space in the queue any more
+
+        async def on_token(token):
+            await queue.put(("token", token))
+
+        async def run():
+            try:
+                outputs = await self.run_turn(session, user_input, on_token=on_token)
+                await queue.put(("message", outputs))
+            except Exception as e:
+                await queue.put(("error", e))
+            finally:
+                if not closed.is_set(): # a full queue is never read again after the client went away
+                    await queue.put((done, None))
+
+        task = asyncio.create_task(run())
+        try:
+            while True:
+                kind, value = await queue.get()
+                if kind is done:
+                    break
+                yield kind, value
+        finally:
+            closed.set()
+            if not task.done(): # client went away
+                task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self.sessions.sessions),
+            "expired_sessions": self.sessions.expired,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "turns": self.turns,
+            "rejected": self.rejected,
+        }
+
+
+def reply_payload(outputs: dict) -> dict:
+    last_ai_message = BasicFunctions.get_last_ai_message(outputs)
+    return {"message": last_ai_message.content if last_ai_message else None, "ended": bool(outputs.get("ended"))}
+
+
+def create_app(graph=None) -> Starlette:
+    checkpointer = graph.checkpointer if graph is not None else create_checkpointer()
+    sessions = SessionStore(
+        checkpointer,
+        idle_timeout=float(environ.get("SERVER_SESSION_IDLE_TIMEOUT", 1800)),
+        max_sessions=int(environ.get("SERVER_MAX_SESSIONS", 100000)),
+        shared=int(environ.get("PIZZABOT_WORKERS", 1)) > 1,
+    )
+    server = ChatServer(
+        graph or build_graph(checkpointer),
+        sessions,
+        max_in_flight=int(environ.get("SERVER_MAX_IN_FLIGHT", 256)),
+        max_queued=int(environ.get("SERVER_MAX_QUEUED", 1024)),
+    )
+
+    def overloaded(e: Exception) -> JSONResponse:
+        return JSONResponse({"error": str(e)}, status_code=503, headers={"Retry-After": "1"})
+
+    async def health(request):
+        return JSONResponse({"status": "ok"})
+
+    async def stats(request):
+        return JSONResponse(server.stats())
+
+    async def openmetrics(request):
+        for name, value in server.stats().items():
+            metrics.describe(f"pizzabot_server_{name}", "gauge", f"Chat server {name.replace('_', ' ')}")
+            metrics.set(f"pizzabot_server_{name}", value)
+        return PlainTextResponse(metrics.to_openmetrics(), media_type="application/openmetrics-text; version=1.0.0; charset=utf-8")
+
+    async def create_session(request):
+        try:
+            session = sessions.create()
+        except Overloaded as e:
+            return overloaded(e)
+        return JSONResponse({"session_id": session.session_id, "message": GREETING}, status_code=201)
+
+    async def delete_session(request):
+        sessions.remove(request.path_params["session_id"])
+        return Response(status_code=204)
+
+    async def post_message(request):
+        try:
+            session = await sessions.get(request.path_params["session_id"])
+        except Overloaded as e:
+            return overloaded(e)
+        if session is None:
+            return JSONResponse({"error": "Unknown session"}, status_code=404)
+        try:
+            body = await request.json()
+        except ValueError:
+            return JSONResponse({"error": "Expected a JSON body with an 'input' field"}, status_code=400)
+        user_input = body.get("input") if isinstance(body, dict) else None
+        if not isinstance(user_input, str):
+            return JSONResponse({"error": "Expected a string 'input' field"}, status_code=422)
+
+        if "text/event-stream" in request.headers.get("accept", ""):
+            try:
+                server.admit()
+            except Overloaded as e:
+                return overloaded(e)
+
+            async def events():
+                async for kind, value in server.stream_turn(session, user_input):
+                    if kind == "token":
+                        yield f"event: token\ndata: {json.dumps(value)}\n\n"
+                    elif kind == "message":
+                        yield f"event: message\ndata: {json.dumps(reply_payload(value))}\n\n"
+                    else:
+                        yield f"event: error\ndata: {json.dumps(str(value))}\n\n"
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        try:
+            outputs = await server.run_turn(session, user_input)
+        except Overloaded as e:
+            return overloaded(e)
+        return JSONResponse(reply_payload(outputs))
+
+    async def websocket_chat(websocket):
+        await websocket.accept()
+        try:
+            session = await sessions.get(websocket.path_params["session_id"])
+        except Overloaded as e:
+            await websocket.send_json({"type": "error", "error": str(e)})
+            await websocket.close(code=1013) # try again later
+            return
+        if session is None:
+            await websocket.send_json({"type": "error", "error": "Unknown session"})
+            await websocket.close(code=4404)
+            return
+        try:
+            while True:
+                user_input = await websocket.receive_text()
+                session.last_seen = time.monotonic()
+                async for kind, value in server.stream_turn(session, user_input):
+                    if kind == "token":
+                        await websocket.send_json({"type": "token", "token": value})
+                    elif kind == "message":
+                        await websocket.send_json({"type": "message", **reply_payload(value)})
+                    else:
+                        await websocket.send_json({"type": "error", "error": str(value)})
+        except WebSocketDisconnect:
+            pass
+
+    @asynccontextmanager
+    async def lifespan(app):
+        expiry = asyncio.create_task(sessions.expire_periodically())
+        logger.info("Chat server started")
+        try:
+            yield
+        finally:
+            expiry.cancel()
+
+    app = Starlette(
+        routes=[
+            Route("/health", health),
+            Route("/stats", stats),
+            Route("/metrics", openmetrics),
+            Route("/sessions", create_session, methods=["POST"]),
+            Route("/sessions/{session_id}", delete_session, methods=["DELETE"]),
+            Route("/sessions/{session_id}/messages", post_message, methods=["POST"]),
+            WebSocketRoute("/sessions/{session_id}/ws", websocket_chat),
+        ],
+        lifespan=lifespan,
+    )
+    app.state.chat_server = server
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(create_app(), host=environ.get("SERVER_HOST", "0.0.0.0"), port=int(environ.get("SERVER_PORT", 8000)))
@@ -0,0 +1,55 @@
+"""
+Measures cold start and per-rerun overhead of the chatbot: python startup_benchmark.py [repetitions]
+
+Cold start numbers are taken in fresh interpreters, the rerun numbers compare building the graph from scratch
+(what the Streamlit app did on every rerun) with the cached `build_graph()`.
+"""
+import statistics
+import subprocess
+import sys
+import time
+
+
+COLD_START = {
+    "import utils": "import utils",
+    "import pizzabot": "import pizzabot",
+    "import pizzabot + build_graph()": "import pizzabot; pizzabot.build_graph()",
+}
+
+
+def measure_cold_start(snippet: str, repetitions: int) -> float:
+    timings = []
+    for _ in range(repetitions):
+        output = subprocess.run(
+            [sys.executable, "-c", f"import time; t = time.perf_counter(); {snippet}; print(time.perf_counter() - t)"],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        timings.append(float(output.strip().splitlines()[-1]))
+    return statistics.median(timings)
+
+
+def measure_rerun(repetitions: int) -> tuple:
+    import pizzabot
+
+    uncached = []
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        pizzabot.build_graph.__wrapped__() # wiring + compile, as before the factory was cached
+        uncached.append(time.perf_counter() - start)
+
+    pizzabot.build_graph()
+    cached = []
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        pizzabot.build_graph()
+        cached.append(time.perf_counter() - start)
+    return statistics.median(uncached), statistics.median(cached)
+
+
+if __name__ == "__main__":
+    repetitions = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    for name, snippet in COLD_START.items():
+        print(f"{name:<35} {measure_cold_start(snippet, repetitions) * 1000:8.1f} ms (cold, median of {repetitions})")
+    uncached, cached = measure_rerun(repetitions)
+    print(f"{'build graph on every rerun':<35} {uncached * 1000:8.1f} ms")
+    print(f"{'cached build_graph()':<35} {cached * 1000:8.3f} ms")
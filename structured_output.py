@@ -0,0 +1,91 @@
+import ast
+import json
+import re
+
+
+INTENT_SCHEMA = {
+    "type": "object",
+    "properties": {"intention": {"type": "boolean"}},
+    "required": ["intention"],
+    "additionalProperties": False,
+}
+
+ADDRESS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "city": {"type": "string"},
+        "street": {"type": "string"},
+        "house_number": {"type": "string"},
+    },
+    "required": ["city", "street", "house_number"],
+    "additionalProperties": False,
+}
+
+# the answers are single-line JSON, anything after a blank line is chatter
+STOP_SEQUENCES = ["\n\n"]
+
+RESPONSE_FORMATS = ("none", "json_object", "json_schema")
+
+_decoder = json.JSONDecoder()
+_code_fence = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+
+class OutputParseError(ValueError):
+    pass
+
+
+class TruncatedOutputError(OutputParseError):
+    pass
+
+
+def completion_options(name: str, schema: dict, max_tokens: int, response_format: str = "none") -> dict:
+    """
+    Keyword arguments for `chat.completions.create`: token budget, stop sequences and optionally
+    the response format (`json_object`, or `json_schema` for servers with guided decoding)
+    """
+    options = {"max_tokens": max_tokens, "stop": STOP_SEQUENCES}
+    if response_format == "json_schema":
+        options["response_format"] = {"type": "json_schema", "json_schema": {"name": name, "schema": schema, "strict": True}}
+    elif response_format == "json_object":
+        options["response_format"] = {"type": "json_object"}
+    elif response_format != "none":
+        raise ValueError(f"Unknown response format {response_format}, expected one of {', '.join(RESPONSE_FORMATS)}")
+    return options
+
+
+def finished_text(text: str, finish_reason: str = None) -> str:
+    """
+    The completion text, TruncatedOutputError if the token budget cut it off (a cut JSON may still parse)
+    """
+    if finish_reason == "length":
+        raise TruncatedOutputError(f"Model output hit the token budget: {text!r}")
+    return text
+
+
+def parse_json_output(text: str):
+    """
+    The first JSON object or array in the model output. Code fences and text around it are ignored,
+    Python literals (True, None, single quotes) are accepted; nothing is evaluated
+    """
+    text = _code_fence.sub("", text.strip())
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if not starts:
+        raise OutputParseError(f"No JSON in model output: {text!r}")
+    start = min(starts)
+    try:
+        return _decoder.raw_decode(text, start)[0]
+    except ValueError:
+        pass
+    end = text.rfind("}" if text[start] == "{" else "]")
+    try:
+        return ast.literal_eval(text[start:end + 1])
+    except (ValueError, SyntaxError):
+        raise OutputParseError(f"Model output is not JSON: {text!r}") from None
+
+
+def parse_bool(value) -> bool:
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lower() in ("true", "false"):
+        return value.strip().lower() == "true"
+    raise OutputParseError(f"Not a boolean: {value!r}")
@@ -0,0 +1,38 @@
+from types import SimpleNamespace
+
+import utils
+from utils import AddressValidationCache
+
+
+def test_key_normalizes_street_spelling():
+    key = AddressValidationCache.key
+    assert key("Leipzig", "Gustav-Freytag-Straße", "12 A") == key("leipzig", "Gustav Freytag Str.", "12a")
+
+
+def test_rejections_expire_with_the_negative_ttl():
+    cache = AddressValidationCache(negative_ttl=-1)
+    cache.set("Leipzig", "Augustusplatz", "10", True)
+    cache.set("Leipzig", "Nowhere", "1", False)
+    assert cache.get("Leipzig", "Augustusplatz", "10") is True
+    assert cache.get("Leipzig", "Nowhere", "1") is None
+
+
+def test_snapshot_round_trip(tmp_path):
+    cache = AddressValidationCache()
+    cache.set("Leipzig", "Augustusplatz", "10", True)
+    cache.export_snapshot(str(tmp_path / "addresses.json"))
+    restored = AddressValidationCache()
+    restored.load_snapshot(str(tmp_path / "addresses.json"))
+    assert restored.get("leipzig", "augustusplatz", "10") is True
+
+
+def test_validate_address_caches_only_definitive_answers(monkeypatch):
+    responses = [SimpleNamespace(status_code=503), SimpleNamespace(status_code=404)]
+    calls = []
+    monkeypatch.setattr(utils, "address_cache", AddressValidationCache())
+    monkeypatch.setattr(utils, "_post_address_validation", lambda payload: calls.append(payload) or responses.pop(0))
+
+    assert utils.validate_address("Leipzig", "Nowhere", "1") is None # server error, not cached
+    assert utils.validate_address("Leipzig", "Nowhere", "1") is None # rejection, cached
+    assert utils.validate_address("Leipzig", "Nowhere", "1") is None
+    assert len(calls) == 2
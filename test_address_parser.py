@@ -0,0 +1,40 @@
+import pytest
+
+from address_parser import city_for_postcode, parse_address
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Gustav-Freytag Straße 12A, Leipzig", ("Leipzig", "Gustav-Freytag Straße", "12A")),
+    ("Leipzig, Augustusplatz 10", ("Leipzig", "Augustusplatz", "10")),
+    ("Karl-Liebknecht-Str. 132, 04277 Leipzig", ("Leipzig", "Karl-Liebknecht-Str", "132")),
+    ("My address is Gustav-Freytag Straße 12A in Leipzig", ("Leipzig", "Gustav-Freytag Straße", "12A")),
+    ("Marktplatz 1 in Halle (Saale)", ("Halle", "Marktplatz", "1")),
+    ("10 Augustusplatz, Leipzig, Germany", ("Leipzig", "Augustusplatz", "10")),
+    ("Hauptstraße 5, in 01067 Dresden", ("Dresden", "Hauptstraße", "5")),
+])
+def test_parses_common_address_forms(text, expected):
+    assert parse_address(text) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("In den Gärten 5, Leipzig", ("Leipzig", "In den Gärten", "5")),
+    ("In den Gärten 5 in Leipzig", ("Leipzig", "In den Gärten", "5")),
+    ("Leipzig, Im Winkel 3", ("Leipzig", "Im Winkel", "3")),
+])
+def test_keeps_in_inside_street_names(text, expected):
+    assert parse_address(text) == expected
+
+
+@pytest.mark.parametrize("text", [
+    "I want a pizza",
+    "Augustusplatz 10", # no city
+    "Hauptstraße 5, 04109 Dresden", # postcode of another city
+    "Augustusplatz 10, Berlin",
+])
+def test_leaves_everything_else_to_the_llm(text):
+    assert parse_address(text) is None
+
+
+def test_city_for_postcode():
+    assert city_for_postcode("04109") == "Leipzig"
+    assert city_for_postcode("10115") is None
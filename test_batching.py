@@ -0,0 +1,70 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import utils
+from batching import AsyncMicroBatcher, MicroBatcher, render_chatml
+
+
+def test_micro_batcher_coalesces_and_deduplicates_threads():
+    batches = []
+
+    def handler(items):
+        batches.append(sorted(items))
+        return [ValueError(item) if item == "bad" else item.upper() for item in items]
+
+    batcher = MicroBatcher(handler, window=0.2, max_batch=4)
+    results = {}
+
+    def submit(item, slot):
+        try:
+            results[slot] = batcher.submit(item)
+        except ValueError as e:
+            results[slot] = e
+
+    threads = [threading.Thread(target=submit, args=(item, i)) for i, item in enumerate(["a", "b", "a", "bad"])]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert batches == [["a", "b", "bad"]]
+    assert [results[i] for i in range(3)] == ["A", "B", "A"]
+    assert isinstance(results[3], ValueError) # only the caller of the failed item fails
+    assert batcher.deduplicated == 1
+
+
+def test_async_micro_batcher_sends_full_batches_early():
+    batches = []
+
+    async def handler(items):
+        batches.append(items)
+        return [item * 2 for item in items]
+
+    batcher = AsyncMicroBatcher(handler, window=10, max_batch=3)
+
+    async def run():
+        return await asyncio.wait_for(asyncio.gather(*(batcher.submit(i) for i in range(3))), 1)
+
+    assert asyncio.run(run()) == [0, 2, 4]
+    assert batches == [[0, 1, 2]]
+
+
+def test_prompts_mode_sends_one_completions_request(monkeypatch):
+    requests = []
+
+    def create(**kwargs):
+        requests.append(kwargs)
+        choices = [SimpleNamespace(index=i, text=f"answer {i}", finish_reason="stop") for i in range(len(kwargs["prompt"]))]
+        return SimpleNamespace(choices=choices[::-1], usage=None) # the server may answer out of order
+
+    client = SimpleNamespace(completions=SimpleNamespace(create=create))
+    monkeypatch.setattr(utils, "get_client", lambda: client)
+    monkeypatch.setattr(utils, "nlu_batch_mode", "prompts")
+    messages = [[{"role": "user", "content": "I want a pizza"}], [{"role": "user", "content": "no thanks"}]]
+    texts = utils._complete_batch(messages, "intent_llm", utils.INTENT_OPTIONS)
+    assert texts == ["answer 0", "answer 1"]
+    (request,) = requests
+    assert request["prompt"] == [render_chatml(m) for m in messages]
+    assert request["max_tokens"] == utils.INTENT_OPTIONS["max_tokens"]
+    assert "<|im_end|>" in request["stop"]
+
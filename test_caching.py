@@ -0,0 +1,113 @@
+import asyncio
+import threading
+import time
+
+import utils
+from caching import AsyncSingleFlight, DiskCache, Memoizer, SingleFlight, TieredCache, TTLCache
+
+
+def test_ttl_cache_expires_and_evicts():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=-1) # already expired
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    cache.set("c", 3)
+    cache.set("d", 4)
+    assert cache.get("a") is None # least recently used
+    assert cache.stats()["evictions"] == 1
+
+
+def test_tiered_cache_promotes_disk_hits(tmp_path):
+    disk = DiskCache(str(tmp_path / "cache.sqlite"))
+    disk.set("key", {"value": 1})
+    cache = TieredCache(TTLCache(), disk)
+    assert cache.get("key") == {"value": 1}
+    assert cache.memory.get("key") == {"value": 1}
+
+
+def test_memoize_keys_on_normalized_input_model_and_prompt_version():
+    model = ["model-a"]
+    memoizer = Memoizer(TTLCache(), model_name=lambda: model[0])
+    calls = []
+
+    @memoizer.memoize("intent", "1")
+    def classify(_input):
+        calls.append(_input)
+        return len(calls)
+
+    assert classify("I want  a Pizza") == 1
+    assert classify("i want a pizza ") == 1 # whitespace and case are normalized
+    model[0] = "model-b"
+    assert classify("I want a pizza") == 2
+    assert memoizer.stats()["intent"]["hits"] == 1
+
+    @memoizer.memoize("intent", "2")
+    def classify_v2(_input):
+        calls.append(_input)
+        return len(calls)
+
+    assert classify_v2("I want a pizza") == 3
+
+
+def test_memoize_async_and_decode():
+    memoizer = Memoizer(TTLCache())
+    calls = []
+
+    @memoizer.memoize("address", "1", decode=tuple)
+    async def extract(_input):
+        calls.append(_input)
+        return ["Leipzig", "Augustusplatz", "10"]
+
+    async def run():
+        return await extract("Augustusplatz 10"), await extract("Augustusplatz 10")
+
+    first, second = asyncio.run(run())
+    assert len(calls) == 1
+    assert second == ("Leipzig", "Augustusplatz", "10")
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    flights = SingleFlight()
+    calls = []
+
+    def slow(question):
+        calls.append(question)
+        time.sleep(0.1)
+        return question.upper()
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flights.do("key", slow, "margherita"))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ["MARGHERITA"] * 5
+    assert len(calls) == 1 and flights.coalesced == 4
+
+
+def test_async_single_flight_coalesces_concurrent_awaits():
+    flights = AsyncSingleFlight()
+    calls = []
+
+    async def slow(question):
+        calls.append(question)
+        await asyncio.sleep(0.05)
+        return question.upper()
+
+    async def run():
+        return await asyncio.gather(*(flights.do("key", slow, "margherita") for _ in range(5)))
+
+    assert asyncio.run(run()) == ["MARGHERITA"] * 5
+    assert len(calls) == 1
+
+
+def test_qanary_answers_are_cached_and_failures_are_not(monkeypatch):
+    runs = []
+    answers = ["", "Calzone folded pizza\n"]
+    monkeypatch.setattr(utils, "qanary_cache", TieredCache(TTLCache()))
+    monkeypatch.setattr(utils, "_run_qanary_pipeline", lambda question: runs.append(question) or answers.pop(0))
+    assert utils.call_qanary_pipeline("What is a calzone?") == "" # failed run, not cached
+    assert utils.call_qanary_pipeline("What is a calzone?") == "Calzone folded pizza\n"
+    assert utils.call_qanary_pipeline("what is a  Calzone?") == "Calzone folded pizza\n" # normalized key
+    assert len(runs) == 2
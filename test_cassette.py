@@ -0,0 +1,61 @@
+import asyncio
+
+import httpx
+import pytest
+import requests
+
+from cassette import AsyncCassetteTransport, Cassette, CassetteAdapter, CassetteMiss, CassetteTransport, request_key
+
+
+def test_request_key_normalizes_query_and_body():
+    assert request_key("get", "http://Host/sparql?b=2&a=1") == request_key("GET", "http://host/sparql?a=1&b=2")
+    assert (request_key("POST", "http://host/v1", b'{"b": 1, "a": 2}', "application/json")
+            == request_key("POST", "http://host/v1", '{"a":2,"b":1}', "application/json"))
+    assert (request_key("POST", "http://host/q", "b=2&a=1", "application/x-www-form-urlencoded")
+            == request_key("POST", "http://host/q", "a=1&b=2", "application/x-www-form-urlencoded"))
+    assert request_key("POST", "http://host/v1", '{"a":1}', "application/json") != request_key("POST", "http://host/v1", '{"a":2}', "application/json")
+
+
+def test_recorded_responses_are_replayed_in_order(tmp_path):
+    path = str(tmp_path / "cassettes" / "calls.jsonl")
+    answers = iter(["first", "second"])
+    live = httpx.MockTransport(lambda request: httpx.Response(200, text=next(answers)))
+    with httpx.Client(transport=CassetteTransport(Cassette(path, "record"), live)) as client:
+        assert client.post("http://llm/v1", json={"q": 1}).text == "first"
+        assert client.post("http://llm/v1", json={"q": 1}).text == "second"
+
+    cassette = Cassette(path, "replay")
+    with cassette.http_client() as client:
+        assert [client.post("http://llm/v1", json={"q": 1}).text for _ in range(3)] == ["first", "second", "second"]
+        with pytest.raises(CassetteMiss):
+            client.post("http://llm/v1", json={"q": 2})
+    assert cassette.stats() == {"mode": "replay", "recordings": 2, "hits": 3, "misses": 1, "recorded": 0}
+
+
+def test_async_transport_records_binary_bodies(tmp_path):
+    path = str(tmp_path / "calls.jsonl")
+    live = httpx.MockTransport(lambda request: httpx.Response(200, content=b"\xff\x00", headers={"content-type": "image/png"}))
+
+    async def fetch(transport):
+        async with httpx.AsyncClient(transport=transport) as client:
+            return await client.get("http://menu/image")
+
+    asyncio.run(fetch(AsyncCassetteTransport(Cassette(path, "record"), live)))
+    response = asyncio.run(fetch(AsyncCassetteTransport(Cassette(path, "replay"), live)))
+    assert response.content == b"\xff\x00"
+    assert response.headers["content-type"] == "image/png"
+
+
+def test_requests_adapter_replays(tmp_path):
+    path = str(tmp_path / "calls.jsonl")
+    cassette = Cassette(path, "record")
+    cassette.record(request_key("GET", "http://pizza/pizza"), "GET", "http://pizza/pizza", 200, "application/json", b'[{"id": 1}]')
+    session = requests.Session()
+    session.mount("http://", CassetteAdapter(Cassette(path, "replay")))
+    response = session.get("http://pizza/pizza")
+    assert response.status_code == 200 and response.json() == [{"id": 1}]
+
+
+def test_unknown_mode_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        Cassette(str(tmp_path / "calls.jsonl"), "live")
@@ -0,0 +1,64 @@
+import threading
+
+import pytest
+
+from checkpoints import BatchedSqliteSaver, PrunedMemorySaver, create_checkpointer
+from pizzabot import build_graph, chat_turn
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def checkpointer(request, tmp_path, monkeypatch):
+    monkeypatch.setenv("PIZZABOT_CHECKPOINT_KEEP", "3")
+    saver = create_checkpointer(request.param, str(tmp_path / "sessions.sqlite"))
+    yield saver
+    if isinstance(saver, BatchedSqliteSaver):
+        saver.close()
+
+
+def reply(outputs: dict) -> str:
+    return outputs["last_ai_message"].content
+
+
+def test_only_the_latest_checkpoints_are_kept(backends, checkpointer):
+    graph = build_graph.__wrapped__(checkpointer)
+    chat_turn(graph, "s1", "I want to order a pizza")
+    chat_turn(graph, "s2", "I want to order a pizza")
+    assert reply(chat_turn(graph, "s1", "Margherita")) == "What is your delivery address?"
+    for thread_id in ("s1", "s2"):
+        config = {"configurable": {"thread_id": thread_id}}
+        assert len(list(checkpointer.list(config))) == 3
+    # the session resumes from the kept checkpoints
+    outputs = chat_turn(graph, "s1", "Augustusplatz 10, Leipzig")
+    assert "42" in reply(outputs) and outputs["ended"]
+
+
+def test_memory_saver_drops_unreferenced_channel_values(backends):
+    saver = PrunedMemorySaver(keep=1)
+    graph = build_graph.__wrapped__(saver)
+    chat_turn(graph, "s1", "I want to order a pizza")
+    chat_turn(graph, "s1", "Margherita")
+    (checkpoint_id,) = saver.storage["s1"][""]
+    versions = saver.get({"configurable": {"thread_id": "s1"}})["channel_versions"]
+    assert {(k[2], k[3]) for k in saver.blobs if k[0] == "s1"} <= set(versions.items())
+    assert all(k[2] == checkpoint_id for k in saver.writes)
+
+
+def test_keep_zero_keeps_every_checkpoint(backends):
+    saver = PrunedMemorySaver(keep=0)
+    graph = build_graph.__wrapped__(saver)
+    chat_turn(graph, "s1", "I want to order a pizza")
+    chat_turn(graph, "s1", "Margherita")
+    assert len(saver.storage["s1"][""]) > 3
+
+
+def test_setup_runs_under_the_flush_lock(tmp_path):
+    saver = BatchedSqliteSaver.from_path(str(tmp_path / "sessions.sqlite"))
+    owned = []
+    setup = saver.setup
+    saver.setup = lambda: owned.append(saver._flush_lock._is_owned()) or setup()
+    try:
+        with saver.cursor(transaction=False) as cur:
+            cur.execute("SELECT count(*) FROM checkpoints")
+        assert owned == [True]
+    finally:
+        saver.close()
@@ -0,0 +1,100 @@
+import asyncio
+import threading
+
+import pytest
+from langchain_core.messages import AIMessage, FunctionMessage
+
+import pizzabot
+import utils
+from caching import Memoizer, TTLCache
+from conftest import ADDRESS
+from pizzabot import achat_turn, build_graph, chat_turn
+
+
+@pytest.fixture
+def graph():
+    from langgraph.checkpoint.memory import MemorySaver
+    return build_graph.__wrapped__(MemorySaver())
+
+
+def reply(outputs: dict) -> str:
+    return pizzabot.BasicFunctions.get_last_ai_message(outputs).content
+
+
+def test_description_is_streamed_to_the_token_callback(backends, graph):
+    tokens = []
+    outputs = chat_turn(graph, "s1", "tell me more about the margherita", on_token=tokens.append)
+    assert tokens == ["A ", "classic."]
+    assert reply(outputs) == "A classic."
+    assert "generate_pizza_description" not in backends
+
+
+def test_async_description_stream_accepts_coroutine_callbacks(backends, graph):
+    tokens = []
+
+    async def on_token(token):
+        tokens.append(token)
+
+    outputs = asyncio.run(achat_turn(graph, "s1", "describe the margherita", on_token=on_token))
+    assert tokens == ["A ", "classic."]
+    assert isinstance(outputs["last_ai_message"], AIMessage)
+
+
+def test_cached_description_is_not_streamed_from_the_llm(monkeypatch):
+    monkeypatch.setattr(utils, "llm_cache", Memoizer(TTLCache()))
+    monkeypatch.setattr(utils, "get_client", lambda: pytest.fail("the LLM was called"))
+    args = ("tell me more about the margherita", "context", "en")
+    utils.llm_cache.store("generate_pizza_description", utils.DESCRIPTION_PROMPT_VERSION, args, "A classic.")
+    assert list(utils.stream_pizza_description(*args)) == ["A classic."]
+
+
+def test_speculative_checker_prefetches_the_menu_during_the_intent_check(backends, monkeypatch):
+    prefetched = threading.Event()
+    monkeypatch.setattr(pizzabot, "prefetch_pizza_menu", prefetched.set)
+    checker = pizzabot.CheckerNode(speculative=True)
+    update = checker.invoke(pizzabot.initial_state("I want a pizza"))
+    assert update["active_order"] is True
+    assert prefetched.wait(5)
+
+
+def test_speculative_checker_does_not_prefetch_outside_the_intent_check(backends):
+    checker = pizzabot.CheckerNode(speculative=True)
+    state = {**pizzabot.initial_state("Margherita"), "active_order": True, "pending_slot": "pizza_name"}
+    checker.invoke(state)
+    assert backends == ["validate_pizza_name"]
+
+
+def test_async_speculative_checker(backends):
+    checker = pizzabot.CheckerNode(speculative=True)
+
+    async def run():
+        update = await checker.ainvoke(pizzabot.initial_state("I want a pizza"))
+        await asyncio.sleep(0)
+        return update
+
+    assert asyncio.run(run())["active_order"] is True
+    assert sorted(backends) == ["check_order_intention", "prefetch_pizza_menu"]
+
+
+def test_order_dialogue(backends, graph):
+    assert reply(chat_turn(graph, "s1", "I want to order a pizza")).startswith("What pizza would you like to order?")
+    assert reply(chat_turn(graph, "s1", "Margherita")) == "What is your delivery address?"
+    outputs = chat_turn(graph, "s1", "Augustusplatz 10, Leipzig")
+    assert "42" in reply(outputs) and outputs["ended"]
+    assert outputs["customer_address"] == ADDRESS
+
+
+def test_history_is_bounded_and_archived(monkeypatch, tmp_path):
+    archive = tmp_path / "archive.jsonl"
+    monkeypatch.setattr(utils, "history_window", 4)
+    monkeypatch.setattr(utils, "history_archive_path", str(archive))
+    state = pizzabot.initial_state("hi")
+    for i in range(6):
+        utils.BasicFunctions.add_message(state, AIMessage(content=f"message {i}"))
+    utils.BasicFunctions.add_message(state, FunctionMessage(content="pizza_name", name="pizza_name"))
+    assert [m.content for m in state["messages"]] == ["message 3", "message 4", "message 5", "pizza_name"]
+    assert state["archived_messages"] == 3
+    assert len(archive.read_text().splitlines()) == 3
+    # the index answers without scanning the history
+    assert utils.BasicFunctions.get_pending_slot(state) == "pizza_name"
+    assert utils.BasicFunctions.get_last_ai_message(state).content == "message 5"
@@ -0,0 +1,60 @@
+from types import SimpleNamespace
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+
+from evaluation import Evaluator, run_local
+
+
+class Judge:
+    def __init__(self, verdict: str):
+        self.verdict = verdict
+        self.calls = 0
+
+    def invoke(self, messages):
+        self.calls += 1
+        return SimpleNamespace(content=self.verdict)
+
+
+def outputs(answer: str) -> dict:
+    return {"messages": [HumanMessage(content="hi"), AIMessage(content=answer)]}
+
+
+@pytest.mark.parametrize("actual, expected", [
+    ("Your order 42 was placed!", "Your order 42 was placed."),
+    ("What pizza would you like to order?", "what pizza would you like to order"),
+])
+def test_matching_answers_skip_the_judge(actual, expected):
+    judge = Judge("INCORRECT")
+    evaluator = Evaluator(lambda: judge)
+    assert evaluator.correct(outputs(actual), {"expected": expected})
+    assert judge.calls == 0
+
+
+@pytest.mark.parametrize("actual, expected", [
+    ("Your order 42 was placed", "order 4"),
+    ("Pepperoni pizzas are sold out", "Pepperoni pizza"),
+])
+def test_partial_words_go_to_the_judge(actual, expected):
+    judge = Judge("INCORRECT")
+    evaluator = Evaluator(lambda: judge)
+    assert not evaluator.correct(outputs(actual), {"expected": expected})
+    assert not evaluator.correct(outputs(actual), {"expected": expected}) # cached verdict
+    assert judge.calls == 1
+    assert evaluator.counts == {"matched": 0, "cached": 1, "judged": 1, "missing": 0}
+
+
+def test_run_local_does_not_change_the_dataset():
+    examples = [{"inputs": {"messages": [HumanMessage(content="I want a pizza")]}, "outputs": {"expected": "What pizza"}}]
+
+    class Target:
+        def invoke(self, state):
+            state["messages"].append(AIMessage(content="What pizza would you like?"))
+            return state
+
+    def correct(outputs, reference_outputs):
+        return True
+
+    report = run_local(Target(), examples, [correct])
+    assert report["summary"] == {"correct": 1.0}
+    assert len(examples[0]["inputs"]["messages"]) == 1
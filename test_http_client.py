@@ -0,0 +1,125 @@
+import asyncio
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+import requests
+
+from http_client import AsyncHttpClient, HttpClient, parse_timeouts
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Keep-alive stub of a backend: /slow answers after 0.2s, everything else right away
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path == "/slow":
+            time.sleep(0.2)
+        body = b'{"ok": true}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def base_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+def pool_stats(client: HttpClient, base_url: str) -> dict:
+    return client.stats()[base_url]
+
+
+def test_parse_timeouts():
+    timeouts = parse_timeouts("menu=3, qanary=30")
+    assert timeouts["menu"] == 3 and timeouts["qanary"] == 30 and timeouts["order"] == 5
+
+
+def test_one_session_per_host(base_url):
+    client = HttpClient()
+    assert client.session(f"{base_url}/pizza") is client.session(f"{base_url}/address/validate")
+    assert client.session("http://qanary:8080/startquestionansweringwithtextquestion") is not client.session(base_url)
+    client.close()
+
+
+def test_connections_are_kept_alive(base_url):
+    client = HttpClient()
+    for _ in range(3):
+        assert client.get(f"{base_url}/pizza", endpoint="menu").json() == {"ok": True}
+    pool = pool_stats(client, base_url)
+    assert pool["connections_opened"] == 1
+    assert pool["requests"] == 3
+    assert pool["in_use"] == 0 and pool["idle"] == 1
+    client.close()
+
+
+def test_pool_keeps_at_most_pool_maxsize_connections(base_url):
+    client = HttpClient(pool_maxsize=2)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        responses = list(executor.map(lambda _: client.get(f"{base_url}/slow"), range(4)))
+    assert all(response.status_code == 200 for response in responses)
+    pool = pool_stats(client, base_url)
+    assert pool["maxsize"] == 2 and pool["idle"] <= 2
+    client.close()
+
+
+def test_endpoint_timeouts(base_url):
+    client = HttpClient(timeouts=parse_timeouts("qanary=0.05"))
+    assert client.timeout("qanary") == 0.05 and client.timeout("unknown") == client.timeouts["default"]
+    with pytest.raises(requests.Timeout):
+        client.get(f"{base_url}/slow", endpoint="qanary")
+    assert client.get(f"{base_url}/slow", endpoint="menu").status_code == 200
+    client.close()
+
+
+@pytest.fixture
+def transport(monkeypatch):
+    """
+    httpx clients created by `AsyncHttpClient` answer from a mock transport, the returned list records the requests
+    """
+    requests_sent = []
+
+    def handler(request):
+        requests_sent.append(request)
+        return httpx.Response(200, json={"ok": True})
+
+    monkeypatch.setattr(httpx, "AsyncClient", functools.partial(httpx.AsyncClient, transport=httpx.MockTransport(handler)))
+    return requests_sent
+
+
+def test_async_client_per_loop_with_endpoint_timeouts_and_stats(transport):
+    client = AsyncHttpClient(timeouts=parse_timeouts("qanary=30"))
+
+    async def run():
+        assert client.client() is client.client()
+        await client.get("http://pizza-api/pizza", endpoint="menu")
+        await client.post("http://qanary:8080/question", endpoint="qanary", json={"question": "margherita"})
+        await client.get("http://pizza-api/pizza")
+        stats = client.stats()
+        await client.aclose()
+        return stats
+
+    stats = asyncio.run(run())
+    assert [request.extensions["timeout"]["read"] for request in transport] == [5, 30, 5]
+    assert stats == {
+        "pizza-api": {"max_connections": 100, "in_flight": 0, "requests": 2},
+        "qanary:8080": {"max_connections": 100, "in_flight": 0, "requests": 1},
+    }
@@ -0,0 +1,80 @@
+import pytest
+
+from intent_classifier import CascadingIntentClassifier, KeywordMatcher, Tiers, tokenize
+
+
+NOT_AN_ORDER = [
+    "I want a refund",
+    "I want a refund for my pizza",
+    "cancel my order",
+    "can I talk to a human",
+    "what time is it",
+    "what's the weather tomorrow",
+    "Is it going to rain this afternoon?",
+    "where is my order",
+    "order status",
+    "my pizza arrived cold, I want to complain",
+]
+
+# mention pizza, but ask about it or only talk about it
+PIZZA_BUT_NO_ORDER = [
+    "Do you have vegan pizza?",
+    "I like pizza",
+    "Do you deliver pizza to Berlin?",
+    "I want to know if you have vegan pizza",
+    "I'll have to think about it",
+    "Is pizza delivery free?",
+]
+
+
+@pytest.fixture(scope="module")
+def classifier():
+    classifier = CascadingIntentClassifier()
+    classifier.train()
+    return classifier
+
+
+def test_tokenize_marks_negated_words():
+    assert tokenize("don't want pizza") == ["don't", "not_want", "not_pizza", "don't_not_want", "not_want_not_pizza"]
+
+
+@pytest.mark.parametrize("_input", NOT_AN_ORDER)
+def test_negative_phrasings_are_never_local_orders(classifier, _input):
+    decision = classifier.classify_locally(_input)
+    assert decision is None or decision.intention is False
+
+
+@pytest.mark.parametrize("_input", PIZZA_BUT_NO_ORDER)
+def test_keywords_only_match_clear_order_phrasings(classifier, _input):
+    assert KeywordMatcher().classify(_input) is None
+    decision = classifier.classify_locally(_input)
+    assert decision is None or decision.intention is False
+
+
+@pytest.mark.parametrize("_input", ["I want a pizza", "I'll have a Pepperoni", "Order pizza", "buy two pizzas"])
+def test_keywords_match_clear_orders(_input):
+    assert KeywordMatcher().classify(_input) == (True, Tiers.KEYWORDS, 1.0)
+
+
+@pytest.mark.parametrize("_input", ["I want a refund for my pizza", "where is my pizza", "order status", "cancel my pizza order"])
+def test_keywords_defer_requests_about_existing_orders(_input):
+    assert KeywordMatcher().defers(_input)
+
+
+@pytest.mark.parametrize("_input", ["I want a pizza", "I'd like to order", "Can I get a Margherita?", "I want to order a Hawaiian pizza"])
+def test_clear_orders_are_answered_locally(classifier, _input):
+    decision = classifier.classify_locally(_input)
+    assert decision is not None and decision.intention is True
+
+
+def test_unclear_input_goes_to_the_llm(classifier):
+    calls = []
+    decision = classifier.classify("I want a refund", llm=lambda _input: calls.append(_input) or False)
+    assert calls == ["I want a refund"]
+    assert decision.tier == Tiers.LLM and decision.intention is False
+
+
+def test_local_model_confidence_is_calibrated(classifier):
+    # unseen wording with known words only: the old raw posterior was > 0.9
+    decision = classifier.model.classify("I want to talk to someone")
+    assert decision is None or decision.confidence < classifier.confidence
@@ -0,0 +1,62 @@
+import knowledge
+import utils
+from knowledge import PizzaKnowledge, build_snapshot, label_aliases
+
+
+def binding(label: str, description: str) -> dict:
+    return {
+        "pizza": {"value": f"http://www.wikidata.org/entity/{label}"},
+        "label": {"value": label},
+        "description": {"value": description},
+    }
+
+
+SPARQL_RESULT = {"results": {"bindings": [
+    binding("Pizza Margherita", "pizza with tomato, mozzarella and basil"),
+    binding("Hawaiian pizza", "pizza topped with pineapple and ham"),
+]}}
+
+
+def test_label_aliases():
+    assert label_aliases("Pizza Margherita") == {"pizza margherita", "margherita", "margherita pizza"}
+
+
+def test_context_has_one_line_per_mentioned_pizza():
+    knowledge = PizzaKnowledge(build_snapshot(SPARQL_RESULT))
+    assert knowledge.context("Tell me more about the Hawaiian and the margherita") == (
+        "Hawaiian pizza pizza topped with pineapple and ham\n"
+        "Pizza Margherita pizza with tomato, mozzarella and basil\n"
+    )
+    assert knowledge.context("tell me about calzone") == ""
+
+
+def test_qanary_is_only_called_for_unknown_pizzas(monkeypatch):
+    calls = []
+    monkeypatch.setattr(utils, "get_knowledge", lambda: PizzaKnowledge(build_snapshot(SPARQL_RESULT)))
+    monkeypatch.setattr(utils, "call_qanary_pipeline", lambda question: calls.append(question) or "Calzone folded pizza\n")
+    assert utils.get_pizza_context("describe the margherita").startswith("Pizza Margherita")
+    assert utils.get_pizza_context("describe the calzone") == "Calzone folded pizza\n"
+    assert calls == ["describe the calzone"]
+
+
+def test_qanary_is_asked_for_the_unknown_pizza_of_a_question(monkeypatch):
+    calls = []
+    monkeypatch.setattr(utils, "get_knowledge", lambda: PizzaKnowledge(build_snapshot(SPARQL_RESULT)))
+    monkeypatch.setattr(utils, "call_qanary_pipeline", lambda question: calls.append(question) or (
+        "Pizza Margherita pizza with tomato, mozzarella and basil\nCalzone folded pizza\n"))
+    assert utils.get_pizza_context("What is the difference between the margherita and a calzone?") == (
+        "Pizza Margherita pizza with tomato, mozzarella and basil\n"
+        "Calzone folded pizza\n"
+    )
+    assert utils.get_pizza_context("Tell me more about the Hawaiian pizza, please") == "Hawaiian pizza pizza topped with pineapple and ham\n"
+    assert calls == ["What is the difference between the margherita and a calzone?"]
+
+
+def test_missing_snapshot_is_built_on_request(monkeypatch, tmp_path):
+    snapshot_path = tmp_path / "pizza_knowledge.json"
+    monkeypatch.setenv("PIZZA_KNOWLEDGE_SNAPSHOT", str(snapshot_path))
+    monkeypatch.setenv("PIZZA_KNOWLEDGE_BUILD", "1")
+    monkeypatch.setattr(knowledge, "_knowledge", None)
+    monkeypatch.setattr(utils, "fetch_pizza_descriptions_from_wikidata", lambda: SPARQL_RESULT)
+    assert knowledge.get_knowledge().context("describe the margherita").startswith("Pizza Margherita")
+    assert snapshot_path.exists()
@@ -0,0 +1,41 @@
+import pizzabot
+from language import LanguageDetector, Sources, language_name
+from pizzabot import LanguageDetectionNode, Nodes, build_graph, session_language
+from utils import _pizza_description_messages
+
+
+def test_build_graph_starts_with_language_detection():
+    graph = build_graph.__wrapped__()
+    nodes = graph.get_graph().nodes
+    assert Nodes.LANGUAGE_DETECTION.value in nodes
+    assert any(edge.source == "__start__" and edge.target == Nodes.LANGUAGE_DETECTION.value for edge in graph.get_graph().edges)
+
+
+def test_detector_skips_short_and_menu_only_input():
+    detector = LanguageDetector(languages=["en", "de"])
+    assert detector.is_uninformative("Margherita")
+    assert detector.is_uninformative("Hawaii pizza please 2 3", vocabulary={"hawaii"})
+    assert detector.detect("ja", previous="de") == ("de", Sources.SESSION)
+    assert detector.detect("ok") == ("en", Sources.DEFAULT)
+
+
+def test_detector_detects_longer_input():
+    detector = LanguageDetector(languages=["en", "de"])
+    assert detector.detect("Ich möchte gerne eine Pizza bestellen") == ("de", Sources.DETECTED)
+    assert detector.detect("I would like to order a pizza please") == ("en", Sources.DETECTED)
+
+
+def test_language_is_fixed_once_set(monkeypatch):
+    monkeypatch.setattr(pizzabot, "menu_words", lambda: set())
+    node = LanguageDetectionNode(LanguageDetector(languages=["en", "de"]))
+    assert node.invoke({"input": "I would like to order a pizza please"}) == {"language": "en"}
+    # a German address later in an English session does not switch it
+    assert node.invoke({"input": "Gustav-Freytag Straße 12A in Leipzig", "language": "en"}) == {"language": "en"}
+    # nothing is set from input too short to detect, the default applies
+    assert node.invoke({"input": "Margherita"}) == {"language": None}
+    assert session_language({"input": "Margherita"}) == "en"
+
+
+def test_description_prompt_uses_the_session_language():
+    messages = _pizza_description_messages("tell me more", "context", "de")
+    assert messages[0]["content"].endswith(f"in {language_name('de')}.")
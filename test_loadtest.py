@@ -0,0 +1,71 @@
+import asyncio
+import socket
+
+import pytest
+from langgraph.checkpoint.memory import MemorySaver
+
+import pizzabot
+import utils
+from caching import Memoizer, TieredCache, TTLCache
+from loadtest import generator
+from loadtest.__main__ import start_stubs
+from pizzabot import build_graph
+
+
+@pytest.fixture
+def graph():
+    return build_graph.__wrapped__(MemorySaver())
+
+
+@pytest.fixture
+def scripts(monkeypatch):
+    scripts = {
+        "margherita": ["I want to order a pizza", "Margherita", "Augustusplatz 10, Leipzig"],
+        "no_address": ["I want to order a pizza", "Margherita"],
+    }
+    monkeypatch.setattr(generator, "SCRIPTS", scripts)
+    return scripts
+
+
+def test_conversations_without_an_order_are_reported(backends, graph, scripts):
+    result = asyncio.run(generator.run_load(4, 2, scripts=list(scripts), graph=graph))
+    report = result.report()
+    assert report["conversations"] == 4 and report["errors"] == {}
+    assert report["incomplete"] == {"no_address": 2}
+
+
+def test_open_loop_latency_includes_the_wait_for_a_slot(backends, graph, scripts, monkeypatch):
+    async def slow_intention_check(_input):
+        await asyncio.sleep(0.05)
+        return True
+
+    monkeypatch.setattr(pizzabot, "acheck_order_intention", slow_intention_check)
+    result = asyncio.run(generator.run_load(4, 1, rate=1000, scripts=["margherita"], graph=graph))
+    assert len(result.queue_waits) == 4
+    assert max(result.queue_waits) >= 0.1 # the last arrival waited for the three before it
+    assert min(result.steps["margherita#1"]) >= 0.05
+    assert max(result.steps["margherita#1"]) >= max(result.queue_waits) + 0.05
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_scripts_place_orders_against_the_stubs(monkeypatch):
+    for name in ("pizza_api_base", "qanary_api_base", "openai_api_base", "openai_api_key", "_client", "_aclient"):
+        monkeypatch.setattr(utils, name, getattr(utils, name))
+    monkeypatch.setattr(utils, "llm_cache", Memoizer(TTLCache()))
+    monkeypatch.setattr(utils, "qanary_cache", TieredCache(TTLCache()))
+    port = free_port()
+    process = start_stubs("127.0.0.1", port, [], [])
+    try:
+        generator.point_bot_at(f"http://127.0.0.1:{port}")
+        report = asyncio.run(generator.run_load(len(generator.SCRIPTS), 2, graph=build_graph.__wrapped__(MemorySaver()))).report()
+    finally:
+        process.terminate()
+        utils.menu_cache.invalidate()
+    assert report["errors"] == {}
+    assert report["conversations"] == len(generator.SCRIPTS)
+    assert report["incomplete"] == {}
@@ -0,0 +1,158 @@
+import threading
+import time
+
+import pytest
+
+from utils import MenuCache, MenuUnavailableError, PizzaNameIndex
+
+
+ITEMS = [
+    {"id": 1, "name": "Margherita"},
+    {"id": 2, "name": "Pepperoni"},
+    {"id": 3, "name": "Hawaiian", "aliases": ["Hawaii"]},
+    {"id": 4, "name": "Quattro Formaggi"},
+]
+
+
+@pytest.fixture(scope="module")
+def index():
+    return PizzaNameIndex(ITEMS)
+
+
+@pytest.mark.parametrize("_input, pizza_id", [
+    ("Margherita", "1"),
+    ("I want a hawaii pizza please", "3"),
+    ("pizza pepperoni", "2"),
+    ("Quattro Formaggi", "4"),
+    ("formaggi", "4"),
+    ("margarita", "1"),
+    ("quatro formagi please", "4"),
+    ("peperoni pizza", "2"),
+])
+def test_names_aliases_and_misspellings_are_found(index, _input, pizza_id):
+    assert index.lookup(_input) == pizza_id
+
+
+@pytest.mark.parametrize("_input", [
+    "pizza",
+    "a pizza please",
+    "I want to order a pizza",
+    "tuna pizza",
+    "pizza with salami",
+    "",
+])
+def test_generic_or_unknown_pizzas_are_not_matched(index, _input):
+    assert index.lookup(_input) is None
+
+
+def test_snapshot_round_trip(index):
+    restored = PizzaNameIndex.from_snapshot(index.snapshot())
+    assert restored.lookup("margarita") == "1"
+    assert restored.lookup("tuna pizza") is None
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Loader:
+    """
+    Returns "menu 1", "menu 2", ...; loads after the first one wait until `release` is set
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.release = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        if self.calls > 1:
+            assert self.release.wait(5)
+        return f"menu {self.calls}"
+
+
+def wait_for(condition):
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def loader():
+    return Loader()
+
+
+def test_menu_is_loaded_once_within_the_ttl(clock, loader):
+    cache = MenuCache(loader, ttl=10, clock=clock)
+    assert cache.get() == "menu 1"
+    clock.now = 5
+    assert cache.get() == "menu 1"
+    assert loader.calls == 1
+    assert cache.stats()["misses"] == 1 and cache.stats()["hits"] == 1
+
+
+def test_expired_menu_is_loaded_again(clock, loader):
+    cache = MenuCache(loader, ttl=10, stale_ttl=0, clock=clock)
+    cache.get()
+    clock.now = 10
+    loader.release.set()
+    assert cache.get() == "menu 2"
+    assert cache.stats()["misses"] == 2
+
+
+def test_stale_menu_is_served_while_a_single_refresh_runs(clock, loader):
+    cache = MenuCache(loader, ttl=10, stale_ttl=100, clock=clock)
+    cache.get()
+    clock.now = 20
+    # the Pizza API does not answer yet, the callers do not wait for it
+    assert [cache.get() for _ in range(3)] == ["menu 1"] * 3
+    assert loader.calls == 2
+    loader.release.set()
+    wait_for(lambda: cache.stats()["refreshes"] == 2)
+    assert cache.get() == "menu 2"
+    stats = cache.stats()
+    assert (stats["hits"], stats["stale_hits"], stats["misses"]) == (1, 3, 1)
+    assert stats["hit_rate"] == 0.8 and stats["age"] == 0
+
+
+def test_menu_is_refreshed_ahead_of_the_ttl(clock, loader):
+    cache = MenuCache(loader, ttl=10, refresh_ahead=0.8, clock=clock)
+    cache.get()
+    clock.now = 7
+    cache.get()
+    assert loader.calls == 1
+    clock.now = 8
+    loader.release.set()
+    assert cache.get() == "menu 1" # served from the cache, the refresh runs in the background
+    wait_for(lambda: cache.peek() == "menu 2")
+    assert cache.is_fresh() and cache.stats()["stale_hits"] == 0
+
+
+def test_failed_refresh_keeps_serving_the_stale_menu(clock):
+    loads = iter(["menu 1"])
+
+    def loader():
+        try:
+            return next(loads)
+        except StopIteration:
+            raise ConnectionError("Pizza API is down") from None
+
+    cache = MenuCache(loader, ttl=10, stale_ttl=100, clock=clock)
+    cache.get()
+    clock.now = 20
+    assert cache.get() == "menu 1"
+    wait_for(lambda: cache.stats()["refresh_errors"] == 1)
+    assert cache.get() == "menu 1"
+    clock.now = 110 # older than the stale limit
+    with pytest.raises(MenuUnavailableError):
+        cache.get()
@@ -0,0 +1,59 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from metrics import Histogram, Metrics
+
+
+def test_histogram_buckets_are_upper_bounds():
+    histogram = Histogram(buckets=(0.1, 1))
+    for value in (0.1, 0.5, 5):
+        histogram.observe(value)
+    assert histogram.snapshot() == {"count": 3, "sum": 5.6, "buckets": {"0.1": 1, "1": 1, "+Inf": 1}}
+
+
+def test_timer_counts_errors():
+    metrics = Metrics()
+    with metrics.timer("menu"):
+        pass
+    with pytest.raises(ValueError), metrics.timer("menu"):
+        raise ValueError
+    (histogram,) = metrics.snapshot()["histograms"]
+    assert histogram["name"] == "pizzabot_backend_duration_seconds" and histogram["count"] == 2
+    assert metrics.counters[("pizzabot_backend_errors", (("backend", "menu"),))] == 1
+
+
+def test_timed_wraps_coroutines():
+    metrics = Metrics()
+
+    @metrics.timed("checker", kind="node")
+    async def node():
+        return "done"
+
+    assert asyncio.run(node()) == "done"
+    assert metrics.histograms[("pizzabot_node_duration_seconds", (("node", "checker"),))].count == 1
+
+
+def test_openmetrics_export():
+    metrics = Metrics()
+    metrics.record_usage("intent_llm", SimpleNamespace(prompt_tokens=12, completion_tokens=3))
+    metrics.record_usage("intent_llm", None)
+    metrics.set("pizzabot_circuit_state", 1, backend="order")
+    metrics.observe("pizzabot_backend_duration_seconds", 0.02, backend="menu")
+    text = metrics.to_openmetrics()
+    assert 'pizzabot_llm_tokens_total{backend="intent_llm",type="prompt"} 12' in text
+    assert "# TYPE pizzabot_circuit_state gauge" in text
+    assert 'pizzabot_backend_duration_seconds_bucket{backend="menu",le="0.025"} 1' in text
+    assert 'pizzabot_backend_duration_seconds_bucket{backend="menu",le="+Inf"} 1' in text
+    assert text.endswith("# EOF\n")
+
+
+def test_dump_writes_one_file_per_process(tmp_path, monkeypatch):
+    monkeypatch.setattr("os.getpid", lambda: 4242)
+    metrics = Metrics()
+    metrics.inc("pizzabot_nlu_batches")
+    metrics.dump(str(tmp_path / "metrics-{pid}.json"))
+    dump = json.loads((tmp_path / "metrics-4242.json").read_text())
+    assert dump["counters"] == [{"name": "pizzabot_nlu_batches", "labels": {}, "value": 1}]
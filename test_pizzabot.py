@@ -1,48 +1,22 @@
+import argparse
 from os import environ
-from langsmith import Client, evaluate
 from langchain.chat_models import init_chat_model
 from langchain_core.messages import AIMessage
 from pizzabot import *
 from data.test_dialogue import correct_dialogue
+from utils import cassette
+from evaluation import Evaluator, create_judge_cache, run_local
 from dotenv import load_dotenv
 
 
 load_dotenv(override=True)
 
-ls_client = Client()
-
 openai_api_key = environ.get('OPENAI_API_KEY')
 openai_api_base = environ.get('OPENAI_API_BASE')
 model_name = environ.get("MODEL_NAME")
 
 # ===== START Initialize LangGraph =====
-order_node = OrderNode()
-checker_node = CheckerNode()
-retrieval_node = RetrievalNode()
-description_node = DescriptionNode()
-
-workflow = StateGraph(ChatbotState)
-
-workflow.add_node(Nodes.CHECKER.value, checker_node.invoke)
-workflow.add_node(Nodes.RETRIEVAL.value, retrieval_node.invoke)
-workflow.add_node(Nodes.ORDER_FORM.value, order_node.invoke)
-workflow.add_node(Nodes.DESCRIPTION.value, description_node.invoke)
-
-workflow.add_conditional_edges(
-    Nodes.CHECKER.value,
-    checker_node.route,
-    {
-        Nodes.RETRIEVAL.value: Nodes.RETRIEVAL.value,
-        Nodes.DESCRIPTION.value: Nodes.DESCRIPTION.value,
-        END: END,
-    }
-)
-workflow.add_edge(Nodes.RETRIEVAL.value, Nodes.ORDER_FORM.value)
-workflow.add_edge(Nodes.DESCRIPTION.value, END)
-workflow.add_edge(Nodes.ORDER_FORM.value, END)
-
-workflow.set_entry_point(Nodes.CHECKER.value)
-graph = workflow.compile()
+graph = build_graph()
 
 # ===== END Initialize LangGraph =====
 
@@ -50,57 +24,43 @@ graph = workflow.compile()
 
 dataset_name = "pizzabot"
 
-try:
-    dataset = ls_client.create_dataset(
-        dataset_name=dataset_name,
-    )
-
-    ls_client.create_examples(
-        inputs=[e["inputs"] for e in correct_dialogue],
-        outputs=[e["outputs"] for e in correct_dialogue],
-        dataset_id=dataset.id
-    )
-except Exception as e:
-    print(e)
-    # dataset was already created
-    dataset = next(ls_client.list_datasets(dataset_name=dataset_name))
+
+def create_dataset(ls_client):
+    try:
+        dataset = ls_client.create_dataset(
+            dataset_name=dataset_name,
+        )
+
+        ls_client.create_examples(
+            inputs=[e["inputs"] for e in correct_dialogue],
+            outputs=[e["outputs"] for e in correct_dialogue],
+            dataset_id=dataset.id
+        )
+    except Exception as e:
+        print(e)
+        # dataset was already created
+        dataset = next(ls_client.list_datasets(dataset_name=dataset_name))
+    return dataset
 
 # ===== END Create dataset =====
 
-judge_llm = init_chat_model(model_name)
+# the judge is only created if an answer doesn't match the expected one;
+# its calls are recorded / replayed with the rest of the run (PIZZABOT_CASSETTE_MODE)
+evaluator = Evaluator(
+    lambda: init_chat_model(model_name, **({"http_client": cassette.http_client()} if cassette else {})),
+    judge_model=model_name,
+    cache=create_judge_cache(),
+)
 
 def correct(outputs: dict, reference_outputs: dict) -> bool:
-    instructions = (
-        "Given an actual answer and an expected answer, determine whether"
-        " the actual answer contains all of the information in the"
-        " expected answer. Respond with 'CORRECT' if the actual answer"
-        " does contain all of the expected information and 'INCORRECT'"
-        " otherwise. Do not include anything else in your response."
-    )
-    # Our graph outputs a State dictionary, which in this case means
-    # we'll have a 'messages' key and the final message should
-    # be our actual answer.
-    ai_messages = [msg for msg in outputs["messages"] if type(msg) == AIMessage]
-    if not ai_messages:
-        return False
-    actual_answer = ai_messages[-1].content
-    expected_answer = reference_outputs["expected"]
-    user_msg = (
-        f"ACTUAL ANSWER: {actual_answer}"
-        f"\n\nEXPECTED ANSWER: {expected_answer}"
-    )
-    response = judge_llm.invoke(
-        [
-            {"role": "system", "content": instructions},
-            {"role": "user", "content": user_msg}
-        ]
-    )
-    return response.content.upper() == "CORRECT"
+    return evaluator.correct(outputs, reference_outputs)
 
 def convert_dict_to_message(message):
     """
     Convert a dictionary to a message object.
     """
+    if not isinstance(message, dict): # local runs pass the message objects of data/test_dialogue.py
+        return message
     if message["type"] == 'ai':
         return AIMessage(
             content=message["content"],
@@ -136,10 +96,27 @@ def example_to_state(inputs: dict) -> dict:
 # Remember that langgraph graphs are also langchain runnables.
 target = example_to_state | graph
 
-experiment_results = evaluate(
-    target,
-    data=dataset_name,
-    evaluators=[correct],
-)
 
-print(f"Experiment {experiment_results.experiment_name} completed.")
\ No newline at end of file
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluates the pizzabot graph on data/test_dialogue.py")
+    parser.add_argument("--local", action="store_true", help="run without LangSmith")
+    parser.add_argument("--max-concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    if args.local:
+        report = run_local(target, correct_dialogue, [correct], max_concurrency=args.max_concurrency)
+        for example, result in zip(correct_dialogue, report["results"]):
+            print(f"{example['inputs'][INPUT]!r}: {result.get('scores', result.get('error'))} ({result['seconds']:.2f} s)")
+        print(f"Scores: {report['summary']}, errors: {report['errors']}, {report['duration']:.1f} s")
+    else:
+        from langsmith import Client, evaluate
+
+        create_dataset(Client())
+        experiment_results = evaluate(
+            target,
+            data=dataset_name,
+            evaluators=[correct],
+            max_concurrency=args.max_concurrency,
+        )
+        print(f"Experiment {experiment_results.experiment_name} completed.")
+    print(f"Judge: {evaluator.counts}")
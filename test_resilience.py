@@ -0,0 +1,218 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+import pizzabot
+import utils
+from pizzabot import build_graph, chat_turn
+from resilience import CircuitBreaker, CircuitOpenError, DeadlineExceeded, Resilience, is_backend_failure
+from structured_output import OutputParseError
+from utils import MenuCache, MenuUnavailableError
+
+
+class APIConnectionError(Exception): # named like the error of the openai client
+    pass
+
+
+def http_error(status: int) -> requests.HTTPError:
+    return requests.HTTPError(response=SimpleNamespace(status_code=status))
+
+
+@pytest.mark.parametrize("error, failure", [
+    (ConnectionError(), True),
+    (DeadlineExceeded(), True),
+    (requests.ConnectTimeout(), True),
+    (APIConnectionError(), True),
+    (http_error(503), True),
+    (http_error(404), False),
+    (OutputParseError("no JSON"), False),
+    (requests.JSONDecodeError("Expecting value", "", 0), False),
+    (KeyError("city"), False),
+])
+def test_only_transport_errors_and_5xx_are_backend_failures(error, failure):
+    assert is_backend_failure(error) is failure
+
+
+def test_unusable_answers_do_not_open_the_circuit():
+    resilience = Resilience(failure_threshold=1, hedging=False)
+    backend = resilience.backend("intent_llm")
+
+    def answer(error):
+        raise error
+
+    with pytest.raises(OutputParseError):
+        backend.call(answer, OutputParseError("no JSON"))
+    assert backend.breaker.state == CircuitBreaker.CLOSED
+    with pytest.raises(ConnectionError):
+        backend.call(answer, ConnectionError())
+    with pytest.raises(CircuitOpenError):
+        backend.call(answer, ConnectionError())
+
+
+def test_backends_have_their_own_thread_pools():
+    resilience = Resilience(max_threads=1, hedging=False)
+    release = threading.Event()
+    slow = resilience.guarded("qanary")(lambda: release.wait(5))
+    fast = resilience.guarded("menu")(lambda: "menu")
+    blocked = threading.Thread(target=slow)
+    blocked.start()
+    try:
+        start = time.monotonic()
+        assert fast() == "menu"
+        assert time.monotonic() - start < 1
+        assert resilience.executor("qanary") is not resilience.executor("menu")
+    finally:
+        release.set()
+        blocked.join()
+
+
+def test_orders_are_not_abandoned_at_the_deadline():
+    resilience = Resilience(deadlines={"default": 0.01})
+
+    @resilience.guarded("order", abandon=False)
+    def post_order():
+        time.sleep(0.05)
+        return "42"
+
+    @resilience.guarded("order", abandon=False)
+    async def apost_order():
+        await asyncio.sleep(0.05)
+        return "42"
+
+    assert post_order() == "42"
+    assert asyncio.run(apost_order()) == "42"
+    assert resilience.backends["order"].hedge is False
+
+
+def open_circuit(backend):
+    with pytest.raises(ConnectionError):
+        backend.call(lambda: (_ for _ in ()).throw(ConnectionError()))
+    assert backend.breaker.state == CircuitBreaker.OPEN
+
+
+def test_cancelled_half_open_probe_is_released():
+    resilience = Resilience(failure_threshold=1, reset_timeout=0, hedging=False)
+    backend = resilience.backend("qanary")
+    open_circuit(backend)
+
+    async def cancel_probe():
+        probe = asyncio.ensure_future(backend.acall(asyncio.sleep, 5))
+        await asyncio.sleep(0.01)
+        assert backend.breaker.state == CircuitBreaker.HALF_OPEN
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+    asyncio.run(cancel_probe())
+    assert backend.call(lambda: "answer") == "answer" # not rejected, the probe closes the circuit
+    assert backend.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_closed_stream_releases_the_half_open_probe():
+    resilience = Resilience(failure_threshold=1, reset_timeout=0, hedging=False)
+    backend = resilience.backend("description_llm")
+    open_circuit(backend)
+
+    def stream():
+        with backend.guard():
+            yield "A "
+            yield "classic."
+
+    tokens = stream()
+    assert next(tokens) == "A "
+    tokens.close() # the client went away in the middle of the description
+    assert backend.breaker.state == CircuitBreaker.HALF_OPEN
+    assert list(stream()) == ["A ", "classic."]
+    assert backend.breaker.state == CircuitBreaker.CLOSED
+
+
+@pytest.fixture
+def graph():
+    from langgraph.checkpoint.memory import MemorySaver
+    return build_graph.__wrapped__(MemorySaver())
+
+
+def failing(error):
+    def call(*args):
+        raise error
+
+    async def acall(*args):
+        raise error
+    return call, acall
+
+
+def patch_failing(monkeypatch, name, error):
+    call, acall = failing(error)
+    monkeypatch.setattr(pizzabot, name, call)
+    monkeypatch.setattr(pizzabot, f"a{name}", acall)
+
+
+def reply(outputs: dict) -> str:
+    return outputs["last_ai_message"].content
+
+
+def test_unavailable_intent_check_asks_again(backends, graph, monkeypatch):
+    patch_failing(monkeypatch, "check_order_intention", CircuitOpenError("intent_llm is unavailable"))
+    assert reply(chat_turn(graph, "s1", "I want to order a pizza")).startswith("Invalid order.")
+
+
+def test_unavailable_address_check_asks_again(backends, graph, monkeypatch):
+    chat_turn(graph, "s1", "I want to order a pizza")
+    chat_turn(graph, "s1", "Margherita")
+    patch_failing(monkeypatch, "check_customer_address", DeadlineExceeded("ner_llm did not answer"))
+    assert reply(chat_turn(graph, "s1", "Augustusplatz 10, Leipzig")).startswith("Invalid customer address.")
+
+
+@pytest.mark.parametrize("error, answer, ended", [
+    # not sent, the user can send the address again to retry
+    (CircuitOpenError("order is unavailable"), "Something went wrong while submitting your order, please try again.", False),
+    # may have been placed, the dialogue ends so it is not ordered twice
+    (requests.ReadTimeout(), "We could not confirm your order, it may still be processed.", True),
+])
+def test_failed_order_placement(backends, graph, monkeypatch, error, answer, ended):
+    patch_failing(monkeypatch, "post_order", error)
+    chat_turn(graph, "s1", "I want to order a pizza")
+    chat_turn(graph, "s1", "Margherita")
+    outputs = chat_turn(graph, "s1", "Augustusplatz 10, Leipzig")
+    assert reply(outputs).startswith(answer)
+    assert bool(outputs["ended"]) is ended
+
+
+def test_other_errors_are_not_hidden(backends, graph, monkeypatch):
+    patch_failing(monkeypatch, "check_order_intention", KeyError("intention"))
+    with pytest.raises(KeyError):
+        chat_turn(graph, "s1", "I want to order a pizza")
+
+
+def test_order_that_was_not_sent_can_be_retried(backends, graph, monkeypatch):
+    call, acall = pizzabot.post_order, pizzabot.apost_order
+    patch_failing(monkeypatch, "post_order", CircuitOpenError("order is unavailable"))
+    chat_turn(graph, "s1", "I want to order a pizza")
+    chat_turn(graph, "s1", "Margherita")
+    chat_turn(graph, "s1", "Augustusplatz 10, Leipzig")
+    monkeypatch.setattr(pizzabot, "post_order", call)
+    monkeypatch.setattr(pizzabot, "apost_order", acall)
+    outputs = chat_turn(graph, "s1", "Augustusplatz 10, Leipzig")
+    assert "42" in reply(outputs) and outputs["ended"]
+
+
+def test_menu_outage_without_a_cached_menu(backends, graph, monkeypatch):
+    def load():
+        raise requests.ConnectionError("Pizza API is down")
+
+    monkeypatch.setattr(utils, "menu_cache", MenuCache(load))
+    for name in ("get_pizza_menu", "validate_pizza_name"):
+        monkeypatch.setattr(pizzabot, name, getattr(utils, name))
+        monkeypatch.setattr(pizzabot, f"a{name}", getattr(utils, f"a{name}"))
+
+    with pytest.raises(MenuUnavailableError) as raised:
+        utils.menu_cache.get()
+    assert isinstance(raised.value.__cause__, requests.ConnectionError)
+    assert is_backend_failure(raised.value)
+
+    assert reply(chat_turn(graph, "s1", "I want to order a pizza")).endswith("I cannot load the menu right now, please try again in a moment.")
+    assert reply(chat_turn(graph, "s1", "Margherita")).startswith("Invalid pizza")
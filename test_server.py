@@ -0,0 +1,122 @@
+import asyncio
+
+import pytest
+from langgraph.checkpoint.base import empty_checkpoint
+from langgraph.checkpoint.memory import MemorySaver
+from starlette.testclient import TestClient
+
+from checkpoints import BatchedSqliteSaver
+from pizzabot import build_graph
+from server import ChatServer, Session, SessionStore, create_app
+
+
+@pytest.fixture
+def graph():
+    return build_graph.__wrapped__(MemorySaver())
+
+
+@pytest.fixture
+def client(backends, graph):
+    with TestClient(create_app(graph)) as client:
+        yield client
+
+
+def test_session_turn(client):
+    session_id = client.post("/sessions").json()["session_id"]
+    response = client.post(f"/sessions/{session_id}/messages", json={"input": "I want to order a pizza"})
+    assert response.status_code == 200
+    assert response.json()["message"].startswith("What pizza would you like to order?")
+    assert client.post("/sessions/unknown/messages", json={"input": "hi"}).status_code == 404
+
+
+@pytest.mark.parametrize("body, status", [
+    ({"content": "not json"}, 400),
+    ({"json": {}}, 422),
+    ({"json": {"input": 5}}, 422),
+    ({"json": ["I want a pizza"]}, 422),
+])
+def test_input_is_validated(client, body, status):
+    session_id = client.post("/sessions").json()["session_id"]
+    assert client.post(f"/sessions/{session_id}/messages", **body).status_code == status
+
+
+def test_overloaded_stream_is_rejected_before_it_starts(client):
+    session_id = client.post("/sessions").json()["session_id"]
+    client.app.state.chat_server.max_queued = 0
+    response = client.post(
+        f"/sessions/{session_id}/messages", json={"input": "I want a pizza"}, headers={"Accept": "text/event-stream"},
+    )
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+
+
+def test_sessions_survive_a_restart(backends, graph):
+    with TestClient(create_app(graph)) as client:
+        session_id = client.post("/sessions").json()["session_id"]
+        client.post(f"/sessions/{session_id}/messages", json={"input": "I want to order a pizza"})
+    # a new server process on the same checkpointer, its session registry is empty
+    with TestClient(create_app(graph)) as client:
+        response = client.post(f"/sessions/{session_id}/messages", json={"input": "Margherita"})
+        assert response.status_code == 200
+        assert response.json()["message"] == "What is your delivery address?"
+
+
+def test_workers_continue_each_others_sessions(backends, tmp_path, monkeypatch):
+    monkeypatch.setenv("PIZZABOT_WORKERS", "2")
+    # two worker processes, each with its own connection to the shared file, the batches are never full
+    savers = [BatchedSqliteSaver.from_path(str(tmp_path / "sessions.sqlite"), batch_size=1000, flush_interval=60) for _ in range(2)]
+    first, second = (TestClient(create_app(build_graph.__wrapped__(saver))) for saver in savers)
+    with first, second:
+        session_id = first.post("/sessions").json()["session_id"]
+        first.post(f"/sessions/{session_id}/messages", json={"input": "I want to order a pizza"})
+        response = second.post(f"/sessions/{session_id}/messages", json={"input": "Margherita"})
+        assert response.json()["message"] == "What is your delivery address?"
+    for saver in savers:
+        saver.close()
+
+
+def test_shared_sessions_continued_elsewhere_are_not_deleted(backends, graph):
+    config = {"configurable": {"thread_id": "s1", "checkpoint_ns": ""}}
+    graph.checkpointer.put(config, empty_checkpoint(), {}, {}) # a turn another worker just ran
+    for shared, kept in ((True, True), (False, False)):
+        sessions = SessionStore(graph.checkpointer, idle_timeout=60, shared=shared)
+        sessions.register("s1").last_seen -= 120
+        sessions.expire_idle()
+        assert not sessions.sessions
+        assert (graph.checkpointer.get_tuple(config) is not None) is kept
+
+
+def test_waiting_turns_of_a_busy_session_do_not_hold_a_slot(backends, graph):
+    async def run():
+        server = ChatServer(graph, SessionStore(graph.checkpointer), max_in_flight=1)
+        busy, other = Session("busy"), Session("other")
+        async with busy.lock:
+            waiting = asyncio.create_task(server.run_turn(busy, "I want a pizza"))
+            await asyncio.sleep(0)
+            outputs = await asyncio.wait_for(server.run_turn(other, "I want a pizza"), 5)
+            assert server.queued == 1 and server.in_flight == 0
+        await waiting
+        return outputs
+
+    assert asyncio.run(run())["active_order"] is True
+
+
+def test_disconnect_with_a_full_token_buffer_ends_the_turn():
+    async def run():
+        server = ChatServer(None, None, token_buffer=1)
+
+        async def run_turn(session, user_input, on_token=None):
+            for i in range(10):
+                await on_token(f"token {i} ")
+            return {}
+
+        server.run_turn = run_turn
+        events = server.stream_turn(Session("s1"), "tell me more about the margherita")
+        assert await events.__anext__() == ("token", "token 0 ")
+        await asyncio.sleep(0) # the producer fills the buffer again
+        await events.aclose() # the client went away
+        for _ in range(5):
+            await asyncio.sleep(0)
+        return [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+
+    assert asyncio.run(run()) == []
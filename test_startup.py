@@ -0,0 +1,19 @@
+import subprocess
+import sys
+
+from langgraph.checkpoint.memory import MemorySaver
+
+from pizzabot import build_graph
+
+
+def test_build_graph_is_cached_per_checkpointer():
+    checkpointer = MemorySaver()
+    assert build_graph(checkpointer) is build_graph(checkpointer)
+    assert build_graph(checkpointer) is not build_graph(MemorySaver())
+
+
+def test_utils_imports_the_clients_lazily():
+    # a fresh interpreter, the modules may already be loaded by other tests
+    code = "import sys, utils; print(','.join(m for m in ('openai', 'httpx', 'requests', 'fuzzywuzzy') if m in sys.modules))"
+    loaded = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout.strip()
+    assert loaded == ""
@@ -0,0 +1,69 @@
+from types import SimpleNamespace
+
+import pytest
+
+import utils
+from structured_output import (
+    ADDRESS_SCHEMA, OutputParseError, TruncatedOutputError, completion_options, finished_text, parse_bool, parse_json_output,
+)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('{"intention": true}', {"intention": True}),
+    ('```json\n{"intention": false}\n```', {"intention": False}),
+    ("Sure! {'city': 'Leipzig', 'street': 'Augustusplatz', 'house_number': 10} Anything else?",
+     {"city": "Leipzig", "street": "Augustusplatz", "house_number": 10}),
+    ('[{"Leipzig": "CITY"}]', [{"Leipzig": "CITY"}]),
+])
+def test_parse_json_output(text, expected):
+    assert parse_json_output(text) == expected
+
+
+@pytest.mark.parametrize("text", ["I think so", '{"city": "Leipzig", "street": "Karl-Liebkn', "{__import__('os')}"])
+def test_parse_json_output_rejects_other_text(text):
+    with pytest.raises(OutputParseError):
+        parse_json_output(text)
+
+
+def test_parse_bool():
+    assert parse_bool(True) and parse_bool(" TRUE ") and not parse_bool("false")
+    with pytest.raises(OutputParseError):
+        parse_bool("yes")
+
+
+def test_completion_options():
+    assert completion_options("address", ADDRESS_SCHEMA, 128) == {"max_tokens": 128, "stop": ["\n\n"]}
+    schema = completion_options("address", ADDRESS_SCHEMA, 128, "json_schema")["response_format"]
+    assert schema["json_schema"]["schema"] is ADDRESS_SCHEMA
+    with pytest.raises(ValueError):
+        completion_options("address", ADDRESS_SCHEMA, 128, "xml")
+
+
+def test_truncated_output_is_an_error():
+    assert finished_text('{"intention": true}', "stop") == '{"intention": true}'
+    with pytest.raises(TruncatedOutputError):
+        finished_text('{"city": "Leipzig", "street": "Karl', "length")
+
+
+def completion(text: str, finish_reason: str):
+    """
+    A client answering every chat completion with `text`, the answer cache is skipped through `__wrapped__`
+    """
+    message = SimpleNamespace(content=text)
+    response = SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason=finish_reason)], usage=None)
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=lambda **kwargs: response)))
+
+
+def test_address_budget_fits_long_street_names(monkeypatch):
+    answer = '{"city": "Dresden", "street": "Straße des 17. Juni am Großen Garten", "house_number": "12A"}'
+    monkeypatch.setattr(utils, "get_client", lambda: completion(answer, "stop"))
+    assert utils.ADDRESS_OPTIONS["max_tokens"] >= 128
+    assert utils.llm_address_entities.__wrapped__("Straße des 17. Juni am Großen Garten 12A, Dresden") == (
+        "Dresden", "Straße des 17. Juni am Großen Garten", "12A")
+
+
+def test_cut_off_address_is_not_used(monkeypatch):
+    # the cut answer parses, but the street name may be incomplete
+    monkeypatch.setattr(utils, "get_client", lambda: completion('{"city": "Leipzig", "street": "Karl", "house_number": "1"}', "length"))
+    with pytest.raises(TruncatedOutputError):
+        utils.llm_address_entities.__wrapped__("Karl-Liebknecht-Straße 132, Leipzig")
@@ -0,0 +1,84 @@
+import gc
+import os
+import threading
+import time
+
+import pytest
+
+import utils
+import workers
+from caching import DiskCache
+from utils import MenuCache
+from workers import SharedMenu, WorkerPool, publish_menu
+
+
+MENU = [{"id": 1, "name": "Margherita"}, {"id": 2, "name": "Hawaii"}]
+
+
+def test_shared_menu_reloads_only_replaced_snapshots(tmp_path):
+    snapshot = str(tmp_path / "menu.json")
+    publish_menu(snapshot, utils.PizzaMenu(MENU))
+    shared = SharedMenu(snapshot)
+    assert shared().names == ["Margherita", "Hawaii"]
+    assert shared() is shared()
+    assert shared.loads == 1
+    publish_menu(snapshot, utils.PizzaMenu(MENU[:1]))
+    assert shared().names == ["Margherita"]
+    assert shared.loads == 2
+
+
+def test_shared_menu_refuses_snapshots_past_the_stale_limit(tmp_path):
+    snapshot = str(tmp_path / "menu.json")
+    publish_menu(snapshot, utils.PizzaMenu(MENU))
+    shared = SharedMenu(snapshot, max_age=60)
+    assert shared().names == ["Margherita", "Hawaii"]
+    published = time.time() - 120
+    os.utime(snapshot, (published, published))
+    with pytest.raises(RuntimeError):
+        shared()
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork")
+def test_disk_cache_reconnects_in_forked_children(tmp_path):
+    cache = DiskCache(str(tmp_path / "cache.sqlite"))
+    cache.set("parent", 1)
+    connection = cache._conn
+    pid = os.fork()
+    if pid == 0:
+        try:
+            cache.set("child", cache.get("parent") + 1)
+            os._exit(0 if cache._conn is not connection else 1)
+        except BaseException:
+            os._exit(2)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert cache.get("child") == 2
+    assert cache._conn is connection
+
+
+def test_preload_starts_no_threads(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, "menu_cache", MenuCache(lambda: None))
+    monkeypatch.setattr(utils, "_get_menu_items", utils.resilience.guarded("menu")(lambda: MENU))
+    monkeypatch.setattr(workers, "get_knowledge", lambda: None)
+    monkeypatch.setattr(workers, "get_language_detector", lambda: type("Detector", (), {"load": lambda self: None})())
+    threads = set(threading.enumerate())
+    pool = WorkerPool(2, shared_dir=str(tmp_path))
+    try:
+        pool.preload()
+    finally:
+        gc.unfreeze()
+    assert set(threading.enumerate()) <= threads
+    assert utils.menu_cache.get().names == ["Margherita", "Hawaii"] # fresh, no load
+    assert SharedMenu(pool.menu_snapshot)().names == ["Margherita", "Hawaii"]
+
+
+def test_no_fork_while_threads_run(tmp_path):
+    release = threading.Event()
+    thread = threading.Thread(target=release.wait, name="refresh")
+    thread.start()
+    try:
+        with pytest.raises(RuntimeError, match="refresh"):
+            WorkerPool(2, shared_dir=str(tmp_path)).spawn(0)
+    finally:
+        release.set()
+        thread.join()
@@ -1,10 +1,23 @@
-import requests
+import asyncio
+import hashlib
 import json
-from os import environ
-from openai import OpenAI
+import re
+import unicodedata
+import threading
+import time
+from os import environ, path
 from dotenv import load_dotenv
-from fuzzywuzzy import fuzz
-from SPARQLWrapper import SPARQLWrapper, JSON
+from http_client import HttpClient, AsyncHttpClient, parse_timeouts
+from intent_classifier import CascadingIntentClassifier
+from address_parser import parse_address
+from knowledge import get_knowledge, merge_context
+from language import language_name
+from caching import AsyncSingleFlight, DiskCache, Memoizer, SingleFlight, TieredCache, TTLCache, normalize_key_text
+from metrics import Metrics
+from resilience import Resilience, parse_deadlines
+from batching import AsyncMicroBatcher, MicroBatcher, CHATML_STOP, render_chatml
+from structured_output import ADDRESS_SCHEMA, INTENT_SCHEMA, OutputParseError, completion_options, finished_text, parse_bool, parse_json_output
+from concurrent.futures import ThreadPoolExecutor
 import logging
 
 
@@ -18,46 +31,225 @@ pizza_api_base = environ.get('PIZZA_API_BASE')
 openai_api_key = environ.get('OPENAI_API_KEY')
 openai_api_base = environ.get('OPENAI_API_BASE')
 qanary_api_base = environ.get('QANARY_API_BASE')
+pizza_menu_ttl = float(environ.get('PIZZA_MENU_TTL', 300))
+pizza_menu_stale_ttl = float(environ.get('PIZZA_MENU_STALE_TTL', 3600))
 
-client = OpenAI(
-    api_key=openai_api_key,
-    base_url=openai_api_base,
+metrics = Metrics()
+if environ.get('PIZZABOT_METRICS_DUMP'):
+    metrics.dump_periodically(environ.get('PIZZABOT_METRICS_DUMP'), float(environ.get('PIZZABOT_METRICS_DUMP_INTERVAL', 60)))
+
+cassette_mode = environ.get('PIZZABOT_CASSETTE_MODE', 'off')
+cassette = None
+if cassette_mode != 'off':
+    from cassette import Cassette
+    cassette = Cassette(environ.get('PIZZABOT_CASSETTE_PATH', 'cassettes/pizzabot.jsonl'), cassette_mode)
+    if cassette_mode == 'replay':
+        openai_api_key = openai_api_key or 'replay' # no LLM server is contacted
+
+# deadlines, hedged requests and circuit breakers of the backends, see resilience.py
+resilience = Resilience(
+    deadlines=parse_deadlines(environ.get('PIZZABOT_DEADLINES')),
+    hedging=environ.get('PIZZABOT_HEDGING', '1') == '1' and cassette is None, # hedges would reorder the recorded calls
+    failure_threshold=int(environ.get('PIZZABOT_BREAKER_FAILURES', 5)),
+    reset_timeout=float(environ.get('PIZZABOT_BREAKER_RESET', 30)),
+    max_threads=int(environ.get('PIZZABOT_BACKEND_THREADS', 16)),
+    metrics=metrics,
+)
+
+_client = None
+_aclient = None
+
+
+def get_client():
+    """
+    The OpenAI client is created (and the openai package imported) on first use
+    """
+    global _client
+    if _client is None:
+        from openai import OpenAI
+        _client = OpenAI(
+            api_key=openai_api_key,
+            base_url=openai_api_base,
+            timeout=resilience.deadlines["description_llm"], # the longest LLM call, streams are not abandoned otherwise
+            http_client=cassette.http_client() if cassette else None,
+        )
+    return _client
+
+
+def get_aclient():
+    global _aclient
+    if _aclient is None:
+        from openai import AsyncOpenAI
+        _aclient = AsyncOpenAI(
+            api_key=openai_api_key,
+            base_url=openai_api_base,
+            timeout=resilience.deadlines["description_llm"],
+            http_client=cassette.async_http_client() if cassette else None,
+        )
+    return _aclient
+
+http = HttpClient(
+    pool_connections=int(environ.get('HTTP_POOL_CONNECTIONS', 4)),
+    pool_maxsize=int(environ.get('HTTP_POOL_MAXSIZE', 16)),
+    timeouts=parse_timeouts(environ.get('HTTP_TIMEOUTS')),
+    cassette=cassette,
+)
+
+llm_cache = Memoizer(
+    TieredCache(
+        TTLCache(maxsize=int(environ.get('LLM_CACHE_SIZE', 1024)), ttl=float(environ.get('LLM_CACHE_TTL', 86400))),
+        DiskCache(environ.get('LLM_CACHE_PATH')) if environ.get('LLM_CACHE_PATH') else None,
+    ),
+    model_name=lambda: environ.get("MODEL_NAME"),
+)
+
+qanary_cache = TieredCache(
+    TTLCache(maxsize=int(environ.get('QANARY_CACHE_SIZE', 512)), ttl=float(environ.get('QANARY_CACHE_TTL', 7 * 86400))),
+    DiskCache(environ.get('QANARY_CACHE_PATH'), table="qanary") if environ.get('QANARY_CACHE_PATH') else None,
+)
+qanary_flights = SingleFlight()
+aqanary_flights = AsyncSingleFlight()
+
+intent_classifier = CascadingIntentClassifier(
+    confidence=float(environ.get('INTENT_LOCAL_CONFIDENCE', 0.9)),
+    traffic_log=environ.get('INTENT_TRAFFIC_LOG'),
+)
+
+ahttp = AsyncHttpClient(
+    max_connections=int(environ.get('HTTP_ASYNC_MAX_CONNECTIONS', 100)),
+    max_keepalive_connections=int(environ.get('HTTP_POOL_MAXSIZE', 16)),
+    timeouts=parse_timeouts(environ.get('HTTP_TIMEOUTS')),
+    cassette=cassette,
 )
 
 
-def generate_pizza_description(_input, context) -> str:
+DESCRIPTION_PROMPT_VERSION = "2"
+
+
+def _pizza_description_messages(_input, context, language="en") -> list:
     final_prompt = f"""
 Here is the context with pizza descriptions: {context}
 
 Here is the user message: {_input}
 """
 
-    chat_response = client.chat.completions.create(
-        model=environ.get("MODEL_NAME"),
-        messages=[
-            {"role": "system", "content": """You are a Pizza Salesman.
+    return [
+        {"role": "system", "content": """You are a Pizza Salesman.
 Given the context that has multiple pizza descriptions and the user's question generate a pizza description.
-**Output only the description**"""},
-            {"role": "user", "content": final_prompt}
-        ]
+**Output only the description**"""
+            f"\nWrite the description in {language_name(language)}."},
+        {"role": "user", "content": final_prompt}
+    ]
+
+
+@llm_cache.memoize("generate_pizza_description", DESCRIPTION_PROMPT_VERSION)
+@metrics.timed("description_llm")
+@resilience.guarded("description_llm")
+def generate_pizza_description(_input, context, language="en") -> str:
+    chat_response = get_client().chat.completions.create(
+        model=environ.get("MODEL_NAME"),
+        messages=_pizza_description_messages(_input, context, language)
     )
+    metrics.record_usage("description_llm", chat_response.usage)
 
     received_message = chat_response.choices[0].message.content
 
     return received_message
 
 
-def execute(query: str, endpoint_url: str = 'https://query.wikidata.org/bigdata/namespace/wdq/sparql'):
+@llm_cache.memoize("generate_pizza_description", DESCRIPTION_PROMPT_VERSION)
+@metrics.timed("description_llm")
+@resilience.guarded("description_llm")
+async def agenerate_pizza_description(_input, context, language="en") -> str:
+    chat_response = await get_aclient().chat.completions.create(
+        model=environ.get("MODEL_NAME"),
+        messages=_pizza_description_messages(_input, context, language)
+    )
+    metrics.record_usage("description_llm", chat_response.usage)
+
+    return chat_response.choices[0].message.content
+
+
+def stream_pizza_description(_input, context, language="en"):
+    """
+    Yields the description tokens as they arrive from the LLM
+    """
+    cached = llm_cache.lookup("generate_pizza_description", DESCRIPTION_PROMPT_VERSION, (_input, context, language))
+    if cached is not None:
+        yield cached
+        return
+
+    parts = []
+    with metrics.timer("description_llm"), resilience.backend("description_llm").guard(): # until the last token
+        stream = get_client().chat.completions.create(
+            model=environ.get("MODEL_NAME"),
+            messages=_pizza_description_messages(_input, context, language),
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+
+        for chunk in stream:
+            metrics.record_usage("description_llm", chunk.usage) # only set on the last chunk
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+                yield parts[-1]
+
+    llm_cache.store("generate_pizza_description", DESCRIPTION_PROMPT_VERSION, (_input, context, language), "".join(parts))
+
+
+async def astream_pizza_description(_input, context, language="en"):
+    cached = llm_cache.lookup("generate_pizza_description", DESCRIPTION_PROMPT_VERSION, (_input, context, language))
+    if cached is not None:
+        yield cached
+        return
+
+    parts = []
+    with metrics.timer("description_llm"), resilience.backend("description_llm").guard():
+        stream = await get_aclient().chat.completions.create(
+            model=environ.get("MODEL_NAME"),
+            messages=_pizza_description_messages(_input, context, language),
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+
+        async for chunk in stream:
+            metrics.record_usage("description_llm", chunk.usage)
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+                yield parts[-1]
+
+    llm_cache.store("generate_pizza_description", DESCRIPTION_PROMPT_VERSION, (_input, context, language), "".join(parts))
+
+
+WIKIDATA_SPARQL_ENDPOINT = 'https://query.wikidata.org/bigdata/namespace/wdq/sparql'
+SPARQL_HEADERS = {
+    "Accept": "application/sparql-results+json",
+    "User-Agent": "pizzabot (https://github.com/WSE-research/pizzabot)",
+}
+
+
+@resilience.guarded("sparql")
+def _sparql_query(query: str, endpoint_url: str):
+    # plain SPARQL protocol request, so the pooled keep-alive connection is reused
+    response = http.post(endpoint_url, endpoint="sparql", data={"query": query}, headers=SPARQL_HEADERS)
+    response.raise_for_status()
+    return response.json()
+
+
+@resilience.guarded("sparql")
+async def _asparql_query(query: str, endpoint_url: str):
+    response = await ahttp.post(endpoint_url, endpoint="sparql", data={"query": query}, headers=SPARQL_HEADERS)
+    response.raise_for_status()
+    return response.json()
+
+
+def execute(query: str, endpoint_url: str = WIKIDATA_SPARQL_ENDPOINT):
     """
     https://query.wikidata.org/bigdata/namespace/wdq/sparql
     """
     try:
-        sparql = SPARQLWrapper(endpoint_url)
-        sparql.timeout = 20
-        sparql.setQuery(query)
-        sparql.setReturnFormat(JSON)
-        response = sparql.query().convert()
-        return response
+        with metrics.timer("sparql_execute"):
+            return _sparql_query(query, endpoint_url)
     except Exception as e:
         logger.error(str(e))
         if 'MalformedQueryException' in str(e) or 'bad formed' in str(e):
@@ -65,32 +257,37 @@ def execute(query: str, endpoint_url: str = 'https://query.wikidata.org/bigdata/
         return {'error': str(e)}
 
 
-def call_qanary_pipeline(question: str):
-    """
-    Call Qanary pipeline to get the answer for the given question
-    """
+async def aexecute(query: str, endpoint_url: str = WIKIDATA_SPARQL_ENDPOINT):
     try:
-        url = f'{qanary_api_base}/startquestionansweringwithtextquestion'
-        
-        logger.info(f"Calling Qanary pipeline at: {url}")
+        with metrics.timer("sparql_execute"):
+            return await _asparql_query(query, endpoint_url)
+    except Exception as e:
+        logger.error(str(e))
+        return {'error': str(e)}
 
-        headers = {
-            'Origin': qanary_api_base,
-            'Referer': url
-        }
 
-        data = {
-            'question': question,
-            'componentfilterinput': '',
-            'componentlist[]': ['Alex-Wikidata_Lookup_NEL_component', 'Alex-Wikidata_Query_Builder_component', 'Alex-QE-Python-SPARQLExecuter'] # our component sequence
-        }
+QANARY_COMPONENTS = ['Alex-Wikidata_Lookup_NEL_component', 'Alex-Wikidata_Query_Builder_component', 'Alex-QE-Python-SPARQLExecuter'] # our component sequence
+
+
+def _qanary_request(question: str) -> tuple:
+    url = f'{qanary_api_base}/startquestionansweringwithtextquestion'
+
+    headers = {
+        'Origin': qanary_api_base,
+        'Referer': url
+    }
 
-        response = requests.post(url, headers=headers, data=data, timeout=60)
+    data = {
+        'question': question,
+        'componentfilterinput': '',
+        'componentlist[]': QANARY_COMPONENTS
+    }
 
-        uuid = response.json()['inGraph']
-        sparql_endpoint = response.json()['endpoint']
+    return url, headers, data
 
-        query = f"""
+
+def _qanary_answer_query(uuid: str) -> str:
+    return f"""
         PREFIX qa: <http://www.wdaqua.eu/qa#>
         PREFIX oa: <http://www.w3.org/ns/openannotation/core/>
         PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
@@ -102,20 +299,120 @@ def call_qanary_pipeline(question: str):
                 rdf:value ?value .
         }}"""
 
-        result = eval(execute(query, sparql_endpoint)["results"]["bindings"][0]["value"]["value"]) # response format from Virtuoso is weird
 
-        rq_vars = result["head"]["vars"]
+def _qanary_context(answer: dict) -> str:
+    result = parse_json_output(answer["results"]["bindings"][0]["value"]["value"]) # response format from Virtuoso is weird
+
+    rq_vars = result["head"]["vars"]
+
+    context = ""
+
+    for b in result["results"]["bindings"]:
+        context += " ".join([f'{b[var]["value"]}' for var in rq_vars]) + "\n"
+
+    return context
+
+
+def qanary_cache_key(question: str, components: list = QANARY_COMPONENTS) -> str:
+    return hashlib.sha256(json.dumps([normalize_key_text(question), components]).encode("utf-8")).hexdigest()
+
+
+def call_qanary_pipeline(question: str):
+    """
+    Call Qanary pipeline to get the answer for the given question.
+    Answers are cached, and concurrent identical questions share one pipeline run
+    """
+    key = qanary_cache_key(question)
+    context = qanary_cache.get(key)
+    if context is not None:
+        return context
 
-        context = ""
+    context = qanary_flights.do(key, _run_qanary_pipeline, question)
+    if context: # failed runs return "" and are not cached
+        qanary_cache.set(key, context)
+    return context
 
-        for b in result["results"]["bindings"]:
-            context += " ".join([f'{b[var]["value"]}' for var in rq_vars]) + "\n"
 
+async def acall_qanary_pipeline(question: str):
+    key = qanary_cache_key(question)
+    context = qanary_cache.get(key)
+    if context is not None:
         return context
+
+    context = await aqanary_flights.do(key, _arun_qanary_pipeline, question)
+    if context:
+        qanary_cache.set(key, context)
+    return context
+
+
+@resilience.guarded("qanary")
+def _start_qanary(question: str) -> dict:
+    url, headers, data = _qanary_request(question)
+
+    logger.debug(f"Calling Qanary pipeline at: {url}")
+
+    response = http.post(url, endpoint="qanary", headers=headers, data=data)
+    return response.json()
+
+
+@resilience.guarded("qanary")
+async def _astart_qanary(question: str) -> dict:
+    url, headers, data = _qanary_request(question)
+
+    logger.debug(f"Calling Qanary pipeline at: {url}")
+
+    response = await ahttp.post(url, endpoint="qanary", headers=headers, data=data)
+    return response.json()
+
+
+def _run_qanary_pipeline(question: str):
+    try:
+        with metrics.timer("qanary_start"):
+            started = _start_qanary(question)
+
+        uuid = started['inGraph']
+        sparql_endpoint = started['endpoint']
+
+        return _qanary_context(execute(_qanary_answer_query(uuid), sparql_endpoint))
+    except Exception as e:
+        logger.error(str(e))
+        return ""
+
+
+async def _arun_qanary_pipeline(question: str):
+    try:
+        with metrics.timer("qanary_start"):
+            started = await _astart_qanary(question)
+
+        uuid = started['inGraph']
+        sparql_endpoint = started['endpoint']
+
+        return _qanary_context(await aexecute(_qanary_answer_query(uuid), sparql_endpoint))
     except Exception as e:
         logger.error(str(e))
         return ""
 
+
+def get_pizza_context(question: str) -> str:
+    """
+    Pizza descriptions from the local Wikidata snapshot. The Qanary pipeline is asked as well if the question names
+    a pizza the snapshot doesn't know, its lines are added to the ones from the snapshot
+    """
+    knowledge = get_knowledge()
+    context, complete = knowledge.answer(question) if knowledge is not None else ("", False)
+    if complete:
+        return context
+    return merge_context(context, call_qanary_pipeline(question))
+
+
+async def aget_pizza_context(question: str) -> str:
+    knowledge = get_knowledge()
+    context, complete = knowledge.answer(question) if knowledge is not None else ("", False)
+    if complete:
+        return context
+    return merge_context(context, await acall_qanary_pipeline(question))
+
+
 def fetch_pizza_descriptions_from_wikidata() -> dict:
     # note, this is a static SPARQL query that returns descriptions for all available pizzas
     sparql_query = """
@@ -137,94 +434,705 @@ ORDER BY ?label # sort by name
     return result
 
 
-def check_order_intention(_input):
-    example_string_1 = "I wanna order a pizza."
-    assistant_docstring_1 = """{"intention": True}"""
+INTENT_PROMPT_VERSION = "2"
 
-    example_string_2 = "How are you doing today?"
-    assistant_docstring_2 = """{"intention": False}"""
+# NLU output: token budget and stop sequences always, PIZZABOT_NLU_RESPONSE_FORMAT=json_object|json_schema
+# additionally constrains the output on servers that support it
+nlu_response_format = environ.get('PIZZABOT_NLU_RESPONSE_FORMAT', 'none')
+INTENT_OPTIONS = completion_options("order_intention", INTENT_SCHEMA, max_tokens=12, response_format=nlu_response_format)
 
-    chat_response = client.chat.completions.create(
-        model=environ.get("MODEL_NAME"),
-        messages=[
-            {"role": "system", "content": """You are an Input Validation Tools.
+# static prefix, identical for every call, so the server can reuse its prompt cache
+INTENT_PROMPT_PREFIX = (
+    {"role": "system", "content": """You are an Input Validation Tools.
 Recognize whether the user wants to order a pizza or he/she has another intention and output the structured data as a JSON. **Output ONLY the structured data.**
 Below is a text for you to analyze."""},
-            {"role": "user", "content": example_string_1},
-            {"role": "assistant", "content": assistant_docstring_1},
-            {"role": "user", "content": example_string_2},
-            {"role": "assistant", "content": assistant_docstring_2},
-            {"role": "user", "content": _input}
-        ]
+    {"role": "user", "content": "I wanna order a pizza."},
+    {"role": "assistant", "content": """{"intention": true}"""},
+    {"role": "user", "content": "How are you doing today?"},
+    {"role": "assistant", "content": """{"intention": false}"""},
+)
+
+
+def _order_intention_messages(_input) -> list:
+    return [*INTENT_PROMPT_PREFIX, {"role": "user", "content": _input}]
+
+
+def check_order_intention(_input):
+    """
+    Keyword matcher and local model first, the LLM only if both are not confident
+    """
+    return intent_classifier.classify(_input, llm=llm_order_intention).intention
+
+
+async def acheck_order_intention(_input):
+    return (await intent_classifier.aclassify(_input, allm=allm_order_intention)).intention
+
+
+def _parse_order_intention(received_message) -> bool:
+    logger.debug(received_message)
+    output = parse_json_output(received_message)
+    if not isinstance(output, dict) or "intention" not in output:
+        raise OutputParseError(f"No intention in model output: {received_message!r}")
+    return parse_bool(output["intention"])
+
+
+@llm_cache.memoize("check_order_intention", INTENT_PROMPT_VERSION)
+@metrics.timed("intent_llm")
+@resilience.guarded("intent_llm")
+def llm_order_intention(_input):
+    if intent_batcher is not None:
+        return intent_batcher.submit(_input)
+    chat_response = get_client().chat.completions.create(
+        model=environ.get("MODEL_NAME"),
+        messages=_order_intention_messages(_input),
+        **INTENT_OPTIONS
     )
+    metrics.record_usage("intent_llm", chat_response.usage)
 
-    received_message = chat_response.choices[0].message.content
-    logger.info(received_message)
-    return eval(received_message)["intention"]
+    choice = chat_response.choices[0]
+    return _parse_order_intention(finished_text(choice.message.content, choice.finish_reason))
 
 
-def check_customer_address(_input):
-    example_string = "My address is Gustav-Freytag Straße 12A in Leipzig."
-    assistant_docstring = """[{"Leipzig": "CITY"}, {"Gustav-Freytag Straße": "STREET"}, {"12A": "HOUSE_NUMBER"}]"""
-    chat_response = client.chat.completions.create(
+@llm_cache.memoize("check_order_intention", INTENT_PROMPT_VERSION)
+@metrics.timed("intent_llm")
+@resilience.guarded("intent_llm")
+async def allm_order_intention(_input):
+    if aintent_batcher is not None:
+        return await aintent_batcher.submit(_input)
+    chat_response = await get_aclient().chat.completions.create(
         model=environ.get("MODEL_NAME"),
-        messages=[
-            {"role": "system", "content": """You are a Named Entity Recognition Tool.
-Recognize named entities and output the structured data as a JSON. **Output ONLY the structured data.**
+        messages=_order_intention_messages(_input),
+        **INTENT_OPTIONS
+    )
+    metrics.record_usage("intent_llm", chat_response.usage)
+
+    choice = chat_response.choices[0]
+    return _parse_order_intention(finished_text(choice.message.content, choice.finish_reason))
+
+
+ADDRESS_PROMPT_VERSION = "2"
+
+# long street names ("Karl-Liebknecht-Straße") take many tokens, a cut off answer is an error, not an address
+ADDRESS_OPTIONS = completion_options("address", ADDRESS_SCHEMA, max_tokens=128, response_format=nlu_response_format)
+
+ADDRESS_PROMPT_PREFIX = (
+    {"role": "system", "content": """You are a Named Entity Recognition Tool.
+Recognize the city, street and house number and output the structured data as a JSON. **Output ONLY the structured data.**
 Below is a text for you to analyze."""},
-            {"role": "user", "content": example_string},
-            {"role": "assistant", "content": assistant_docstring},
-            {"role": "user", "content": _input}
-        ]
+    {"role": "user", "content": "My address is Gustav-Freytag Straße 12A in Leipzig."},
+    {"role": "assistant", "content": """{"city": "Leipzig", "street": "Gustav-Freytag Straße", "house_number": "12A"}"""},
+)
+
+
+def _address_entities_messages(_input) -> list:
+    return [*ADDRESS_PROMPT_PREFIX, {"role": "user", "content": _input}]
+
+
+def _parse_address_entities(received_message) -> tuple:
+    output = parse_json_output(received_message)
+    if isinstance(output, list): # entity list of the first prompt version: [{"Leipzig": "CITY"}, ...]
+        output = {label.lower(): value for d in output if isinstance(d, dict) for value, label in d.items()}
+    try:
+        return (str(output["city"]), str(output["street"]), str(output["house_number"]))
+    except (KeyError, TypeError):
+        raise OutputParseError(f"Incomplete address in model output: {received_message!r}") from None
+
+
+@llm_cache.memoize("check_customer_address", ADDRESS_PROMPT_VERSION, decode=tuple)
+@metrics.timed("ner_llm")
+@resilience.guarded("ner_llm")
+def llm_address_entities(_input) -> tuple:
+    if address_batcher is not None:
+        return address_batcher.submit(_input)
+    chat_response = get_client().chat.completions.create(
+        model=environ.get("MODEL_NAME"),
+        messages=_address_entities_messages(_input),
+        **ADDRESS_OPTIONS
     )
+    metrics.record_usage("ner_llm", chat_response.usage)
 
-    received_message = chat_response.choices[0].message.content
-    logger.info(received_message)
+    choice = chat_response.choices[0]
+    received_message = finished_text(choice.message.content, choice.finish_reason)
+    logger.debug(received_message)
+
+    return _parse_address_entities(received_message)
+
+
+@llm_cache.memoize("check_customer_address", ADDRESS_PROMPT_VERSION, decode=tuple)
+@metrics.timed("ner_llm")
+@resilience.guarded("ner_llm")
+async def allm_address_entities(_input) -> tuple:
+    if aaddress_batcher is not None:
+        return await aaddress_batcher.submit(_input)
+    chat_response = await get_aclient().chat.completions.create(
+        model=environ.get("MODEL_NAME"),
+        messages=_address_entities_messages(_input),
+        **ADDRESS_OPTIONS
+    )
+    metrics.record_usage("ner_llm", chat_response.usage)
+
+    choice = chat_response.choices[0]
+    received_message = finished_text(choice.message.content, choice.finish_reason)
+    logger.debug(received_message)
 
-    response_dictionary = {}
-    for d in json.loads(received_message):
-        response_dictionary.update(d)
+    return _parse_address_entities(received_message)
 
-    city = [k for (k, v) in response_dictionary.items() if v == "CITY"][0]
-    street = [k for (k, v) in response_dictionary.items() if v == "STREET"][0]
-    house_number = [
-        k for (k, v) in response_dictionary.items() if v == "HOUSE_NUMBER"][0]
+
+# Micro-batching of the NLU calls: concurrent intent / address LLM calls within the window are sent together,
+# as one multi-prompt completions request ("prompts", ChatML prompts) or as concurrent chat completions ("fanout").
+# Only "prompts" hands the server a batch; "fanout" just deduplicates identical inputs and adds the window to the latency
+nlu_batch_window = float(environ.get('PIZZABOT_NLU_BATCH_WINDOW_MS', 0)) / 1000
+nlu_batch_mode = environ.get('PIZZABOT_NLU_BATCH_MODE', 'prompts')
+nlu_batch_size = int(environ.get('PIZZABOT_NLU_BATCH_SIZE', 32))
+
+
+def _complete_batch(message_lists: list, backend: str, options: dict) -> list:
+    """
+    One completion text per message list; a failed completion is returned as the exception
+    """
+    metrics.inc("pizzabot_nlu_batches", backend=backend)
+    metrics.inc("pizzabot_nlu_batched_prompts", len(message_lists), backend=backend)
+    if nlu_batch_mode == "prompts":
+        response = get_client().completions.create(
+            model=environ.get("MODEL_NAME"),
+            prompt=[render_chatml(messages) for messages in message_lists],
+            max_tokens=options["max_tokens"],
+            stop=CHATML_STOP + options["stop"] # the completions endpoint has no response_format
+        )
+        metrics.record_usage(backend, response.usage)
+        texts = [None] * len(message_lists)
+        for choice in response.choices:
+            try:
+                texts[choice.index] = finished_text(choice.text, choice.finish_reason)
+            except OutputParseError as e: # only the callers of this prompt fail
+                texts[choice.index] = e
+        return texts
+
+    def complete(messages):
+        try:
+            chat_response = get_client().chat.completions.create(model=environ.get("MODEL_NAME"), messages=messages, **options)
+        except Exception as e:
+            return e
+        metrics.record_usage(backend, chat_response.usage)
+        choice = chat_response.choices[0]
+        try:
+            return finished_text(choice.message.content, choice.finish_reason)
+        except OutputParseError as e:
+            return e
+
+    return list(nlu_executor.map(complete, message_lists))
+
+
+async def _acomplete_batch(message_lists: list, backend: str, options: dict) -> list:
+    metrics.inc("pizzabot_nlu_batches", backend=backend)
+    metrics.inc("pizzabot_nlu_batched_prompts", len(message_lists), backend=backend)
+    if nlu_batch_mode == "prompts":
+        response = await get_aclient().completions.create(
+            model=environ.get("MODEL_NAME"),
+            prompt=[render_chatml(messages) for messages in message_lists],
+            max_tokens=options["max_tokens"],
+            stop=CHATML_STOP + options["stop"] # the completions endpoint has no response_format
+        )
+        metrics.record_usage(backend, response.usage)
+        texts = [None] * len(message_lists)
+        for choice in response.choices:
+            try:
+                texts[choice.index] = finished_text(choice.text, choice.finish_reason)
+            except OutputParseError as e: # only the callers of this prompt fail
+                texts[choice.index] = e
+        return texts
+
+    async def complete(messages):
+        chat_response = await get_aclient().chat.completions.create(model=environ.get("MODEL_NAME"), messages=messages, **options)
+        metrics.record_usage(backend, chat_response.usage)
+        choice = chat_response.choices[0]
+        return finished_text(choice.message.content, choice.finish_reason)
+
+    return await asyncio.gather(*[complete(messages) for messages in message_lists], return_exceptions=True)
+
+
+def _parse_batch(texts: list, parse) -> list:
+    results = []
+    for text in texts:
+        try:
+            results.append(text if isinstance(text, Exception) else parse(text))
+        except Exception as e: # only the callers of this input fail
+            results.append(e)
+    return results
+
+
+def _nlu_batch_handler(messages, parse, backend: str, options: dict):
+    def handler(inputs: list) -> list:
+        return _parse_batch(_complete_batch([messages(_input) for _input in inputs], backend, options), parse)
+    return handler
+
+
+def _anlu_batch_handler(messages, parse, backend: str, options: dict):
+    async def handler(inputs: list) -> list:
+        return _parse_batch(await _acomplete_batch([messages(_input) for _input in inputs], backend, options), parse)
+    return handler
+
+
+intent_batcher = aintent_batcher = address_batcher = aaddress_batcher = None
+if nlu_batch_window > 0:
+    nlu_executor = ThreadPoolExecutor(max_workers=nlu_batch_size, thread_name_prefix="nlu-batch")
+    intent_batcher = MicroBatcher(_nlu_batch_handler(_order_intention_messages, _parse_order_intention, "intent_llm", INTENT_OPTIONS), nlu_batch_window, nlu_batch_size)
+    aintent_batcher = AsyncMicroBatcher(_anlu_batch_handler(_order_intention_messages, _parse_order_intention, "intent_llm", INTENT_OPTIONS), nlu_batch_window, nlu_batch_size)
+    address_batcher = MicroBatcher(_nlu_batch_handler(_address_entities_messages, _parse_address_entities, "ner_llm", ADDRESS_OPTIONS), nlu_batch_window, nlu_batch_size)
+    aaddress_batcher = AsyncMicroBatcher(_anlu_batch_handler(_address_entities_messages, _parse_address_entities, "ner_llm", ADDRESS_OPTIONS), nlu_batch_window, nlu_batch_size)
+
+
+class AddressValidationCache:
+    """
+    Bounded cache of Pizza API address validation results, keyed by the normalized (city, street, house_number).
+    Accepted addresses are kept for `ttl` seconds, rejections only for `negative_ttl` seconds.
+    The content can be exported as a snapshot and loaded again to warm-start another process.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 7 * 86400, negative_ttl: float = 300):
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.negative_ttl = negative_ttl
+
+    @staticmethod
+    def key(city, street, house_number) -> str:
+        street = re.sub(r"(stra(ss|ß)e|str\.?)(?=\s|$)", "str", normalize_key_text(street))
+        return "|".join([normalize_key_text(city), street.replace("-", " "), normalize_key_text(house_number).replace(" ", "")])
+
+    def get(self, city, street, house_number):
+        """
+        Returns True/False for a cached result, None if the address is unknown
+        """
+        return self.cache.get(self.key(city, street, house_number))
+
+    def set(self, city, street, house_number, valid: bool):
+        self.cache.set(self.key(city, street, house_number), valid, ttl=None if valid else self.negative_ttl)
+
+    def export_snapshot(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump([[key, valid, expires_at] for key, valid, expires_at in self.cache.items()], f)
+
+    def load_snapshot(self, path: str):
+        with open(path, encoding="utf-8") as f:
+            entries = json.load(f)
+        now = time.time()
+        for key, valid, expires_at in entries:
+            if expires_at > now:
+                self.cache.set(key, valid, ttl=expires_at - now)
+        logger.info(f"Loaded {len(self.cache)} cached address validations from {path}")
+
+    def stats(self) -> dict:
+        return self.cache.stats()
+
+
+address_cache = AddressValidationCache(
+    maxsize=int(environ.get('ADDRESS_CACHE_SIZE', 10000)),
+    ttl=float(environ.get('ADDRESS_CACHE_TTL', 7 * 86400)),
+    negative_ttl=float(environ.get('ADDRESS_CACHE_NEGATIVE_TTL', 300)),
+)
+if environ.get('ADDRESS_CACHE_SNAPSHOT') and path.exists(environ.get('ADDRESS_CACHE_SNAPSHOT')):
+    address_cache.load_snapshot(environ.get('ADDRESS_CACHE_SNAPSHOT'))
+
+
+def _address_validation_result(address: tuple, response):
+    if response.status_code == 200:
+        address_cache.set(*address, True)
+        logger.debug("Potential Address found: " + str(address))
+        return address
+    if 400 <= response.status_code < 500: # only definitive rejections are cached, not server errors
+        address_cache.set(*address, False)
+    return None
+
+
+@resilience.guarded("address_validate")
+def _post_address_validation(payload: dict):
+    return http.post(f"{pizza_api_base}/address/validate", endpoint="address_validate", json=payload)
+
+
+@resilience.guarded("address_validate")
+async def _apost_address_validation(payload: dict):
+    return await ahttp.post(f"{pizza_api_base}/address/validate", endpoint="address_validate", json=payload)
+
+
+def validate_address(city, street, house_number):
+    address = (city, street, house_number)
+    cached = address_cache.get(*address)
+    if cached is not None:
+        return address if cached else None
 
     payload = {"city": city, "street": street, "house_number": house_number}
-    response = requests.post(
-        f"{pizza_api_base}/address/validate", json=payload, timeout=5)
+    with metrics.timer("address_validate"):
+        response = _post_address_validation(payload)
+    return _address_validation_result(address, response)
 
-    if response.status_code != 200:
+
+async def avalidate_address(city, street, house_number):
+    address = (city, street, house_number)
+    cached = address_cache.get(*address)
+    if cached is not None:
+        return address if cached else None
+
+    payload = {"city": city, "street": street, "house_number": house_number}
+    with metrics.timer("address_validate"):
+        response = await _apost_address_validation(payload)
+    return _address_validation_result(address, response)
+
+
+def extract_address_entities(_input) -> tuple:
+    """
+    Local address parser first, the LLM only for input the parser can't handle
+    """
+    address = parse_address(_input)
+    if address is not None:
+        logger.debug(f"Address parsed locally: {address}")
+        return address
+    return llm_address_entities(_input)
+
+
+async def aextract_address_entities(_input) -> tuple:
+    address = parse_address(_input)
+    if address is not None:
+        logger.debug(f"Address parsed locally: {address}")
+        return address
+    return await allm_address_entities(_input)
+
+
+def check_customer_address(_input):
+    city, street, house_number = extract_address_entities(_input)
+    return validate_address(city, street, house_number)
+
+
+async def acheck_customer_address(_input):
+    city, street, house_number = await aextract_address_entities(_input)
+    return await avalidate_address(city, street, house_number)
+
+
+class MenuUnavailableError(ConnectionError):
+    """
+    The menu could not be loaded and there is no usable cached copy, raised from the error of the last load
+    """
+
+
+class MenuCache:
+    """
+    Process-wide cache of the parsed Pizza API menu.
+
+    The menu is refreshed in the background once it reaches `refresh_ahead` of its TTL.
+    After the TTL the stale menu is served right away while a single background refresh
+    replaces it (stale-while-revalidate, up to `stale_ttl`). Only callers that find no usable
+    menu wait for the load. `clock` returns seconds, e.g. a fake clock in tests.
+    """
+
+    def __init__(self, loader, ttl: float = 300, stale_ttl: float = 3600, refresh_ahead: float = 0.8, clock=time.monotonic):
+        self.loader = loader
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.refresh_ahead = refresh_ahead
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self._value = None
+        self._loaded_at = 0.0
+        self._last_error = None # of the last failed load, the cause of `MenuUnavailableError`
+        self._lock = threading.Lock()
+        self._refresh_done = None # threading.Event of the refresh in flight, if any
+
+    def get(self):
+        """
+        Returns the cached menu, loading it synchronously only if there is nothing usable
+        """
+        value = self._value
+        if value is not None:
+            age = self.clock() - self._loaded_at
+            if age < self.ttl:
+                self._count("hits")
+                if age >= self.ttl * self.refresh_ahead:
+                    self._refresh_in_background()
+                return value
+            if age < self.ttl + self.stale_ttl:
+                self._count("stale_hits")
+                self._refresh_in_background()
+                return value
+
+        self._count("misses")
+        done = self._refresh_in_background()
+        done.wait()
+        if self._value is None or self.clock() - self._loaded_at >= self.ttl + self.stale_ttl: # the load failed
+            raise MenuUnavailableError("Pizza menu is not available") from self._last_error
+        return self._value
+
+    def peek(self):
+        """
+        The cached menu (possibly stale), None if it was not loaded yet. Never loads it
+        """
+        return self._value
+
+    def is_fresh(self) -> bool:
+        return self._value is not None and self.clock() - self._loaded_at < self.ttl
+
+    async def aget(self):
+        """
+        Same as `get`, but only blocks a worker thread (not the event loop) if the menu has to be loaded
+        """
+        value = self._value
+        if value is not None and self.clock() - self._loaded_at < self.ttl + self.stale_ttl:
+            return self.get() # never waits, a refresh runs in the background
+        return await asyncio.to_thread(self.get)
+
+    def set(self, value):
+        """
+        Stores a loaded menu as fresh
+        """
+        with self._lock:
+            self._value = value
+            self._loaded_at = self.clock()
+            self._last_error = None
+            self.refreshes += 1
+
+    def invalidate(self):
+        with self._lock:
+            self._value = None
+            self._loaded_at = 0.0
+
+    def _count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self) -> dict:
+        requests_total = self.hits + self.stale_hits + self.misses
+        return {
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.stale_hits) / requests_total if requests_total else 0.0,
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+            "age": self.clock() - self._loaded_at if self._value is not None else None,
+        }
+
+    def _refresh_in_background(self) -> threading.Event:
+        with self._lock:
+            if self._refresh_done is not None: # a refresh is already running
+                return self._refresh_done
+            done = self._refresh_done = threading.Event()
+        threading.Thread(target=self._refresh, args=(done,), daemon=True).start()
+        return done
+
+    def _refresh(self, done: threading.Event):
+        try:
+            self.set(self.loader())
+        except Exception as e:
+            with self._lock:
+                self._last_error = e
+                self.refresh_errors += 1
+            logger.error(f"Pizza menu refresh failed: {e}")
+        finally:
+            with self._lock:
+                self._refresh_done = None
+            done.set()
+
+
+def normalize_text(text: str) -> str:
+    """
+    Lowercases the text, folds accents and collapses everything that is not a letter or digit into single spaces
+    """
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(re.findall(r"[a-z0-9]+", text))
+
+
+class PizzaNameIndex:
+    """
+    Normalized lookup structure over the menu, built once per menu refresh.
+
+    Every pizza is indexed by its lowercased name and aliases (e.g. "hawaiian pizza", "pizza hawaiian")
+    and by the token n-grams of those. Lookups try an exact phrase match on the n-grams of the input first,
+    then a token match and only then a best-score fuzzy ranking over the remaining candidates.
+    The fuzzy ranking compares the input without stopwords to the bare names (no "pizza" aliases) and needs a
+    similar word in both, so generic input like "pizza" or "tuna pizza" does not match any pizza.
+    """
+
+    stopwords = {"pizza", "pizzas", "a", "an", "the", "i", "want", "to", "order", "please", "one", "with", "and"}
+
+    def __init__(self, items: list, threshold: int = 80):
+        self.threshold = threshold
+        self.phrases = {} # normalized name or alias -> pizza id
+        self.tokens = {} # single token -> set of pizza ids
+        self.max_phrase_length = 1
+        for item in items:
+            pizza_id = str(item["id"])
+            for alias in self.aliases(item):
+                self.phrases.setdefault(alias, pizza_id)
+                words = alias.split()
+                self.max_phrase_length = max(self.max_phrase_length, len(words))
+                for word in words:
+                    if word not in self.stopwords and len(word) > 2:
+                        self.tokens.setdefault(word, set()).add(pizza_id)
+        self.choices = self.bare_names(self.phrases)
+
+    @classmethod
+    def terms(cls, text: str) -> list:
+        """
+        The words of a normalized text without the stopwords
+        """
+        return [word for word in text.split() if word not in cls.stopwords]
+
+    @classmethod
+    def bare_names(cls, phrases: dict) -> dict:
+        """
+        Fuzzy matching choices: the names and aliases without stopwords -> pizza id
+        """
+        names = {}
+        for phrase, pizza_id in phrases.items():
+            bare = " ".join(cls.terms(phrase))
+            if bare:
+                names.setdefault(bare, pizza_id)
+        return names
+
+    def aliases(self, item: dict) -> set:
+        name = normalize_text(item["name"])
+        bare = " ".join(w for w in name.split() if w not in ("pizza", "pizzas"))
+        aliases = {name, bare, f"pizza {bare}", f"{bare} pizza"}
+        aliases.update(normalize_text(alias) for alias in item.get("aliases", []))
+        return {alias for alias in aliases if alias}
+
+    def lookup(self, _input: str):
+        query = normalize_text(_input)
+        if not query:
+            return None
+
+        words = query.split()
+        # exact match on the longest name/alias contained in the input
+        for n in range(min(self.max_phrase_length, len(words)), 0, -1):
+            for i in range(len(words) - n + 1):
+                pizza_id = self.phrases.get(" ".join(words[i:i + n]))
+                if pizza_id is not None:
+                    return pizza_id
+
+        # token match, only if the tokens point to a single pizza
+        candidates = set()
+        for word in words:
+            candidates.update(self.tokens.get(word, ()))
+        if len(candidates) == 1:
+            return next(iter(candidates))
+
+        # best-score fuzzy ranking over the bare names of the token candidates (or the whole menu)
+        terms = self.terms(query)
+        choices = [c for c, pizza_id in self.choices.items() if pizza_id in candidates] if candidates else list(self.choices)
+        if len("".join(terms)) < 3 or not choices:
+            return None
+        from fuzzywuzzy import fuzz, process # only needed when neither the phrase nor the token match succeeded
+        ranked = process.extractBests(" ".join(terms), choices, scorer=fuzz.WRatio, processor=None,
+                                      score_cutoff=self.threshold, limit=5)
+        for choice, _ in ranked:
+            # a high score alone can also come from a shared substring, one word has to be similar
+            if any(fuzz.ratio(term, word) >= self.threshold for term in terms for word in choice.split()):
+                return self.choices[choice]
         return None
 
-    logger.info("Potential Address found: " +
-                str((city, street, house_number)))
-    return (city, street, house_number)
+    def snapshot(self) -> dict:
+        return {
+            "threshold": self.threshold,
+            "phrases": self.phrases,
+            "tokens": {token: sorted(ids) for token, ids in self.tokens.items()},
+            "max_phrase_length": self.max_phrase_length,
+        }
+
+    @classmethod
+    def from_snapshot(cls, snapshot: dict):
+        """
+        Restores a built index without re-indexing the menu
+        """
+        index = cls.__new__(cls)
+        index.threshold = snapshot["threshold"]
+        index.phrases = snapshot["phrases"]
+        index.tokens = {token: set(ids) for token, ids in snapshot["tokens"].items()}
+        index.max_phrase_length = snapshot["max_phrase_length"]
+        index.choices = cls.bare_names(index.phrases)
+        return index
+
+
+class PizzaMenu:
+    def __init__(self, items: list, index: PizzaNameIndex = None):
+        self.items = items
+        self.names = [item["name"] for item in items]
+        self.index = index or PizzaNameIndex(items)
+        self.words = {word for phrase in self.index.phrases for word in phrase.split()}
+
+    def snapshot(self) -> dict:
+        return {"items": self.items, "index": self.index.snapshot()}
+
+    @classmethod
+    def from_snapshot(cls, snapshot: dict):
+        return cls(snapshot["items"], PizzaNameIndex.from_snapshot(snapshot["index"]))
+
+
+@resilience.guarded("menu")
+def _get_menu_items() -> list:
+    response = http.get(f"{pizza_api_base}/pizza", endpoint="menu")
+    response.raise_for_status()
+    return response.json()
+
+
+def fetch_pizza_menu() -> PizzaMenu:
+    with metrics.timer("menu"):
+        items = _get_menu_items()
+    return PizzaMenu(items)
+
+
+menu_cache = MenuCache(fetch_pizza_menu, ttl=pizza_menu_ttl, stale_ttl=pizza_menu_stale_ttl)
 
 
 def get_pizza_menu():
-    response = requests.get(f"{pizza_api_base}/pizza", timeout=5)
-    return ", ".join([item["name"] for item in response.json()])
+    return ", ".join(menu_cache.get().names)
+
+
+def menu_words() -> set:
+    """
+    Words of the pizza names and aliases, empty while the menu is not loaded
+    """
+    menu = menu_cache.peek()
+    return menu.words if menu is not None else set()
 
 
 def validate_pizza_name(_input):
-    threshold = 80
-    response = requests.get(f"{pizza_api_base}/pizza", timeout=5)
-    menu = response.json()
-    for item in menu:
-        current_ratio = fuzz.partial_ratio(_input, list(item.values())[1])
-        if (current_ratio >= threshold):
-            # print("debugging: " + str(list(item.values())[1]) + " was determined type")
-            return str(list(item.values())[0])
-    return None
+    return menu_cache.get().index.lookup(_input)
 
 
-def post_order(pizza_id, address):
+def prefetch_pizza_menu():
+    """
+    Warms the menu cache, returns whether a load was necessary
+    """
+    if menu_cache.is_fresh():
+        return False
+    menu_cache.get()
+    return True
+
+
+async def aprefetch_pizza_menu():
+    if menu_cache.is_fresh():
+        return False
+    await menu_cache.aget()
+    return True
+
+
+async def aget_pizza_menu():
+    return ", ".join((await menu_cache.aget()).names)
+
+
+async def avalidate_pizza_name(_input):
+    return (await menu_cache.aget()).index.lookup(_input)
+
+
+def _order_payload(pizza_id, address) -> dict:
     city, street, house_number = address
-    post = {"pizza_id": pizza_id, "city": city,
+    return {"pizza_id": pizza_id, "city": city,
             "street": street, "house_number": house_number}
-    response = requests.post(f"{pizza_api_base}/order", json=post, timeout=5)
 
+
+def _parse_order_response(response):
     if response.status_code != 200:
         return None
 
@@ -237,20 +1145,98 @@ def post_order(pizza_id, address):
     return order_id
 
 
+# not idempotent: never hedged (a duplicate would place a second order) and never abandoned at a deadline (the
+# order may have been placed already), the call ends with its HTTP timeout
+@metrics.timed("order_post")
+@resilience.guarded("order", abandon=False)
+def post_order(pizza_id, address):
+    response = http.post(f"{pizza_api_base}/order", endpoint="order", json=_order_payload(pizza_id, address))
+    return _parse_order_response(response)
+
+
+@metrics.timed("order_post")
+@resilience.guarded("order", abandon=False)
+async def apost_order(pizza_id, address):
+    response = await ahttp.post(f"{pizza_api_base}/order", endpoint="order", json=_order_payload(pizza_id, address))
+    return _parse_order_response(response)
+
+
 def get_order(order_id):
-    response = requests.get(
-        f"{pizza_api_base}/address/validate/" + order_id, timeout=5)
+    response = http.get(
+        f"{pizza_api_base}/address/validate/" + order_id, endpoint="order")
     order = response.json()
     # TODO return order information if asked
 
 
+history_window = int(environ.get('PIZZABOT_HISTORY_WINDOW', 20))
+history_archive_path = environ.get('PIZZABOT_HISTORY_ARCHIVE')
+
+
+def archive_messages(messages: list):
+    """
+    Appends messages that fall out of the history window to the archive file (JSON lines), if one is configured
+    """
+    if not history_archive_path:
+        return
+    with open(history_archive_path, "a", encoding="utf-8") as f:
+        for m in messages:
+            f.write(json.dumps({"type": m.type, "content": m.content, "name": getattr(m, "name", None)}) + "\n")
+
+
 class BasicFunctions:
     def get_last_missing_slots(state, required_slots):
         return [slot.value for slot in required_slots if slot.value not in state['slots'].keys()]
 
     def get_last_function_message(outputs):
+        if outputs.get("last_function_message") is not None:
+            return outputs["last_function_message"]
         from langchain_core.messages import FunctionMessage
         return [m for m in outputs["messages"] if isinstance(m, FunctionMessage)][-1]
 
     def get_last_message_or_no_message(state):
         return state["messages"][-1] if len(state["messages"]) > 0 else "No message"
+
+    def get_last_ai_message(state):
+        if state.get("last_ai_message") is not None:
+            return state["last_ai_message"]
+        from langchain_core.messages import AIMessage
+        return next((m for m in reversed(state["messages"]) if isinstance(m, AIMessage)), None)
+
+    def get_pending_slot(state):
+        """
+        The slot the bot is waiting for; derived from the last message for states without the index
+        """
+        if "pending_slot" in state:
+            return state["pending_slot"]
+        from langchain_core.messages import FunctionMessage
+        last_message = BasicFunctions.get_last_message_or_no_message(state)
+        return last_message.name if isinstance(last_message, FunctionMessage) else None
+
+    def add_message(state, message):
+        """
+        Appends the message, updates the history index and moves messages beyond the history window to the archive
+        """
+        from langchain_core.messages import AIMessage, FunctionMessage
+        state["messages"].append(message)
+        if isinstance(message, FunctionMessage):
+            state["last_function_message"] = message
+            state["pending_slot"] = message.name
+        else:
+            state["pending_slot"] = None
+            if isinstance(message, AIMessage):
+                state["last_ai_message"] = message
+
+        overflow = len(state["messages"]) - history_window
+        if history_window > 0 and overflow > 0:
+            archive_messages(state["messages"][:overflow])
+            del state["messages"][:overflow]
+            state["archived_messages"] = state.get("archived_messages", 0) + overflow
+
+    def history_update(state) -> dict:
+        return {
+            "messages": state["messages"],
+            "pending_slot": BasicFunctions.get_pending_slot(state),
+            "last_ai_message": state.get("last_ai_message"),
+            "last_function_message": state.get("last_function_message"),
+            "archived_messages": state.get("archived_messages", 0),
+        }
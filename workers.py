@@ -0,0 +1,187 @@
+"""
+Pre-fork worker mode for the chat server: python workers.py [number of workers]
+
+The master loads the pizza menu, its name index and the knowledge snapshot once, then forks the workers, which
+inherit them copy-on-write. No thread is started before the fork: the backend calls of the preload run inline in the
+main thread and the menu is stored in the cache without a refresh thread. Menu refreshes are done by the master only:
+it publishes the menu together with the built index to a snapshot file in shared memory, the workers' menu caches
+reload from that file instead of calling the Pizza API and re-indexing. A reloaded menu is parsed into a private copy
+in every worker, only the menu loaded before the fork is shared.
+
+The master opens the listening socket before the fork and every worker serves `server.create_app()` on it, accepting
+the client connections directly; the master does not touch the traffic. Any worker can serve any session: the sessions
+live in the SQLite checkpointer shared by the workers (PIZZABOT_CHECKPOINTER=sqlite is the default in this mode) and
+the checkpoints of a turn are committed when it ends. Routing is therefore not sticky, the turns of one session
+must be sent one after the other (as the chat clients do), concurrent turns of a session in two workers are not
+serialized.
+"""
+import asyncio
+import gc
+import json
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+from os import environ, path
+
+import utils
+from knowledge import get_knowledge
+from language import get_language_detector
+from utils import logger
+
+
+SHARED_DIR = "/dev/shm" if path.isdir("/dev/shm") else tempfile.gettempdir()
+
+
+def publish_menu(snapshot_path: str, menu: utils.PizzaMenu):
+    """
+    Writes the menu snapshot next to the current one and swaps it in atomically
+    """
+    tmp_path = f"{snapshot_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(menu.snapshot(), f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, snapshot_path)
+
+
+class SharedMenu:
+    """
+    Worker side of the menu snapshot, used as the loader of `utils.menu_cache`.
+
+    A snapshot older than `max_age` seconds is refused like a failed Pizza API call, so a worker does not
+    serve a menu past the stale limit of its cache when the master cannot refresh it
+    """
+
+    def __init__(self, snapshot_path: str, max_age: float = None):
+        self.snapshot_path = snapshot_path
+        self.max_age = max_age
+        self.loads = 0
+        self._version = None
+        self._menu = None
+
+    def __call__(self) -> utils.PizzaMenu:
+        stat = os.stat(self.snapshot_path)
+        if self.max_age is not None and time.time() - stat.st_mtime > self.max_age:
+            raise RuntimeError(f"Pizza menu snapshot is older than {self.max_age}s")
+        version = (stat.st_ino, stat.st_mtime_ns)
+        if version != self._version: # only parse snapshots the master has replaced
+            with open(self.snapshot_path, "rb") as f:
+                self._menu = utils.PizzaMenu.from_snapshot(json.loads(f.read()))
+            self._version = version
+            self.loads += 1
+        return self._menu
+
+
+class WorkerPool:
+    def __init__(self, workers: int, host: str = "0.0.0.0", port: int = 8000, shared_dir: str = SHARED_DIR):
+        self.workers = workers
+        self.host = host
+        self.port = port
+        self.run_dir = tempfile.mkdtemp(prefix=f"pizzabot-{os.getpid()}-", dir=shared_dir)
+        self.menu_snapshot = path.join(self.run_dir, "menu.json")
+        self.listener = None
+        self.pids = {}
+
+    def preload(self):
+        """
+        Everything loaded here is shared copy-on-write with the workers. Starts no thread, see `spawn`
+        """
+        with utils.resilience.inline():
+            menu = utils.fetch_pizza_menu()
+            get_knowledge()
+        utils.menu_cache.set(menu)
+        publish_menu(self.menu_snapshot, menu)
+        get_language_detector().load()
+        utils.http.close() # no pooled connections may be shared across the fork
+        gc.freeze() # keep the preloaded objects out of the collector so their pages stay shared
+
+    def listen(self):
+        """
+        The listening socket, inherited by the workers, which all accept on it
+        """
+        self.listener = socket.create_server((self.host, self.port), backlog=2048)
+        self.listener.set_inheritable(True)
+
+    def spawn(self, worker_index: int):
+        # a thread running at the fork may hold a lock (logging, an executor queue) that stays locked in the child
+        threads = [thread.name for thread in threading.enumerate() if thread is not threading.main_thread()]
+        if threads:
+            raise RuntimeError(f"Threads started before the fork: {', '.join(threads)}")
+        pid = os.fork()
+        if pid:
+            self.pids[pid] = worker_index
+            return
+        try:
+            self.run_worker()
+        finally:
+            os._exit(0)
+
+    def run_worker(self):
+        import uvicorn
+        from server import create_app
+
+        environ["PIZZABOT_WORKERS"] = str(self.workers)
+        cache = utils.menu_cache
+        cache.loader = SharedMenu(self.menu_snapshot, max_age=cache.ttl + cache.stale_ttl)
+        uvicorn.Server(uvicorn.Config(create_app(), log_level="warning")).run(sockets=[self.listener])
+
+    async def refresh_menu(self):
+        cache = utils.menu_cache
+        while True:
+            await asyncio.sleep(cache.ttl * cache.refresh_ahead)
+            try:
+                publish_menu(self.menu_snapshot, await asyncio.to_thread(utils.fetch_pizza_menu))
+            except Exception as e:
+                logger.error(f"Pizza menu refresh failed, workers keep the previous menu: {e}")
+
+    async def supervise(self, stopped: asyncio.Event):
+        while not stopped.is_set():
+            for pid in list(self.pids):
+                if os.waitpid(pid, os.WNOHANG)[0]:
+                    logger.error(f"Worker {self.pids.pop(pid)} exited, shutting down")
+                    stopped.set()
+            try:
+                await asyncio.wait_for(stopped.wait(), 1)
+            except asyncio.TimeoutError:
+                pass
+
+    async def serve(self):
+        stopped = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stopped.set)
+        refresh = asyncio.create_task(self.refresh_menu())
+        logger.info(f"Serving on {self.host}:{self.port} with {self.workers} workers")
+        await self.supervise(stopped)
+        refresh.cancel()
+
+    def run(self):
+        if environ.setdefault("PIZZABOT_CHECKPOINTER", "sqlite") != "sqlite":
+            logger.warning("Sessions are not shared by the workers, a session only works while its turns reach the same worker")
+        self.preload()
+        self.listen()
+        for worker_index in range(self.workers): # fork before the master starts any event loop or thread
+            self.spawn(worker_index)
+        self.listener.close() # only the workers accept
+        try:
+            asyncio.run(self.serve())
+        finally:
+            for pid in self.pids:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+            for pid in self.pids:
+                os.waitpid(pid, 0)
+            shutil.rmtree(self.run_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    WorkerPool(
+        int(sys.argv[1]) if len(sys.argv) > 1 else int(environ.get("PIZZABOT_WORKERS", os.cpu_count() or 1)),
+        host=environ.get("SERVER_HOST", "0.0.0.0"),
+        port=int(environ.get("SERVER_PORT", 8000)),
+    ).run()